@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Точность и задержка распознавания на размеченных изображениях: grab_helper.find_cube (каждый цвет),
+grab_helper.find_grabber_center, grab_helper.find_lines и scanner.read_qr_code.
+
+Запуск: python bench_accuracy.py [--truth test_images/ground_truth.json] [--recording out.frames ...]
+                                 [-n 20] [--tolerance 20] [--save baseline.json] [--baseline baseline.json]
+
+Разметка лежит рядом с изображениями (test_images/ground_truth.json), путь к изображению - относительно файла разметки:
+    "grabber/yellow.png": {"cubes": {"yellow": [556, 323]}, "grabber": null, "lines": 1, "qr": null}
+cubes - центры кубов по цветам, цвета, которых нет в cubes, на изображении отсутствуют; grabber - центр захвата
+или null, если его не видно; lines - сколько линий должна найти find_lines; qr - текст QR-кода или null.
+Разметка записи recording.FrameRecorder лежит в out.frames.json с номерами кадров вместо путей;
+неразмеченные кадры записи пропускаются.
+
+Для каждой функции выводятся среднее и 99-й перцентиль времени вызова, доля верных ответов, пропуски
+(объект есть, но не найден или найден дальше --tolerance пикселей), ложные срабатывания и ошибка центра в пикселях.
+--save сохраняет результат в JSON, --baseline сравнивает с сохранённым ранее; если верных ответов стало меньше,
+скрипт завершается с кодом 1.
+"""
+import argparse
+import contextlib
+import json
+import math
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import grab_helper
+import scanner
+from recording import FrameRecording
+
+
+class Score:
+    """
+    Результаты одной функции по всем изображениям
+    """
+
+    def __init__(self):
+        self.times = []
+        self.correct = 0
+        self.missed = 0
+        self.false = 0
+        self.errors = []
+
+    def point(self, found: tuple[int, int] | None, expected: tuple[int, int] | None, tolerance: float):
+        if expected is None:
+            if found is None:
+                self.correct += 1
+            else:
+                self.false += 1
+            return
+        if found is None:
+            self.missed += 1
+            return
+        error = math.dist(found, expected)
+        self.errors.append(error)
+        if error <= tolerance:
+            self.correct += 1
+        else:
+            self.missed += 1
+
+    def value(self, found, expected):
+        if found == expected:
+            self.correct += 1
+        elif expected is None:
+            self.false += 1
+        else:
+            self.missed += 1
+
+    def summary(self) -> dict:
+        times = np.array(self.times) * 1000
+        total = self.correct + self.missed + self.false
+        return {
+            "calls": len(self.times),
+            "mean_ms": float(times.mean()),
+            "p99_ms": float(np.percentile(times, 99)),
+            "total": total,
+            "correct": self.correct,
+            "missed": self.missed,
+            "false": self.false,
+            "mean_error_px": float(np.mean(self.errors)) if self.errors else None,
+            "max_error_px": float(np.max(self.errors)) if self.errors else None,
+        }
+
+
+def load_cases(truth_path: str, recordings: list[str]):
+    """
+    :return: (имя, кадр BGR, разметка) для каждого размеченного изображения и кадра записи
+    """
+    with open(truth_path) as f:
+        truth = json.load(f)
+    directory = os.path.dirname(truth_path)
+    for name, label in truth.items():
+        image = cv2.imread(os.path.join(directory, name))
+        if image is None:
+            raise FileNotFoundError(os.path.join(directory, name))
+        yield name, image, label
+
+    for path in recordings:
+        with open(path + ".json") as f:
+            truth = json.load(f)
+        recording = FrameRecording(path)
+        for index, label in truth.items():
+            yield f"{os.path.basename(path)}#{index}", np.array(recording.images[int(index)]), label
+
+
+def timed(score: Score, n: int, function, *args):
+    result = function(*args)
+    for _ in range(n):
+        start = time.perf_counter()
+        function(*args)
+        score.times.append(time.perf_counter() - start)
+    return result
+
+
+def evaluate(cases, n: int, tolerance: float, verbose: bool) -> dict[str, Score]:
+    scores = {f"find_cube[{color}]": Score() for color in grab_helper.COLORS}
+    scores.update(find_grabber_center=Score(), find_lines=Score(), read_qr_code=Score())
+
+    for name, image, label in cases:
+        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        cube_area = grab_helper.get_area(hsv.shape[1], hsv.shape[0], grab_helper.CUBE_FIND_AREA)
+        grabber_area = grab_helper.get_area(hsv.shape[1], hsv.shape[0], grab_helper.GRABBER_FIND_AREA)
+        report = []
+
+        for color in grab_helper.COLORS:
+            score = scores[f"find_cube[{color}]"]
+            x, y, _ = timed(score, n, grab_helper.find_cube, hsv, cube_area, color)
+            expected = label["cubes"].get(color)
+            score.point(None if x is None else (x, y), expected, tolerance)
+            if x is not None or expected is not None:
+                report.append(f"{color} {(x, y) if x is not None else None} / {expected}")
+
+        score = scores["find_grabber_center"]
+        center = timed(score, n, grab_helper.find_grabber_center, hsv, grabber_area)
+        score.point(None if center == (-1, -1) else center, label["grabber"], tolerance)
+        report.append(f"grabber {center} / {label['grabber']}")
+
+        score = scores["find_lines"]
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):     # find_lines печатает площади
+            lines = timed(score, n, grab_helper.find_lines, hsv)
+        score.value(len(lines), label["lines"])
+        report.append(f"lines {len(lines)} / {label['lines']}")
+
+        score = scores["read_qr_code"]
+        code = timed(score, n, scanner.read_qr_code, image)
+        score.value(code, label["qr"])
+        report.append(f"qr {code} / {label['qr']}")
+
+        if verbose:
+            print(f"{name:<28} " + ", ".join(report))
+
+    return scores
+
+
+def compare(results: dict, baseline: dict) -> bool:
+    """
+    :return: True, если ни у одной функции не стало меньше верных ответов
+    """
+    ok = True
+    print("\nagainst baseline:")
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None:
+            print(f"{name:<20} new")
+            continue
+        regression = result["correct"] < old["correct"]
+        ok &= not regression
+        print(f"{name:<20} mean {old['mean_ms']:7.3f} -> {result['mean_ms']:7.3f} ms "
+              f"({(result['mean_ms'] / old['mean_ms'] - 1) * 100:+5.0f}%)  "
+              f"correct {old['correct']} -> {result['correct']}{'  REGRESSION' if regression else ''}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--truth", default="test_images/ground_truth.json")
+    parser.add_argument("--recording", nargs="*", default=[], help="записи recording.FrameRecorder с разметкой .json")
+    parser.add_argument("-n", type=int, default=20, help="повторов каждого вызова для замера времени")
+    parser.add_argument("--tolerance", type=float, default=20, help="допустимая ошибка центра, пикселей")
+    parser.add_argument("--save", help="сохранить результат в JSON")
+    parser.add_argument("--baseline", help="сравнить с результатом, сохранённым через --save")
+    parser.add_argument("-v", "--verbose", action="store_true", help="найденное и ожидаемое для каждого изображения")
+    args = parser.parse_args()
+
+    scores = evaluate(load_cases(args.truth, args.recording), args.n, args.tolerance, args.verbose)
+    results = {name: score.summary() for name, score in scores.items()}
+
+    for name, r in results.items():
+        error = "" if r["mean_error_px"] is None else \
+            f"  error mean {r['mean_error_px']:5.1f} max {r['max_error_px']:5.1f} px"
+        print(f"{name:<20} mean {r['mean_ms']:7.3f} ms  p99 {r['p99_ms']:7.3f} ms  "
+              f"correct {r['correct']}/{r['total']}  missed {r['missed']}  false {r['false']}{error}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            if not compare(results, json.load(f)):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Задержка от захвата кадра до решения по нему в визуальном цикле.
+
+Запуск: python bench_camera.py [--fps 30] [--duration 5] [--size 640x480]
+        python bench_camera.py --source 0 [--preview-fps 10]
+
+Процесс-«камера» публикует синтетические кадры с кубом в FrameRing с частотой --fps, как Camera.capture_loop.
+Потребитель на каждом кадре ищет куб (grab_helper.find_cube по CUBE_FIND_AREA) двумя способами:
+  poll - как прежний BTDriver.take_item: опрос времени кадра с time.sleep(0.05);
+  wait - как Camera.frames: ожидание нового поколения на условии FrameRing.
+Выводятся p50/p99 задержки (время решения - время захвата) и доля обработанных кадров.
+
+С --source замеряется настоящий Camera (индекс камеры или видеофайл) без окна и с окном:
+фактическая частота захвата и задержка кадра до потребителя, который перебирает Camera.frames.
+"""
+import argparse
+import multiprocessing
+import time
+
+import cv2
+import numpy as np
+
+from camera import Camera
+from frame_ring import FrameRing
+import grab_helper
+
+
+def make_image(shape: tuple[int, int, int], shift: int) -> np.ndarray:
+    image = np.full(shape, 90, dtype=np.uint8)
+    x = shape[1] // 2 - 40 + shift % 40
+    cv2.rectangle(image, (x, shape[0] // 2 - 40), (x + 80, shape[0] // 2 + 40), (200, 120, 20), -1)   # синий
+    return image
+
+
+def capture(frames: FrameRing, fps: float, duration: float, stop):
+    images = [make_image(frames.shape, i) for i in range(40)]
+    start = time.time()
+    i = 0
+    while not stop.is_set() and time.time() - start < duration:
+        next_time = start + i / fps
+        time.sleep(max(0.0, next_time - time.time()))
+        image = images[i % len(images)]
+        slot = frames.begin_write()
+        if slot is not None:
+            np.copyto(frames.images[slot], image)
+            frames.write_hsv(slot, image)
+            frames.publish(slot, time.time())
+        i += 1
+
+
+def consume(frames: FrameRing, mode: str, duration: float, area) -> tuple[list[float], int]:
+    latencies = []
+    found = 0
+    generation = frames.generation
+    end = time.time() + duration
+    while time.time() < end:
+        if mode == "poll":
+            if frames.generation == generation:
+                time.sleep(0.05)
+                continue
+            frame = frames.pin_latest()
+        else:
+            frame = frames.pin_after(generation, 0.5)
+            if frame is None:
+                continue
+        with frame:
+            generation = frame.generation
+            cx, cy, rot = grab_helper.find_cube(frame.ensure_hsv(area), area, "blue")
+            latencies.append(time.time() - frame.time)
+            found += cx is not None
+    return latencies, found
+
+
+def measure_camera(source: int | str, display: bool, preview_fps: float, duration: float):
+    camera = Camera(source, None, display=display, preview_fps=preview_fps)
+    try:
+        latencies = []
+        start = time.time()
+        generation = camera.frame_generation
+        for frame in camera.frames(timeout=2):
+            latencies.append(time.time() - frame.time)
+            if time.time() - start >= duration:
+                break
+        fps = (camera.frame_generation - generation) / (time.time() - start)
+    finally:
+        camera.release()
+
+    latencies = np.array(latencies) * 1000
+    print(f"camera {'display' if display else 'headless':<8} capture {fps:6.1f} FPS  "
+          f"frame latency p50 {np.percentile(latencies, 50):6.2f} ms  p99 {np.percentile(latencies, 99):6.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fps", type=float, default=30, help="частота кадров камеры")
+    parser.add_argument("--duration", type=float, default=5, help="длительность каждого замера, с")
+    parser.add_argument("--size", default="640x480", help="размер кадра ШxВ")
+    parser.add_argument("--source", help="индекс камеры или видеофайл для замера Camera")
+    parser.add_argument("--preview-fps", type=float, default=Camera.PREVIEW_FPS)
+    args = parser.parse_args()
+
+    if args.source is not None:
+        source = int(args.source) if args.source.isdigit() else args.source
+        for display in (False, True):
+            measure_camera(source, display, args.preview_fps, args.duration)
+        return
+
+    width, height = map(int, args.size.split("x"))
+    area = grab_helper.get_area(width, height, grab_helper.CUBE_FIND_AREA)
+
+    for mode in ("poll", "wait"):
+        frames = FrameRing((height, width, 3))
+        roi = frames.register_roi(area)
+        stop = multiprocessing.Event()
+        camera = multiprocessing.Process(target=capture, args=(frames, args.fps, args.duration + 1, stop))
+        camera.start()
+        frames.wait(0, 2)
+
+        latencies, found = consume(frames, mode, args.duration, area)
+        stop.set()
+        camera.join()
+        frames.unregister_roi(roi)
+        frames.unlink()
+
+        latencies = np.array(latencies) * 1000
+        print(f"{mode:<5} frame-to-decision p50 {np.percentile(latencies, 50):6.2f} ms  "
+              f"p99 {np.percentile(latencies, 99):6.2f} ms  "
+              f"processed {len(latencies) / (args.fps * args.duration) * 100:5.1f}% of frames  "
+              f"cube found in {found}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Переходная характеристика регулятора движения вдоль стены на симулированном роботе.
+
+Запуск: python bench_controller.py [--step 6] [--duration 12] [--rate 20]
+
+Робот едет вдоль стены со скоростью SerialRobot._speed (и быстрее, --speeds), начиная в --step см от нужного
+расстояния. Сравниваются старый алгоритм watcher'а (10 сэмплов, производная по номеру сэмпла, ожидание эха
+после каждой команды), WallFollowController с коэффициентами по умолчанию, с прежними (d=90, окно 0.9 с)
+и с коэффициентами из аргументов.
+Выводятся перерегулирование, время установления (ошибка < 1 см), число переходов ошибки через ноль и СКО ошибки.
+"""
+import argparse
+import math
+import random
+
+import numpy as np
+
+from controllers import Controller, WallFollowController
+import telemetry
+
+
+class CorridorPlant:
+    """
+    Робот вдоль стены: коррекция V поворачивает его со скоростью, пропорциональной V,
+    расстояние меняется как speed * sin(курс)
+    """
+
+    TURN_GAIN = 1 / 2000    # рад/с на единицу V
+
+    def __init__(self, distance: float, speed: float, noise: float = 0.3):
+        self.distance = distance
+        self.speed = speed
+        self.noise = noise
+        self.heading = 0.0
+        self.correction = 0
+
+    def step(self, dt: float):
+        self.heading += self.correction * self.TURN_GAIN * dt
+        self.distance += self.speed * math.sin(self.heading) * dt
+
+    def measure(self) -> int:
+        return int(round((self.distance + random.gauss(0, self.noise)) * 10))
+
+
+class LegacyWallFollow(Controller):
+    """
+    Алгоритм прежнего SerialRobot.watcher: вызывается на каждый пакет телеметрии, раз в 0.1 с
+    кладёт ошибку в буфер из 10 значений, производная - разность крайних значений буфера
+    """
+
+    command_key = "V"
+    period = 0.0
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._buffer = []
+        self._last_correct = 0
+        self._found = 0
+        self._previous = 0
+
+    def update(self, t: float, samples: np.ndarray) -> int | None:
+        if len(samples) == 0 or t - self._last_correct < 0.1:
+            return None
+        distance = samples["values"][-1][1] / 10
+        self._found += distance < 60
+        if self._found <= 3:
+            return None
+        error = 16 - distance
+        self._buffer.append(error)
+        if len(self._buffer) > 10:
+            del self._buffer[0]
+        result = None
+        if len(self._buffer) >= 10 and self._last_correct != 0:
+            correction = error * 250 + (self._buffer[-1] - self._buffer[0]) * 100
+            if correction != self._previous:
+                result = int(correction)
+            self._previous = correction
+        self._last_correct = t
+        return result
+
+
+def simulate(controller: Controller, speed: float, step: float, duration: float, rate: float,
+             blocking: bool, latency: float = 0.005, sim_dt: float = 0.001) -> dict:
+    plant = CorridorPlant(16 + step, speed)
+    controller.reset()
+
+    pending = []            # (время применения, коррекция)
+    blocked_until = 0.0
+    samples = []
+    next_sample = 0.0
+    next_tick = 0.0
+    seq = 0
+    errors = []
+
+    for i in range(int(duration / sim_dt)):
+        t = i * sim_dt
+        plant.step(sim_dt)
+        while pending and pending[0][0] <= t:
+            plant.correction = pending.pop(0)[1]
+
+        if t >= next_sample:
+            seq += 1
+            record = np.zeros(1, dtype=telemetry.RECORD_DTYPE)
+            record["time"], record["seq"] = t, seq
+            record["values"][0][1] = plant.measure()
+            samples.append(record)
+            next_sample += 1 / rate
+            new_sample = True
+        else:
+            new_sample = False
+
+        # прежний watcher просыпался на каждый пакет и после команды ждал эха; новый - строго по периоду
+        tick = new_sample if controller.period == 0 else t >= next_tick
+        if tick and t >= blocked_until:
+            next_tick += controller.period
+            batch = np.concatenate(samples) if samples else np.empty(0, dtype=telemetry.RECORD_DTYPE)
+            samples.clear()
+            output = controller.update(t, batch)
+            if output is not None:
+                pending.append((t + latency, output))
+                if blocking:
+                    blocked_until = t + 2 * latency
+
+        errors.append(plant.distance - 16)
+
+    errors = np.array(errors)
+    outside = np.flatnonzero(np.abs(errors) >= 1)
+    settling = (outside[-1] + 1) * sim_dt if len(outside) else 0.0
+    crossings = np.count_nonzero(np.diff(np.sign(errors)) != 0)
+    overshoot = max(0.0, float(-errors.min() if step > 0 else errors.max()))
+    return {
+        "overshoot": overshoot,
+        "settling": settling if settling < duration else float("inf"),
+        "crossings": crossings,
+        "rms": float(np.sqrt(np.mean(errors ** 2))),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--step", type=float, default=6, help="начальное отклонение от нужного расстояния, см")
+    parser.add_argument("--duration", type=float, default=12, help="длительность симуляции, с")
+    parser.add_argument("--rate", type=float, default=20, help="частота телеметрии, Гц")
+    parser.add_argument("--speeds", type=float, nargs="+", default=[1, 1.5, 2], help="множители скорости")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--p-gain", type=float, default=250, help="p_gain настраиваемого WallFollowController")
+    parser.add_argument("--d-gain", type=float, default=200, help="d_gain настраиваемого WallFollowController")
+    parser.add_argument("--derivative-window", type=float, default=0.3)
+    args = parser.parse_args()
+
+    tuned = f"tuned p={args.p_gain:g} d={args.d_gain:g}"
+    base_speed = 24.7436
+    for multiplier in args.speeds:
+        for name, controller, blocking in (
+                ("legacy watcher", LegacyWallFollow(), True),
+                ("default gains", WallFollowController(), False),
+                ("previous gains", WallFollowController(d_gain=90, derivative_window=0.9), False),
+                (tuned, WallFollowController(p_gain=args.p_gain, d_gain=args.d_gain,
+                                             derivative_window=args.derivative_window), False)):
+            random.seed(args.seed)
+            r = simulate(controller, base_speed * multiplier, args.step, args.duration, args.rate, blocking)
+            print(f"speed x{multiplier:<4} {name:<20} overshoot {r['overshoot']:5.2f} cm  "
+                  f"settling {r['settling']:6.2f} s  crossings {r['crossings']:3d}  rms {r['rms']:5.2f} cm")
+
+
+if __name__ == "__main__":
+    main()
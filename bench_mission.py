@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Время миссии на эмуляторе платы: маршруты BTDriver.go_to, подъезд и захват куба BTDriver.take_item
+(синтетическая камера из bench_servo) и BTDriver.put на полку, как e1 в main.py.
+
+Запуск: python bench_mission.py [--location locations/regional.json] [--points cube0 cube1 cube2]
+
+Эмулятор выполняет команды с настоящими длительностями (time_scale=1) и шлёт телеметрию 20 раз в секунду.
+Выводится время каждого этапа и всей миссии.
+"""
+import argparse
+import contextlib
+import os
+import time
+
+from bench_servo import SimCamera
+from driver import BTDriver
+from emulator import VirtualArduino
+from navigation import Navigator
+from serial_robot import SerialRobot
+
+CUBE = (40, 0)      # куб перед роботом в точке захвата: вперёд, направо, см
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--location", default="locations/regional.json")
+    parser.add_argument("--points", nargs="+", default=["cube0", "cube1", "cube2"])
+    args = parser.parse_args()
+
+    stages = []
+    with VirtualArduino(telemetry_rate=20) as board, open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(devnull):     # SerialRobot и BTDriver печатают каждую команду
+            robot = SerialRobot(board.port)
+            try:
+                camera = SimCamera(board, CUBE)
+                driver = BTDriver(robot, Navigator(args.location, start="spawn"), camera)
+                robot.switch_rangefinder(SerialRobot.RANGEFINDER_FORWARD, True)
+
+                def stage(name: str, action, *action_args):
+                    start = time.perf_counter()
+                    action(*action_args)
+                    stages.append((name, time.perf_counter() - start))
+
+                for shelf, point in enumerate(args.points):
+                    stage(f"go_to {point}", driver.go_to, point)
+                    board.place(0, 0, 0)    # эмулятор не знает стен: куб ставится перед роботом
+                    stage("take_item", driver.take_item, "blue", True)
+                    stage("go_to storage", driver.go_to, "storage")
+                    stage("put", driver.put, shelf % 2 + 1)
+                stage("go_to spawn", driver.go_to, "spawn")
+            finally:
+                robot.release()
+
+    for name, elapsed in stages:
+        print(f"{name:<16} {elapsed:6.2f} s")
+    print(f"{'total':<16} {sum(elapsed for _, elapsed in stages):6.2f} s")
+
+
+if __name__ == "__main__":
+    main()
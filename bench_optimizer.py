@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Что дают проходы BTDriver.optimize на маршрутах локаций: число команд и оценка времени (BTDriver.estimate_time)
+без оптимизации, только со склейкой поворотов (как было до конвейера проходов) и со всеми проходами.
+
+Запуск: python bench_optimizer.py [locations/*.json ...] [-v]
+
+-v печатает команды каждого маршрута, который изменился.
+"""
+import argparse
+import glob
+
+from driver import BTDriver
+from navigation import Navigator
+
+ROTATIONS_ONLY = ("_fold_rotations", )
+
+
+def parse_commands(commands: list[str]) -> tuple:
+    return tuple((cmd_key, tuple(cmd_args)) for cmd_key, cmd_args in map(BTDriver._parse_command, commands))
+
+
+def optimized(route: tuple, passes: tuple[str, ...] = BTDriver.OPTIMIZATION_PASSES) -> tuple:
+    result = BTDriver.optimize([(cmd_key, list(cmd_args)) for cmd_key, cmd_args in route], passes)
+    return tuple((cmd_key, tuple(cmd_args)) for cmd_key, cmd_args in result)
+
+
+def optimized_time(route: tuple) -> float:
+    return BTDriver.estimate_time(optimized(route))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("locations", nargs="*", default=sorted(glob.glob("locations/*.json")))
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    for path in args.locations:
+        # те же маршруты, что выберет BTDriver, но без оптимизации; таблица не пишется в кэш
+        routes = Navigator(path, compiler=parse_commands, cost=optimized_time).compile_routes()
+        totals = [0, 0, 0, 0.0, 0.0, 0.0]
+        print(f"{path}:")
+        for (source, target), (raw, _) in sorted(routes.items()):
+            variants = (raw, optimized(raw, ROTATIONS_ONLY), optimized(raw))
+            counts = [len(route) for route in variants]
+            times = [BTDriver.estimate_time(route) for route in variants]
+            for i in range(3):
+                totals[i] += counts[i]
+                totals[3 + i] += times[i]
+            print(f"  {source:>8} -> {target:<8} commands {counts[0]:3d} / {counts[1]:3d} / {counts[2]:3d}  "
+                  f"estimate {times[0]:5.1f} / {times[1]:5.1f} / {times[2]:5.1f} s  "
+                  f"saved {counts[1] - counts[2]:2d} commands {times[1] - times[2]:4.1f} s")
+            if args.verbose and variants[1] != variants[2]:
+                print(f"{'':24}{variants[1]}\n{'':24}{variants[2]}")
+        print(f"  {'total':>20} commands {totals[0]:3d} / {totals[1]:3d} / {totals[2]:3d}  "
+              f"estimate {totals[3]:5.1f} / {totals[4]:5.1f} / {totals[5]:5.1f} s  "
+              f"saved {totals[1] - totals[2]:2d} commands {totals[4] - totals[5]:4.1f} s")
+    print("(без оптимизации / только повороты / все проходы)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Порядок сбора кубов по MissionPlanner против порядка из списка (как в e1), оценка и время на эмуляторе,
+а также точный поиск против эвристики на случайных наборах целей.
+
+Запуск: python bench_planner.py [--location locations/regional_graph.json] [--no-emulator]
+
+На эмуляторе миссия выполняется BTDriver.run_mission с синтетической камерой из bench_servo, которая рисует
+только синий куб: цели другого цвета не находятся и пропускаются (MissionPlanner.skip).
+"""
+import argparse
+import contextlib
+import os
+import random
+import time
+
+from bench_servo import SimCamera
+from driver import BTDriver
+from emulator import VirtualArduino
+from mission import MissionPlan, MissionPlanner, PickupTarget
+from navigation import Navigator
+from serial_robot import SerialRobot
+
+CUBE = (40, 0)      # куб перед роботом в точке цели: вперёд, направо, см
+
+SCENARIOS = {
+    "three cubes": [PickupTarget("cube2", "blue", 1), PickupTarget("cube0", "blue", 2),
+                    PickupTarget("cube1", "blue", 1)],
+    "one missing": [PickupTarget("cube2", "blue", 1), PickupTarget("cube0", "green", 2),
+                    PickupTarget("cube1", "blue", 1)],
+}
+
+
+def make_navigator(path: str) -> Navigator:
+    navigator = Navigator(path, start="spawn")
+    navigator.set_compiler(BTDriver.compile_commands, BTDriver.ROUTES_VERSION, BTDriver.estimate_time)
+    return navigator
+
+
+def run(path: str, plan: MissionPlan) -> tuple[float, int]:
+    """
+    :return: время миссии на эмуляторе, сколько целей выполнено
+    """
+    with VirtualArduino(telemetry_rate=20) as board, open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(devnull):     # SerialRobot и BTDriver печатают каждую команду
+            robot = SerialRobot(board.port)
+            try:
+                navigator = make_navigator(path)
+                driver = BTDriver(robot, navigator, SimCamera(board, CUBE))
+
+                go_to = driver.go_to
+
+                def go_to_and_place(wp_name: str):
+                    go_to(wp_name)
+                    board.place(0, 0, 0)    # эмулятор не знает стен: куб ставится перед роботом
+
+                driver.go_to = go_to_and_place
+                robot.switch_rangefinder(SerialRobot.RANGEFINDER_FORWARD, True)
+                start = time.perf_counter()
+                done = driver.run_mission(plan, MissionPlanner(navigator), servo=True)
+                return time.perf_counter() - start, len(done)
+            finally:
+                robot.release()
+
+
+def random_targets(n: int) -> list[PickupTarget]:
+    points = ["cube0", "cube1", "cube2"]
+    destinations = ["storage", "spawn"]
+    return [PickupTarget(random.choice(points), "blue", 1, random.choice(destinations)) for _ in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--location", default="locations/regional_graph.json")
+    parser.add_argument("--no-emulator", action="store_true", help="только оценки")
+    args = parser.parse_args()
+
+    planner = MissionPlanner(make_navigator(args.location))
+    for name, targets in SCENARIOS.items():
+        print(f"{name}:")
+        fixed = MissionPlan("spawn", targets, "spawn", planner.estimate("spawn", targets, "spawn"))
+        planned = planner.plan(targets, start="spawn")
+        for kind, plan in (("listed", fixed), ("planned", planned)):
+            line = f"  {kind:<8} {' -> '.join(t.waypoint for t in plan.targets):<24} estimate {plan.estimate:6.1f} s"
+            if not args.no_emulator:
+                elapsed, done = run(args.location, plan)
+                line += f"  emulator {elapsed:6.1f} s, {done} cubes"
+            print(line)
+
+    # точный поиск против эвристики; пункт назначения у целей разный, поэтому порядок важен
+    random.seed(0)
+    print("random targets, destinations storage/spawn:")
+    for n in (4, 7, 10, 14):
+        results = []
+        for _ in range(5):
+            targets = random_targets(n)
+            start = time.perf_counter()
+            heuristic = planner._improve("spawn", planner._nearest("spawn", targets), "spawn")
+            heuristic_time = time.perf_counter() - start
+            line = [planner.estimate("spawn", targets, "spawn"), planner.estimate("spawn", heuristic, "spawn"),
+                    heuristic_time, None, None]
+            if n <= 10:
+                start = time.perf_counter()
+                exact = planner._exact("spawn", targets, "spawn")
+                line[4] = time.perf_counter() - start
+                line[3] = planner.estimate("spawn", exact, "spawn")
+            results.append(line)
+        listed = sum(r[0] for r in results) / len(results)
+        heuristic = sum(r[1] for r in results) / len(results)
+        heuristic_ms = max(r[2] for r in results) * 1000
+        text = f"  {n:2d} targets  listed {listed:6.1f} s  heuristic {heuristic:6.1f} s ({heuristic_ms:5.1f} ms)"
+        if n <= 10:
+            exact = sum(r[3] for r in results) / len(results)
+            exact_ms = max(r[4] for r in results) * 1000
+            text += f"  exact {exact:6.1f} s ({exact_ms:6.1f} ms)"
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
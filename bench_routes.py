@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Время миссии по маршрутам дерева локации против маршрутов по графу с перекрёстными рёбрами.
+
+Запуск: python bench_routes.py [--tree locations/regional.json] [--graph locations/regional_graph.json]
+                               [--emulator] [--time-scale 1]
+
+Для каждой миссии (последовательности точек) выводится число команд и оценка времени Navigator.route_time
+(BTDriver.estimate_time по рёбрам). С --emulator миссия выполняется BTDriver.go_to на эмуляторе платы
+и выводится измеренное время; путь W эмулятор считает грубо (только по расстоянию до стены впереди).
+"""
+import argparse
+import contextlib
+import os
+import sys
+import time
+
+from driver import BTDriver
+from emulator import VirtualArduino
+from navigation import Navigator
+from serial_robot import SerialRobot
+
+MISSIONS = {
+    "e1": ("spawn", "cube0", "storage", "cube1", "storage", "cube2", "storage", "spawn"),
+    "collect": ("spawn", "cube0", "cube1", "cube2", "storage", "spawn"),
+}
+
+
+def estimate(path: str, mission: tuple[str, ...]) -> tuple[int, float]:
+    """
+    :return: команд и оценка времени миссии, с
+    """
+    navigator = Navigator(path, start=mission[0])
+    navigator.set_compiler(BTDriver.compile_commands, BTDriver.ROUTES_VERSION, BTDriver.estimate_time)
+    commands = 0
+    total = 0.0
+    for target in mission[1:]:
+        commands += len(navigator.find_route(target))
+        total += navigator.route_time(target)
+        navigator.set_current_waypoint(target)
+    return commands, total
+
+
+def run(path: str, mission: tuple[str, ...], time_scale: float) -> float:
+    """
+    :return: время выполнения миссии на эмуляторе, с
+    """
+    with VirtualArduino(telemetry_rate=20, time_scale=time_scale) as board, open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(devnull):     # SerialRobot и BTDriver печатают каждую команду
+            robot = SerialRobot(board.port)
+            try:
+                driver = BTDriver(robot, Navigator(path, start=mission[0]), None)
+                start = time.perf_counter()
+                for target in mission[1:]:
+                    driver.go_to(target)
+                return time.perf_counter() - start
+            finally:
+                robot.release()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tree", default="locations/regional.json")
+    parser.add_argument("--graph", default="locations/regional_graph.json")
+    parser.add_argument("--emulator", action="store_true", help="выполнить миссии на эмуляторе платы")
+    parser.add_argument("--time-scale", type=float, default=1, help="множитель длительностей команд эмулятора")
+    args = parser.parse_args()
+
+    for name, mission in MISSIONS.items():
+        print(f"{name}: {' -> '.join(mission)}")
+        for kind, path in (("tree", args.tree), ("graph", args.graph)):
+            commands, total = estimate(path, mission)
+            line = f"  {kind:<6} {commands:3d} commands  estimate {total:6.1f} s"
+            if args.emulator:
+                line += f"  emulator {run(path, mission, args.time_scale):6.1f} s"
+            print(line)
+            sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
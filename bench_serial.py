@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк задержек команд SerialRobot на эмуляторе платы (emulator.VirtualArduino).
+
+Запуск: python bench_serial.py [-n 200] [--rate 20] [--time-scale 0] [--window 0]
+
+Для каждой команды считаются задержка от send_command до прихода на плату (dispatch), задержка до подтверждения отправки ('+cmd') и до выполнения ('OK'),
+p50/p99 в миллисекундах и количество команд в секунду.
+Пакетные замеры (burst) отправляют n команд не дожидаясь подтверждений и ждут выполнения всех -
+пропускная способность протокола (--window 0 - текущая прошивка, N - оконный протокол).
+"""
+import argparse
+import time
+
+import numpy as np
+
+from emulator import VirtualArduino
+from serial_robot import SerialRobot
+
+
+def report(name: str, samples: list[float]):
+    if not samples:
+        print(f"{name:<24} no samples")
+        return
+    ms = np.array(samples) * 1000
+    print(f"{name:<24} n={len(ms):<5} p50={np.percentile(ms, 50):8.3f} ms  p99={np.percentile(ms, 99):8.3f} ms  "
+          f"{len(ms) / (ms.sum() / 1000):8.1f} cmd/s")
+
+
+def measure_raw(robot: SerialRobot, command: str, n: int) -> tuple[list[float], list[float]]:
+    """
+    Отправляет команду n раз и возвращает задержки до '+cmd' и до 'OK' (если команда его присылает)
+    """
+    completing = command[0] in VirtualArduino.COMPLETING_COMMANDS
+    sent, completed = [], []
+    for _ in range(n):
+        future = robot.send_command(command, await_sending=False)
+        if future.wait_sent(5):
+            sent.append(future.sent_time - future.created_time)
+        if completing and future.wait(5):
+            completed.append(future.completed_time - future.created_time)
+    return sent, completed
+
+
+def measure_burst(robot: SerialRobot, commands: list[str], n: int) -> tuple[float, int]:
+    """
+    Отправляет n команд по кругу из commands без ожидания и ждёт выполнения всех
+    :return: (команд в секунду, сколько команд прервано или потеряно)
+    """
+    t = time.perf_counter()
+    futures = [robot.send_command(commands[i % len(commands)], await_sending=False) for i in range(n)]
+    for future in futures:
+        future.wait(5)
+    return n / (time.perf_counter() - t), sum(f.interrupted or not f.done() for f in futures)
+
+
+def measure_dispatch(robot: SerialRobot, board: VirtualArduino, command: str, n: int) -> list[float]:
+    """
+    Задержка от вызова send_command до прихода команды на плату
+    """
+    result = []
+    for _ in range(n):
+        received = len(board.received)
+        t = time.perf_counter()
+        future = robot.send_command(command, await_sending=False)
+        deadline = t + 10
+        while len(board.received) == received and time.perf_counter() < deadline:
+            time.sleep(0.0001)
+        if len(board.received) > received:
+            result.append(board.received[received][0] - t)
+        future.wait_sent(5)
+    return result
+
+
+def measure_call(n: int, action) -> list[float]:
+    result = []
+    for i in range(n):
+        t = time.perf_counter()
+        action(i)
+        result.append(time.perf_counter() - t)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", type=int, default=200, help="повторов каждой команды")
+    parser.add_argument("--rate", type=float, default=20, help="частота телеметрии эмулятора, Гц")
+    parser.add_argument("--time-scale", type=float, default=0, help="множитель длительностей команд эмулятора")
+    parser.add_argument("--window", type=int, default=0, help="окно протокола SerialRobot, 0 - текущая прошивка")
+    args = parser.parse_args()
+
+    with VirtualArduino(telemetry_rate=args.rate, time_scale=args.time_scale) as board:
+        robot = SerialRobot(board.port, window=args.window)
+
+        results = {}
+        results["dispatch L1"] = measure_dispatch(robot, board, "L1", args.n)
+        results["send_command L1 ack"], _ = measure_raw(robot, "L1", args.n)
+        results["send_command H2 ack"], results["send_command H2 done"] = measure_raw(robot, "H2", args.n)
+        results["go(1)"] = measure_call(args.n, lambda i: robot.go(1))
+        results["rotate(1)"] = measure_call(args.n, lambda i: robot.rotate(1))
+        results["set_hand_angle"] = measure_call(args.n, lambda i: robot.set_hand_angle(100 + i % 2 * 10))
+        bursts = {
+            "burst L1": measure_burst(robot, ["L1"], args.n),
+            "burst G1 S100 F10 S110": measure_burst(robot, ["G1", "S100", "F10", "S110"], args.n),
+        }
+
+        robot.release()
+        time.sleep(0.5)     # процессы робота завершаются по следующей строке телеметрии
+
+    print(f"\ntelemetry {args.rate} Hz, time scale {args.time_scale}, window {args.window}")
+    for name, samples in results.items():
+        report(name, samples)
+    for name, (rate, interrupted) in bursts.items():
+        print(f"{name:<24} {rate:8.1f} cmd/s  interrupted/lost: {interrupted}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Время подъезда к кубу в симуляторе: шагами rotate/go (BTDriver._approach_steps) против непрерывного
+движения SerialRobot.set_velocity (BTDriver._approach_servo).
+
+Запуск: python bench_servo.py [--latency 0.06] [--fps 30]
+
+SerialRobot работает с эмулятором платы (emulator.VirtualArduino), который двигает робота по полу по командам
+F, R и D. SimCamera рисует кадры с синим кубом по положению робота на момент захвата (с задержкой камеры --latency)
+и отдаёт их через интерфейс Camera; распознавание - vision_worker.InlineVision, как с записью.
+Для каждого положения куба выводятся время подъезда, число команд движения и остаток смещения куба от захвата.
+"""
+import argparse
+import contextlib
+import math
+import os
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import grab_helper
+from driver import BTDriver
+from emulator import VirtualArduino
+from frame_ring import Area
+from recording import ReplayFrame
+from serial_robot import SerialRobot
+from vision_worker import InlineVision
+
+GRABBER_CENTER = (303, 378)     # grab_helper.find_grabber_center
+FOCAL = 500                     # пикселей
+HORIZON = 100                   # строка горизонта
+CAMERA_HEIGHT = 7.8             # см над центром куба: куб у захвата (15 см) - на строке 360
+CUBE_SIZE = 5                   # см
+
+CUBES = ((45, 0), (45, 10), (40, -8), (38, 9))      # куб: вперёд, направо от робота, см
+
+
+class SimCamera:
+    """
+    Камера над полом эмулятора: кадр номер n снят в момент start + n / fps и показывает робота
+    на latency секунд раньше
+    """
+
+    def __init__(self, board: VirtualArduino, cube: tuple[float, float], fps: float = 30, latency: float = 0.06,
+                 shape: tuple[int, int, int] = (480, 640, 3)):
+        self.board = board
+        self.cube = cube
+        self.fps = fps
+        self.latency = latency
+        self.image_size = shape
+        self.display = False
+        self._background = np.random.default_rng(0).integers(70, 110, shape, dtype=np.uint8)
+        self._start = time.perf_counter()
+        self._frame = None
+        self._lock = threading.Lock()
+
+    def _render(self, t: float) -> np.ndarray:
+        x, y, heading = self.board.pose(t - self.latency)
+        dx, dy = self.cube[0] - x, self.cube[1] - y
+        h = math.radians(heading)
+        forward = dx * math.cos(h) + dy * math.sin(h)
+        lateral = -dx * math.sin(h) + dy * math.cos(h)
+        image = self._background.copy()
+        if forward > 3:
+            cx = int(GRABBER_CENTER[0] + FOCAL * lateral / forward)
+            cy = int(HORIZON + FOCAL * CAMERA_HEIGHT / forward)
+            half = int(FOCAL * CUBE_SIZE / 2 / forward)
+            cv2.rectangle(image, (cx - half, cy - half), (cx + half, cy + half), (200, 120, 20), -1)
+        return image
+
+    def _make_frame(self, generation: int) -> ReplayFrame:
+        with self._lock:
+            if self._frame is None or self._frame.generation != generation:
+                t = self._start + generation / self.fps
+                self._frame = ReplayFrame(self._render(t), generation, time.time() - (time.perf_counter() - t))
+            return self._frame
+
+    @property
+    def frame_generation(self) -> int:
+        return int((time.perf_counter() - self._start) * self.fps)
+
+    def latest_frame(self) -> ReplayFrame:
+        return self._make_frame(self.frame_generation)
+
+    def wait_for_frame(self, after_generation: int, timeout: float | None = None) -> ReplayFrame | None:
+        wait = self._start + (after_generation + 1) / self.fps - time.perf_counter()
+        if timeout is not None and wait > timeout:
+            time.sleep(timeout)
+            return None
+        time.sleep(max(0.0, wait))
+        return self.latest_frame()
+
+    def frames(self, timeout: float | None = None, after_generation: int | None = None):
+        generation = self.frame_generation if after_generation is None else after_generation
+        while True:
+            frame = self.wait_for_frame(generation, timeout)
+            if frame is None:
+                raise TimeoutError("No frames")
+            yield frame
+            generation = frame.generation
+
+    @contextlib.contextmanager
+    def roi(self, area: Area):
+        yield
+
+    def start_vision_worker(self, colors: tuple[str, ...], area: Area, processes: int | None = None) -> InlineVision:
+        return InlineVision(self, colors, area)
+
+    def stop_vision_worker(self):
+        pass
+
+    def draw_grabber_pos(self, pos):
+        pass
+
+    def draw_object_pos(self, pos):
+        pass
+
+    def set_text(self, text: str):
+        pass
+
+
+def approach(robot: SerialRobot, board: VirtualArduino, cube: tuple[float, float], servo: bool,
+             args) -> tuple[float, int, tuple[int, int] | None]:
+    """
+    :return: время подъезда, сколько команд движения получила плата, смещение куба от захвата на последнем кадре
+    """
+    board.place(0, 0, 0)
+    camera = SimCamera(board, cube, args.fps, args.latency)
+    driver = BTDriver(robot, None, camera)
+    area = driver._find_area(grab_helper.CUBE_FIND_AREA)     # как в take_item
+    vision = camera.start_vision_worker(("blue", ), area)
+    received = len(board.received)
+    start = time.perf_counter()
+    if servo:
+        driver._approach_servo(vision, "blue", GRABBER_CENTER)
+    else:
+        driver._approach_steps(vision, "blue", GRABBER_CENTER)
+    elapsed = time.perf_counter() - start
+    moves = sum(command[0] in "FRD" for _, command in board.received[received:])
+    last = vision.latest("blue")
+    offset = None if last.lost else (GRABBER_CENTER[0] - last.x, GRABBER_CENTER[1] - last.y)
+    return elapsed, moves, offset
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fps", type=float, default=30)
+    parser.add_argument("--latency", type=float, default=0.06, help="задержка камеры, с")
+    args = parser.parse_args()
+
+    results = []
+    stdout = sys.stdout
+    with VirtualArduino(telemetry_rate=20) as board, open(os.devnull, "w") as devnull:
+        sys.stdout = devnull    # SerialRobot печатает каждую команду
+        robot = SerialRobot(board.port)
+        try:
+            for cube in CUBES:
+                for name, servo in (("steps", False), ("servo", True)):
+                    results.append((cube, name, *approach(robot, board, cube, servo, args)))
+        finally:
+            robot.release()
+            sys.stdout = stdout
+
+    totals = {}
+    for cube, name, elapsed, moves, offset in results:
+        totals.setdefault(name, []).append(elapsed)
+        print(f"cube {cube[0]:3.0f} cm, {cube[1]:+4.0f} cm  {name:<6} {elapsed:6.2f} s  {moves:4d} moves  "
+              f"final offset {offset}")
+    for name, times in totals.items():
+        print(f"{name:<6} mean {np.mean(times):6.2f} s")
+
+
+if __name__ == "__main__":
+    main()
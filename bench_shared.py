@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Микробенчмарк доступа к общему состоянию процессов: прокси Manager().Value против полей SharedStruct.
+
+Запуск: python bench_shared.py [-n 20000]
+"""
+import argparse
+import ctypes
+import time
+from multiprocessing import Manager
+
+from camera import CameraControl
+
+
+def measure(n: int, action) -> float:
+    """
+    :return: среднее время одного вызова в микросекундах
+    """
+    t = time.perf_counter()
+    for _ in range(n):
+        action()
+    return (time.perf_counter() - t) / n * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", type=int, default=20000, help="повторов каждой операции")
+    args = parser.parse_args()
+
+    manager = Manager()
+    value = manager.Value(ctypes.c_uint16, 0)
+    text = manager.Value(ctypes.c_char_p, "")
+
+    control = CameraControl.create()
+
+    def set_manager_value():
+        value.value = 1
+
+    def set_manager_pair():
+        value.value = 1
+        value.value = 2
+
+    def set_field():
+        control.object_x = 1
+
+    results = {
+        "Manager Value get": measure(args.n, lambda: value.value),
+        "Manager Value set": measure(args.n, set_manager_value),
+        "Manager c_char_p get": measure(args.n, lambda: text.value),
+        "Manager pair set": measure(args.n, set_manager_pair),
+        "SharedStruct field get": measure(args.n, lambda: control.object_x),
+        "SharedStruct field set": measure(args.n, set_field),
+        "SharedStruct text get": measure(args.n, lambda: control.text),
+        "SharedStruct pair write": measure(args.n, lambda: control.write(object_x=1, object_y=2)),
+        "SharedStruct pair read": measure(args.n, lambda: control.read("object_x", "object_y")),
+    }
+
+    manager.shutdown()
+    control.unlink()
+
+    for name, us in results.items():
+        print(f"{name:<26} {us:10.3f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк разбора телеметрии: текстовые строки 'n n n n n n n' против бинарных кадров telemetry.FRAME_DTYPE.
+
+Запуск: python bench_telemetry.py [-n 100000] [--chunk 256] [--serial-rate 1000]
+
+Декодирование идёт тем же путём, что в SerialRobot.serial_io: поток режется на куски по --chunk байт
+(сколько успевает прийти между чтениями) и скармливается TelemetryDecoder.
+С --serial-rate дополнительно запускается SerialRobot на эмуляторе с телеметрией заданной частоты
+и измеряется загрузка CPU процессом обмена (Linux, /proc).
+"""
+import argparse
+import os
+import random
+import time
+
+from emulator import VirtualArduino
+from serial_robot import SerialRobot
+import telemetry
+from telemetry import TelemetryDecoder
+
+
+def make_samples(n: int) -> list[list[int]]:
+    return [[random.randint(0, 3000) for _ in range(telemetry.TELEMETRY_LEN)] for _ in range(n)]
+
+
+def decode_text(stream: bytes, chunk: int) -> int:
+    decoder = TelemetryDecoder()
+    count = 0
+    for i in range(0, len(stream), chunk):
+        lines, _ = decoder.feed(stream[i:i + chunk])
+        for line in lines:
+            if telemetry.parse_text(line) is not None:
+                count += 1
+    return count
+
+
+def decode_binary(stream: bytes, chunk: int) -> int:
+    decoder = TelemetryDecoder()
+    count = 0
+    for i in range(0, len(stream), chunk):
+        _, frames = decoder.feed(stream[i:i + chunk])
+        count += len(frames)
+    return count
+
+
+def process_cpu_time(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def measure_serial_cpu(rate: float, binary: bool, duration: float = 3) -> float:
+    """
+    :return: доля одного ядра, которую занимает процесс обмена при телеметрии с частотой rate
+    """
+    with VirtualArduino(telemetry_rate=rate) as board:
+        robot = SerialRobot(board.port, binary_telemetry=binary)
+        time.sleep(0.5)
+        cpu = process_cpu_time(robot._serial_io.pid)
+        time.sleep(duration)
+        cpu = process_cpu_time(robot._serial_io.pid) - cpu
+        robot.release()
+        time.sleep(0.3)
+    return cpu / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", type=int, default=100000, help="количество пакетов телеметрии")
+    parser.add_argument("--chunk", type=int, default=256, help="байт за одно чтение из порта")
+    parser.add_argument("--serial-rate", type=float, default=0, help="частота телеметрии для замера CPU, Гц")
+    args = parser.parse_args()
+
+    samples = make_samples(args.n)
+    text_stream = b"".join((" ".join(map(str, s)) + "\r\n").encode("ascii") for s in samples)
+    binary_stream = b"".join(telemetry.encode_frame(i, s) for i, s in enumerate(samples))
+
+    for name, stream, decode in (("text", text_stream, decode_text), ("binary", binary_stream, decode_binary)):
+        t = time.perf_counter()
+        count = decode(stream, args.chunk)
+        elapsed = time.perf_counter() - t
+        assert count == args.n, f"{name}: decoded {count} of {args.n}"
+        print(f"{name:<8} {len(stream) / args.n:5.1f} B/packet  {args.n / elapsed:12.0f} packets/s  "
+              f"{elapsed / args.n * 1e6:7.3f} us/packet")
+
+    if args.serial_rate > 0:
+        for binary in (False, True):
+            load = measure_serial_cpu(args.serial_rate, binary)
+            print(f"serial_io CPU at {args.serial_rate:.0f} Hz, {'binary' if binary else 'text':<6}: {load * 100:5.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Подъезд к кубу на записанной последовательности: поиск по всей CUBE_FIND_AREA на каждом кадре
+(прежний BTDriver.take_item) против tracking.CubeTracker.
+
+Запуск: python bench_tracking.py [--recording out.frames --color blue] [--dropout 0.08] [--seed 0]
+
+Без --recording генерируется синтетическая запись: синий куб приближается к захвату (растёт и смещается вниз),
+на доле кадров --dropout его не видно (смаз, блик), в части кадров рядом есть синий предмет поменьше.
+Запись воспроизводится в реальном времени: пока идёт распознавание, кадры пропускаются.
+Выводятся время распознавания на кадр и время подъезда - до кадра, на котором цикл решил бы брать куб;
+прежний цикл после каждого пропуска спит 0.5 с.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+import grab_helper
+from recording import FrameRecorder, FrameRecording, ReplayFrame
+from tracking import CubeTracker
+
+GRABBER_CENTER = (303, 378)     # grab_helper.find_grabber_center
+GRAB_DISTANCE = 28              # BTDriver.take_item: ближе - берём
+MISS_SLEEP = 0.5
+
+
+def synthesize(path: str, dropout: float, fps: float = 30, duration: float = 8, shape=(480, 640, 3)):
+    rng = np.random.default_rng(0)
+    background = rng.integers(70, 110, shape, dtype=np.uint8)
+    with FrameRecorder(path, shape) as recorder:
+        for i in range(int(fps * duration)):
+            k = min(1.0, i / (fps * duration * 0.8))     # последние кадры куб стоит у захвата
+            image = background.copy()
+            size = int(60 + 100 * k)
+            cx = int(GRABBER_CENTER[0] + 120 * (1 - k) * np.cos(6 * k))
+            cy = int(110 + (GRABBER_CENTER[1] - GRAB_DISTANCE - 110) * k)
+            if random.random() >= dropout:
+                cv2.rectangle(image, (cx - size // 2, cy - size // 2), (cx + size // 2, cy + size // 2),
+                              (200, 120, 20), -1)
+            if (i // 40) % 2:
+                cv2.rectangle(image, (40, 40), (100, 100), (200, 120, 20), -1)     # посторонний синий предмет
+            recorder.append(image, i / fps)
+
+
+def approach(recording: FrameRecording, color: str, use_tracker: bool) -> dict:
+    area = grab_helper.get_area(recording.shape[1], recording.shape[0], grab_helper.CUBE_FIND_AREA)
+    tracker = CubeTracker(color, area)
+    times = recording.times
+    clock = float(times[0])
+    detection_times = []
+    misses = 0
+    while True:
+        index = int(np.searchsorted(times, clock))
+        if index >= len(recording):
+            return {"done": False, "time": clock - times[0], "frames": len(detection_times),
+                    "detection": detection_times, "misses": misses}
+        frame = ReplayFrame(recording.images[index], index + 1, float(times[index]))
+
+        start = time.perf_counter()
+        if use_tracker:
+            track = tracker.update(frame, frame.time)
+            x, y, lost, detected = track.x, track.y, track.lost, track.detected
+        else:
+            x, y, _ = grab_helper.find_cube(frame.ensure_hsv(area), area, color)
+            lost, detected = x is None, x is not None
+        elapsed = time.perf_counter() - start
+        detection_times.append(elapsed)
+        clock = max(clock, frame.time) + elapsed + 1e-6
+
+        if lost:
+            misses += 1
+            clock += MISS_SLEEP
+        elif detected and GRABBER_CENTER[1] - y <= GRAB_DISTANCE:
+            return {"done": True, "time": clock - times[0], "frames": len(detection_times),
+                    "detection": detection_times, "misses": misses}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recording", help="запись recording.FrameRecorder; по умолчанию синтетическая")
+    parser.add_argument("--color", default="blue")
+    parser.add_argument("--dropout", type=float, default=0.08, help="доля кадров без куба в синтетической записи")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        path = args.recording
+        if path is None:
+            path = os.path.join(directory, "approach.frames")
+            synthesize(path, args.dropout)
+        recording = FrameRecording(path)
+
+        for name, use_tracker in (("full search", False), ("tracker", True)):
+            r = approach(recording, args.color, use_tracker)
+            detection = np.array(r["detection"]) * 1000
+            print(f"{name:<12} detection mean {detection.mean():5.2f} ms  p99 {np.percentile(detection, 99):5.2f} ms  "
+                  f"approach {r['time']:5.2f} s{'' if r['done'] else ' (not finished)'}  "
+                  f"frames {r['frames']:4d}  lost {r['misses']}")
+        del recording
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Задержка поиска кубов на кадр: grab_helper.find_cube на каждый цвет из набора.
+
+Запуск: python bench_vision.py [--images test_images/grabber] [-n 200] [--debug-dir /tmp/debug] [--scales 2 4]
+
+Для каждого изображения и набора цветов выводится время на кадр.
+С --debug-dir дополнительно замеряется find_cube с включённой debug_bus, которая сохраняет изображения в папку.
+С --scales для каждого масштаба грубого поиска (grab_helper.DETECTION_SCALE) выводится среднее время find_cube
+по всем изображениям и цветам, число расхождений с полным разрешением и наибольшая ошибка центра.
+"""
+import argparse
+import glob
+import math
+import os
+import time
+
+import cv2
+
+import debug_bus
+import grab_helper
+
+COLOR_SETS = (
+    ("blue", ),
+    ("blue", "black"),      # как в main.e1
+    tuple(grab_helper.COLORS),
+)
+
+
+def per_color(hsv, area, colors):
+    return {color: grab_helper.find_cube(hsv, area, color) for color in colors}
+
+
+def timed(function, n: int, *args) -> tuple[float, object]:
+    result = function(*args)
+    start = time.perf_counter()
+    for _ in range(n):
+        function(*args)
+    return (time.perf_counter() - start) / n * 1000, result
+
+
+def compare_scales(images: str, scales: list[int], n: int):
+    times = {scale: [] for scale in scales}
+    mismatches = {scale: 0 for scale in scales}
+    errors = {scale: 0.0 for scale in scales}
+    detections = 0
+    for path in sorted(glob.glob(os.path.join(images, "*"))):
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        area = grab_helper.get_area(hsv.shape[1], hsv.shape[0], grab_helper.CUBE_FIND_AREA)
+        for color in grab_helper.COLORS:
+            reference = None
+            for scale in scales:
+                elapsed, result = timed(grab_helper.find_cube, n, hsv, area, color, scale)
+                times[scale].append(elapsed)
+                if reference is None:
+                    reference = result
+                    detections += result[0] is not None
+                elif (result[0] is None) != (reference[0] is None):
+                    mismatches[scale] += 1
+                elif result[0] is not None:
+                    errors[scale] = max(errors[scale], math.dist(result[:2], reference[:2]))
+
+    print(f"{detections} cubes found at full resolution")
+    base = sum(times[1]) / len(times[1])
+    for scale in scales:
+        mean = sum(times[scale]) / len(times[scale])
+        print(f"scale 1/{scale}  find_cube {mean:6.3f} ms  x{base / mean:4.2f}  "
+              f"mismatches {mismatches[scale]}  max center error {errors[scale]:4.1f} px")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default="test_images/grabber")
+    parser.add_argument("-n", type=int, default=200, help="повторов на замер")
+    parser.add_argument("--debug-dir", help="замерить find_cube с debug_bus, сохраняющей изображения сюда")
+    parser.add_argument("--scales", type=int, nargs="*", default=[], help="масштабы грубого поиска для сравнения")
+    args = parser.parse_args()
+
+    if args.scales:
+        compare_scales(args.images, [1] + args.scales, args.n)
+        return
+
+    for path in sorted(glob.glob(os.path.join(args.images, "*"))):
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        area = grab_helper.get_area(hsv.shape[1], hsv.shape[0], grab_helper.CUBE_FIND_AREA)
+        for colors in COLOR_SETS:
+            elapsed, found = timed(per_color, args.n, hsv, area, colors)
+            print(f"{os.path.basename(path):<20} {len(colors)} colors  find_cube {elapsed:6.2f} ms  "
+                  f"found {sum(result[0] is not None for result in found.values())}")
+
+        if args.debug_dir:
+            debug_bus.enable(args.debug_dir)
+            debug_time, _ = timed(per_color, args.n, hsv, area, ("blue", ))
+            debug_bus.disable()
+            print(f"{os.path.basename(path):<20} find_cube with debug_bus on {debug_time:6.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Цикл драйвера с распознаванием в том же процессе (прежний BTDriver.take_item с CubeTracker)
+против vision_worker.VisionWorker, который распознаёт в отдельных процессах.
+
+Запуск: python bench_vision_worker.py [--fps 30] [--duration 5] [--colors blue black yellow green] [--processes N]
+
+Процесс-«камера» публикует синтетические кадры с синим кубом в FrameRing с частотой --fps (как bench_camera).
+На каждой итерации драйвер получает положение кубов всех --colors и «принимает решение».
+Выводятся время итерации драйвера (от получения кадра или результата до решения, то есть сколько
+занято ядро драйвера), задержка от захвата кадра до решения (p50/p99) и доля кадров, по которым принято решение.
+"""
+import argparse
+import multiprocessing
+import time
+
+import numpy as np
+
+from bench_camera import capture
+from frame_ring import FrameRing
+from tracking import CubeTracker
+from vision_worker import VisionWorker
+import grab_helper
+
+
+def inline(frames: FrameRing, colors: tuple[str, ...], area, duration: float) -> tuple[list, list, int]:
+    """
+    :return: время итераций, задержки решений, сколько кадров опубликовано за это время
+    """
+    trackers = {color: CubeTracker(color, area) for color in colors}
+    iterations, latencies = [], []
+    index = frames.register_roi(area)
+    generation = first = frames.generation
+    end = time.time() + duration
+    while time.time() < end:
+        frame = frames.pin_after(generation, 0.5)
+        if frame is None:
+            continue
+        start = time.perf_counter()
+        with frame:
+            generation = frame.generation
+            tracks = {color: tracker.update(frame, frame.time) for color, tracker in trackers.items()}
+        iterations.append(time.perf_counter() - start)
+        latencies.append(time.time() - frame.time)
+    frames.unregister_roi(index)
+    return iterations, latencies, frames.generation - first
+
+
+def worker(frames: FrameRing, colors: tuple[str, ...], area, duration: float,
+           processes: int | None) -> tuple[list, list, int]:
+    vision = VisionWorker(frames, colors, area, processes)
+    iterations, latencies = [], []
+    generation = first = frames.generation
+    end = time.time() + duration
+    try:
+        while time.time() < end:
+            detection = vision.wait(colors[0], generation, 0.5)
+            if detection is None:
+                continue
+            start = time.perf_counter()
+            generation = detection.generation
+            tracks = {color: vision.latest(color) for color in colors}
+            iterations.append(time.perf_counter() - start)
+            latencies.append(time.time() - detection.time)
+    finally:
+        vision.release()
+    return iterations, latencies, frames.generation - first
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fps", type=float, default=30)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--colors", nargs="+", default=list(grab_helper.COLORS))
+    parser.add_argument("--processes", type=int, help="процессов распознавания, по умолчанию как в VisionWorker")
+    args = parser.parse_args()
+
+    shape = (480, 640, 3)
+    colors = tuple(args.colors)
+    area = grab_helper.get_area(shape[1], shape[0], grab_helper.CUBE_FIND_AREA)
+    frames = FrameRing(shape)
+    try:
+        for name in ("inline", "worker"):
+            stop = multiprocessing.Event()
+            camera = multiprocessing.Process(target=capture, args=(frames, args.fps, args.duration + 1, stop))
+            camera.start()
+            if name == "inline":
+                iterations, latencies, published = inline(frames, colors, area, args.duration)
+            else:
+                iterations, latencies, published = worker(frames, colors, area, args.duration, args.processes)
+            stop.set()
+            camera.join()
+
+            iterations = np.array(iterations) * 1000
+            latencies = np.array(latencies) * 1000
+            print(f"{name:<7} {len(colors)} colors  iteration mean {iterations.mean():6.3f} ms  "
+                  f"latency p50 {np.percentile(latencies, 50):5.1f} ms  p99 {np.percentile(latencies, 99):5.1f} ms  "
+                  f"frames {len(latencies) / published * 100:3.0f}%")
+    finally:
+        frames.unlink()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,62 @@
+import os
 import time
+import contextlib
 
 import numpy as np
 import cv2
 
 import multiprocessing
-from multiprocessing.shared_memory import SharedMemory, ShareableList
-from multiprocessing import Value, Manager
 import ctypes
 
+from shared_block import SharedStruct
+from frame_ring import FrameRing, Frame, Area
+from telemetry import TelemetryRing, RECORD_DTYPE
+from recording import FrameRecorder
+from scanner import QRWorker
+from vision_worker import VisionWorker
+
+
+class CameraControl(SharedStruct):
+    """
+    Состояние камеры в общей памяти: то, что рисуется поверх изображения, и частота захвата
+    """
+    _fields_ = [
+        ("is_releasing", ctypes.c_bool),
+        ("capture_fps", ctypes.c_float),
+        ("grabber_x", ctypes.c_int16),
+        ("grabber_y", ctypes.c_int16),
+        ("object_x", ctypes.c_int16),
+        ("object_y", ctypes.c_int16),
+        ("text", ctypes.c_char * 128),
+    ]
+
 
 class Camera:
 
     DISPLAY = True
+    PREVIEW_FPS = 10
+
+    FRAME_SLOTS = 4     # последний кадр, кадр в записи и запас для читателей, закрепивших кадры
+    TELEMETRY_HISTORY = 1   # с: сколько телеметрии до кадра хранит record_loop, чтобы найти пакет на момент захвата
 
     image_size: tuple[int, int, int]
-    camera_index: int
+    camera_index: int | str
 
-    def __init__(self, camera_index: int, shared_telemetry: ShareableList | None):
+    def __init__(self, camera_index: int | str, shared_telemetry: TelemetryRing | None,
+                 display: bool | None = None, preview_fps: float | None = None):
+        """
+        :param camera_index: индекс камеры или путь к видеофайлу, как в cv2.VideoCapture
+        :param display: показывать ли окно с изображением, по умолчанию DISPLAY
+        :param preview_fps: частота обновления окна, по умолчанию PREVIEW_FPS; на захват не влияет
+        """
 
         self.camera_index = camera_index
         self._shared_telemetry = shared_telemetry
+        self.display = self.DISPLAY if display is None else display
 
-        tmp_capture = cv2.VideoCapture(0)
+        tmp_capture = cv2.VideoCapture(camera_index)
         if not tmp_capture.isOpened():
-            raise ConnectionError("Failed to open VideoCapture with index 0")
+            raise ConnectionError(f"Failed to open VideoCapture with index {camera_index}")
         ret, image = tmp_capture.read()
         if not ret:
             raise ConnectionError("ret is False")
@@ -31,125 +64,315 @@ class Camera:
 
         self.image_size = tuple(image.shape)
 
-        self._shared_image_memory = SharedMemory("Image", create=True,
-                                                 size=self.image_size[0] * self.image_size[1] * self.image_size[2] * 8)
-        self._shared_hsv_memory = SharedMemory("HSV", create=True,
-                                                 size=self.image_size[0] * self.image_size[1] * self.image_size[2] * 8)
-        self._shared_image_data = np.ndarray(image.shape, dtype=np.uint8, buffer=self._shared_image_memory.buf)
-        self._shared_hsv_data = np.ndarray(image.shape, dtype=np.uint8, buffer=self._shared_hsv_memory.buf)
-
-        self._shared_memory_manager = Manager()
-        self._shared_is_releasing = self._shared_memory_manager.Value(ctypes.c_bool, False)
-
-        self._shared_grabber_x = self._shared_memory_manager.Value(ctypes.c_uint16, 0)
-        self._shared_grabber_y = self._shared_memory_manager.Value(ctypes.c_uint16, 0)
-
-        self._shared_object_x = self._shared_memory_manager.Value(ctypes.c_uint16, 0)
-        self._shared_object_y = self._shared_memory_manager.Value(ctypes.c_uint16, 0)
-
-        self._shared_text = self._shared_memory_manager.Value(ctypes.c_char_p, "")
-
-        self._shared_image_time = self._shared_memory_manager.Value(ctypes.c_uint64, 0)
+        self._frames = FrameRing(self.image_size, self.FRAME_SLOTS)
+        self._control = CameraControl.create()
 
-        self._child_process = multiprocessing.Process(target=Camera.screen_updater, args=(
-            self.DISPLAY,
+        self._child_process = multiprocessing.Process(target=Camera.capture_loop, args=(
             self.camera_index,
-            self.image_size,
-            self._shared_image_time,
-            self._shared_is_releasing,
-            self._shared_grabber_x,
-            self._shared_grabber_y,
-            self._shared_object_x,
-            self._shared_object_y,
-            self._shared_text,
-            self._shared_telemetry
-
+            self._frames,
+            self._control,
         ))
         self._child_process.start()
 
+        self._recorder_process = None
+        self._stop_recording = multiprocessing.Event()
+
+        self._qr_worker = None
+        self._vision_worker = None
+
+        self._display_process = None
+        if self.display:
+            self._display_process = multiprocessing.Process(target=Camera.display_loop, args=(
+                self._frames,
+                self._control,
+                self._shared_telemetry,
+                self.PREVIEW_FPS if preview_fps is None else preview_fps,
+            ))
+            self._display_process.start()
 
     @staticmethod
-    def screen_updater(display: bool,
-                       camera_index: int,
-                       image_size,
-                       image_time: Value,
-                       is_releasing: Value,
-                       grabber_x: Value,
-                       graber_y: Value,
-                       object_x: Value,
-                       object_y: Value,
-                       text: Value,
-                       telemetry: ShareableList):
+    def capture_loop(camera_index: int | str,
+                     frames: FrameRing,
+                     control: CameraControl):
+        """
+        Только захват и публикация кадров, без отрисовки: частота захвата не зависит от окна
+        """
 
         capture = cv2.VideoCapture(camera_index)
         if not capture.isOpened():
             print(f"Failed to open VideoCapture with index {camera_index}")
             return
 
-        shared_memory = SharedMemory("Image")
-        shared_memory_hsv = SharedMemory("HSV")
-        shared_image = np.ndarray(image_size, dtype=np.uint8, buffer=shared_memory.buf)
-        shared_hsv = np.ndarray(image_size, dtype=np.uint8, buffer=shared_memory_hsv.buf)
-
+        fps_start = time.time()
+        fps_frames = 0
         while True:
             ret, image = capture.read()
             t = time.time()
-            image_time.value = int(t * 1000)
 
-            if is_releasing.value:
+            if control.is_releasing:
                 break
+            if not ret:
+                time.sleep(0.01)
+                continue
+
+            # кадр пишется в свободный слот и публикуется только целиком
+            slot = frames.begin_write()
+            if slot is not None:
+                np.copyto(frames.images[slot], image)
+                frames.write_hsv(slot, image)   # только области, на которые кто-то подписан
+                frames.publish(slot, t)
+
+            fps_frames += 1
+            if t - fps_start >= 1:
+                # одиночное float-поле пишется атомарно и без seq-lock: писатель seq - только основной процесс
+                control.capture_fps = fps_frames / (t - fps_start)
+                fps_start = t
+                fps_frames = 0
+
+        capture.release()
 
-            hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-            np.copyto(shared_image, image)
-            np.copyto(shared_hsv, hsv)
-
-            if display:
-                if grabber_x.value > 0 and graber_y.value > 0:
-                    image = cv2.rectangle(image, (grabber_x.value - 5, graber_y.value - 5), (grabber_x.value + 5, graber_y.value + 5), (255, 255, 0), 2)
+    @staticmethod
+    def display_loop(frames: FrameRing,
+                     control: CameraControl,
+                     telemetry: TelemetryRing | None,
+                     preview_fps: float):
+        """
+        Рисует последний кадр с отметками не чаще preview_fps раз в секунду.
+        Работает с пониженным приоритетом, чтобы не отнимать CPU у захвата и распознавания
+        """
+        os.nice(10)
+
+        period = 1 / preview_fps
+        generation = 0
+        next_time = time.time()
+        while not control.is_releasing:
+            frame = frames.pin_after(generation, 0.5)
+            if frame is None:
+                continue
+            with frame:
+                generation = frame.generation
+                image = frame.image.copy()
+
+            grabber_x, grabber_y, object_x, object_y, text = control.read(
+                "grabber_x", "grabber_y", "object_x", "object_y", "text")
+            capture_fps = control.capture_fps
+
+            if grabber_x > 0 and grabber_y > 0:
+                image = cv2.rectangle(image, (grabber_x - 5, grabber_y - 5), (grabber_x + 5, grabber_y + 5), (255, 255, 0), 2)
+
+            if object_x > 0 and object_y > 0:
+                image = cv2.rectangle(image, (object_x - 5, object_y - 5), (object_x + 5, object_y + 5), (255, 0, 255), 2)
+
+            image = cv2.putText(image, text.decode("utf-8", "ignore"), (5, image.shape[0] - 25),
+                                cv2.FONT_HERSHEY_COMPLEX, 1, (255, 255, 0), 1)
+            image = cv2.putText(image, f"{capture_fps:.0f} FPS", (image.shape[1] - 110, 25),
+                                cv2.FONT_HERSHEY_COMPLEX, 0.8, (255, 255, 0), 1)
+
+            if telemetry is not None:
+                image = cv2.putText(image, f"Дальномеры: {telemetry[0]} {telemetry[1]}",
+                                    (5, 25), cv2.FONT_HERSHEY_COMPLEX, 0.8, (255, 255, 0), 1)
+                image = cv2.putText(image, f"Рука: {telemetry[5]}",
+                                    (5, 55), cv2.FONT_HERSHEY_COMPLEX, 0.8, (255, 255, 0), 1)
+
+            cv2.imshow("Robot", image)
+            cv2.waitKey(1)
+
+            next_time = max(next_time + period, time.time())
+            time.sleep(max(0.0, next_time - time.time()))
 
-                if object_x.value > 0 and object_y.value > 0:
-                    image = cv2.rectangle(image, (object_x.value - 5, object_y.value - 5), (object_x.value + 5, object_y.value + 5), (255, 0, 255), 2)
+        cv2.destroyAllWindows()
 
-                image = cv2.putText(image, text.value, (5, image.shape[0] - 25),
-                                    cv2.FONT_HERSHEY_COMPLEX, 1, (255, 255, 0), 1)
+    @staticmethod
+    def record_loop(frames: FrameRing,
+                    telemetry: TelemetryRing | None,
+                    path: str,
+                    stop):
+        """
+        Дописывает каждый новый кадр с телеметрией на момент захвата в FrameRecorder.
+        Отдельный процесс: запись на диск не тормозит захват.
+        К кадру пишется пакет телеметрии, ближайший по времени к захвату кадра, а не последний на момент записи:
+        кадр может ждать в очереди записи
+        """
+        history = np.empty(0, dtype=RECORD_DTYPE)    # пакеты не старше TELEMETRY_HISTORY до кадра
+        telemetry_seq = 0
+        with FrameRecorder(path, frames.shape) as recorder:
+            generation = frames.generation
+            while not stop.is_set():
+                frame = frames.pin_after(generation, 0.5)
+                if frame is None:
+                    continue
+                with frame:
+                    generation = frame.generation
+                    values = None
+                    if telemetry is not None:
+                        records = telemetry.since(telemetry_seq)
+                        if len(records):
+                            telemetry_seq = int(records["seq"][-1])
+                            history = np.concatenate((history, records))
+                        history = history[history["time"] >= frame.time - Camera.TELEMETRY_HISTORY]
+                        if len(history):
+                            values = history["values"][np.argmin(np.abs(history["time"] - frame.time))]
+                        else:
+                            values = telemetry.latest()
+                    recorder.append(frame.image, frame.time, values)
+
+    def start_recording(self, path: str):
+        """
+        Начинает запись кадров в файл, см. recording.ReplayCamera
+        """
+        self.stop_recording()
+        self._stop_recording.clear()
+        self._recorder_process = multiprocessing.Process(target=Camera.record_loop, args=(
+            self._frames,
+            self._shared_telemetry,
+            path,
+            self._stop_recording,
+        ))
+        self._recorder_process.start()
 
-                if telemetry is not None:
-                    image = cv2.putText(image, f"Дальномеры: {telemetry[0]} {telemetry[1]}",
-                                        (5, 25), cv2.FONT_HERSHEY_COMPLEX, 0.8, (255, 255, 0), 1)
-                    image = cv2.putText(image, f"Рука: {telemetry[5]}",
-                                        (5, 55), cv2.FONT_HERSHEY_COMPLEX, 0.8, (255, 255, 0), 1)
+    def stop_recording(self):
+        if self._recorder_process is None:
+            return
+        self._stop_recording.set()
+        self._recorder_process.join()
+        self._recorder_process = None
+
+    def start_qr_worker(self, continuous: bool = True) -> QRWorker:
+        """
+        Запускает декодирование QR-кодов с кадров камеры в отдельном процессе, см. scanner.QRWorker.
+        Если процесс уже запущен, только переключает режим
+        """
+        if self._qr_worker is None:
+            self._qr_worker = QRWorker(self._frames, continuous)
+        else:
+            self._qr_worker.set_continuous(continuous)
+        return self._qr_worker
+
+    def stop_qr_worker(self):
+        if self._qr_worker is None:
+            return
+        self._qr_worker.release()
+        self._qr_worker = None
+
+    def start_vision_worker(self, colors: tuple[str, ...], area: Area, processes: int | None = None) -> VisionWorker:
+        """
+        Запускает распознавание кубов цветов colors в отдельных процессах, см. vision_worker.VisionWorker.
+        Предыдущий пул останавливается
+        """
+        self.stop_vision_worker()
+        self._vision_worker = VisionWorker(self._frames, colors, area, processes)
+        return self._vision_worker
+
+    def stop_vision_worker(self):
+        if self._vision_worker is None:
+            return
+        self._vision_worker.release()
+        self._vision_worker = None
 
-                cv2.imshow("Robot", image)
-                cv2.waitKey(1)
+    def release(self):
+        self.stop_recording()
+        self.stop_qr_worker()
+        self.stop_vision_worker()
+        self._control.is_releasing = True
+        self._child_process.join(1)
+        if self._display_process is not None:
+            self._display_process.join(1)
+        self._control.unlink()
+        self._frames.unlink()
 
-        shared_memory.close()
-        cv2.destroyAllWindows()
+    @property
+    def capture_fps(self) -> float:
+        """
+        Фактическая частота захвата за последнюю секунду
+        """
+        return self._control.capture_fps
+
+    def latest_frame(self) -> Frame | None:
+        """
+        Закрепляет последний кадр: пока он не отпущен, камера его не перезапишет.
+            with camera.roi(area):
+                with camera.latest_frame() as frame:
+                    find_cube(frame.ensure_hsv(area), area, ...)
+        None, если кадров ещё не было
+        """
+        return self._frames.pin_latest()
+
+    def wait_for_frame(self, after_generation: int, timeout: float | None = None) -> Frame | None:
+        """
+        Ждёт кадра новее after_generation и закрепляет последний кадр (см. latest_frame)
+        :return: кадр или None, если вышел таймаут
+        """
+        return self._frames.pin_after(after_generation, timeout)
+
+    def frames(self, timeout: float | None = None, after_generation: int | None = None):
+        """
+        Перебирает новые кадры: каждый следующий новее предыдущего, кадры, пришедшие во время обработки,
+        пропускаются. Кадр закреплён до перехода к следующему.
+            for frame in camera.frames():
+                ...
+        :param timeout: сколько ждать кадра; если вышел, генератор бросает TimeoutError
+        :param after_generation: начать с кадров новее этого поколения, по умолчанию - с первого кадра новее текущего
+        """
+        generation = self.frame_generation if after_generation is None else after_generation
+        while True:
+            frame = self._frames.pin_after(generation, timeout)
+            if frame is None:
+                raise TimeoutError(f"No camera frames for {timeout} s")
+            try:
+                yield frame
+            finally:
+                frame.release()
+            generation = frame.generation
+
+    @contextlib.contextmanager
+    def roi(self, area: Area):
+        """
+        Пока открыт, камера конвертирует область area в HSV в каждом кадре
+        """
+        index = self._frames.register_roi(area)
+        try:
+            yield
+        finally:
+            self._frames.unregister_roi(index)
 
-    def release(self):
-        self._shared_is_releasing.value = True
+    @property
+    def frame_generation(self) -> int:
+        """
+        Номер последнего кадра, растёт на 1 с каждым кадром
+        """
+        return self._frames.generation
 
     @property
     def current_image(self) -> np.ndarray:
-        return self._shared_image_data
+        """
+        Последний кадр без закрепления: слот перезапишется через FRAME_SLOTS - 1 кадров. Для обработки - latest_frame
+        """
+        return self._frames.images[max(self._frames.latest_slot, 0)]
 
     @property
     def image_time(self) -> int:
-        return self._shared_image_time.value
+        """
+        Время последнего кадра, мс
+        """
+        return int(self._frames.latest_time * 1000)
 
     @property
     def current_image_hsv(self) -> np.ndarray:
-        return self._shared_hsv_data
+        """
+        См. current_image. Действительны только области, на которые подписаны через roi
+        """
+        return self._frames.hsv[max(self._frames.latest_slot, 0)]
 
     def draw_grabber_pos(self, pos: tuple[int, int] | None):
-        self._shared_grabber_x.value = 0 if pos is None else pos[0]
-        self._shared_grabber_y.value = 0 if pos is None else pos[1]
+        self._control.write(grabber_x=0 if pos is None else pos[0],
+                            grabber_y=0 if pos is None else pos[1])
 
     def draw_object_pos(self, pos: tuple[int, int] | None):
-        self._shared_object_x.value = 0 if pos is None else pos[0]
-        self._shared_object_y.value = 0 if pos is None else pos[1]
+        self._control.write(object_x=0 if pos is None else pos[0],
+                            object_y=0 if pos is None else pos[1])
 
     def set_text(self, text: str):
-        self._shared_text.value = text
+        self._control.write(text=text.encode("utf-8")[:CameraControl.text.size - 1])
 
 
 def test():
@@ -157,23 +380,26 @@ def test():
 
     import grab_helper
 
-    while True:
-        image = camera.current_image.copy()
-        image_hsv = camera.current_image_hsv.copy()
-
-        grabber_find_area = grab_helper.get_area(image.shape[1], image.shape[0], grab_helper.GRABBER_FIND_AREA)
+    grabber_find_area = grab_helper.get_area(camera.image_size[1], camera.image_size[0], grab_helper.GRABBER_FIND_AREA)
+    cube_find_area = grab_helper.get_area(camera.image_size[1], camera.image_size[0], grab_helper.CUBE_FIND_AREA)
+    with camera.roi(grabber_find_area), camera.roi(cube_find_area):
+        while True:
+            frame = camera.latest_frame()
+            if frame is None:
+                time.sleep(0.05)
+                continue
 
-        grabber_x, grabber_y = grab_helper.find_grabber_center(image_hsv, grabber_find_area)
-        camera.draw_grabber_pos((grabber_x, grabber_y))
+            grabber_x, grabber_y = grab_helper.find_grabber_center(frame.ensure_hsv(grabber_find_area), grabber_find_area)
+            camera.draw_grabber_pos((grabber_x, grabber_y))
 
-        cube_find_area = grab_helper.get_area(image.shape[1], image.shape[0], grab_helper.CUBE_FIND_AREA)
-        cube_x, cube_y, rotated = grab_helper.find_cube(image_hsv, cube_find_area, "green")
-        camera.set_text(f"{cube_x} {cube_y}")
+            cube_x, cube_y, rotated = grab_helper.find_cube(frame.ensure_hsv(cube_find_area), cube_find_area, "green")
+            camera.set_text(f"{cube_x} {cube_y}")
 
-        if None not in (cube_x, cube_y, rotated):
-            camera.draw_object_pos((cube_x, cube_y))
+            if None not in (cube_x, cube_y, rotated):
+                camera.draw_object_pos((cube_x, cube_y))
 
-        cv2.waitKey(1)
+            frame.release()
+            cv2.waitKey(1)
 
 if __name__ == "__main__":
     test()
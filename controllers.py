@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import abc
+import collections
+
+import numpy as np
+
+
+class Controller(abc.ABC):
+    """
+    Регулятор, который SerialRobot.watcher вызывает с фиксированным периодом.
+    По телеметрии, пришедшей с прошлого вызова, возвращает значение для команды command_key
+    или None, если отправлять ничего не нужно. Отправка не ждёт подтверждения платы.
+    """
+
+    command_key: str = ""
+    period: float = 0.1
+
+    def reset(self):
+        pass
+
+    @abc.abstractmethod
+    def update(self, t: float, samples: np.ndarray) -> int | None:
+        """
+        :param t: время вызова, time.time()
+        :param samples: записи telemetry.RECORD_DTYPE, пришедшие с прошлого вызова (могут быть пустыми)
+        """
+
+
+class WallFollowController(Controller):
+    """
+    PD-регулятор расстояния до левой стены, выход - коррекция скорости колёс (команда V).
+
+    Производная считается по реальному времени прихода телеметрии: наклон прямой по ошибкам
+    за последние derivative_window секунд, а не разность первого и последнего из N сэмплов.
+    Выход ограничен по модулю и по скорости изменения, мелкие изменения (dead-band) не отправляются.
+    """
+
+    command_key = "V"
+
+    def __init__(self,
+                 p_gain: float = 250,
+                 d_gain: float = 200,
+                 target_distance: float = 16,
+                 period: float = 0.1,
+                 derivative_window: float = 0.3,
+                 output_limit: float = 3000,
+                 max_rate: float = 20000,
+                 deadband: float = 20,
+                 wall_distance: float = 60,
+                 wall_confirmations: int = 3):
+        """
+        :param p_gain: единиц коррекции на см ошибки
+        :param d_gain: единиц коррекции на см/с изменения ошибки. 200 при окне 0.3 с устанавливается
+                       за 1.3-2 с на скоростях x1-x2 (bench_controller); прежние 90 при окне 0.9 с
+                       (как старые d_mult=100 по 10 сэмплам) не устанавливаются вовсе
+        :param target_distance: желаемое расстояние до стены, см
+        :param period: период вызова, с
+        :param derivative_window: за сколько секунд истории считать производную
+        :param output_limit: ограничение выхода по модулю
+        :param max_rate: ограничение скорости изменения выхода, единиц в секунду
+        :param deadband: изменения выхода меньше этого не отправляются
+        :param wall_distance: стена считается найденной, если она ближе, см ...
+        :param wall_confirmations: ... столько вызовов подряд
+        """
+        self.p_gain = p_gain
+        self.d_gain = d_gain
+        self.target_distance = target_distance
+        self.period = period
+        self.derivative_window = derivative_window
+        self.output_limit = output_limit
+        self.max_rate = max_rate
+        self.deadband = deadband
+        self.wall_distance = wall_distance
+        self.wall_confirmations = wall_confirmations
+
+        self._history = collections.deque()
+        self.reset()
+
+    def reset(self):
+        self._history.clear()
+        self._found_wall_counter = 0
+        self._found_wall = False
+        self._output = 0.0
+        self._sent_output = 0
+        self._last_time = None
+
+    @property
+    def found_wall(self) -> bool:
+        return self._found_wall
+
+    def update(self, t: float, samples: np.ndarray) -> int | None:
+        if len(samples) == 0:
+            return None
+
+        distance = float(np.mean(samples["values"][:, 1])) / 10
+        if distance < self.wall_distance:
+            self._found_wall_counter += 1
+        else:
+            self._found_wall_counter = 0
+        self._found_wall = self._found_wall or self._found_wall_counter > self.wall_confirmations
+        if not self._found_wall:
+            return None
+
+        sample_time = float(samples["time"][-1])
+        error = self.target_distance - distance
+        history = self._history
+        history.append((sample_time, error))
+        while history[0][0] < sample_time - self.derivative_window:
+            history.popleft()
+
+        dt = self.period if self._last_time is None else t - self._last_time
+        self._last_time = t
+
+        # пока история не накопилась, производная не определена - как и раньше, не корректируем
+        if len(history) < 2 or history[-1][0] - history[0][0] < self.derivative_window * 0.5:
+            return None
+
+        times, errors = np.array(history).T
+        times = times - times.mean()
+        slope = float(np.dot(times, errors - errors.mean()) / np.dot(times, times))
+
+        target = self.p_gain * error + self.d_gain * slope
+        target = float(np.clip(target, -self.output_limit, self.output_limit))
+
+        max_step = self.max_rate * dt
+        self._output += float(np.clip(target - self._output, -max_step, max_step))
+
+        output = int(self._output)
+        if abs(output - self._sent_output) < self.deadband and not (output == 0 and self._sent_output != 0):
+            return None
+        self._sent_output = output
+        return output
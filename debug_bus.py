@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Отладочные изображения детекторов (маски, контуры, линии) без затрат в рабочем режиме.
+
+Детектор публикует промежуточное изображение:
+    debug_bus.show("Mask", mask)
+Пока шина выключена, show - пустая функция. Дорогую отрисовку, которая нужна только для отладки, нужно
+закрывать проверкой:
+    if debug_bus.enabled:
+        debug_bus.show("Contours", cv2.drawContours(...))
+
+debug_bus.enable() показывает изображения в окнах, debug_bus.enable("dir") сохраняет их в папку.
+Показ и сохранение идут в отдельном процессе. Детектор не ждёт окно: если процесс не успевает,
+лишние изображения отбрасываются.
+"""
+import multiprocessing
+import os
+import queue
+
+import numpy as np
+import cv2
+
+QUEUE_SIZE = 8
+
+enabled = False
+
+_queue = None
+_process = None
+_dropped = 0
+
+
+def _noop(name: str, image: np.ndarray):
+    pass
+
+
+def _publish(name: str, image: np.ndarray):
+    global _dropped
+    try:
+        _queue.put_nowait((name, image))
+    except queue.Full:
+        _dropped += 1
+
+
+show = _noop
+
+
+def enable(output_dir: str | None = None):
+    """
+    :param output_dir: папка для сохранения изображений; None - показывать в окнах
+    """
+    global enabled, show, _queue, _process
+    if enabled:
+        return
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    _queue = multiprocessing.Queue(QUEUE_SIZE)
+    _process = multiprocessing.Process(target=_consume, args=(_queue, output_dir), daemon=True)
+    _process.start()
+    show = _publish
+    enabled = True
+
+
+def disable():
+    global enabled, show, _queue, _process
+    if not enabled:
+        return
+    show = _noop
+    enabled = False
+    _queue.put(None)
+    _process.join(1)
+    _queue = _process = None
+
+
+def dropped() -> int:
+    """
+    Сколько изображений отброшено, потому что процесс показа не успевал
+    """
+    return _dropped
+
+
+def _consume(images, output_dir: str | None):
+    counter = 0
+    while True:
+        item = images.get()
+        if item is None:
+            break
+        name, image = item
+        if output_dir is None:
+            cv2.imshow(name, image)
+            cv2.waitKey(1)
+        else:
+            cv2.imwrite(os.path.join(output_dir, f"{counter:06d}_{name}.png"), image)
+        counter += 1
+    if output_dir is None:
+        cv2.destroyAllWindows()
@@ -1,9 +1,11 @@
 import math
+import collections
 
 import numpy
 
 from serial_robot import SerialRobot
 from navigation import Navigator
+from mission import MissionPlan, MissionPlanner
 import time
 from typing import Callable
 from camera import Camera
@@ -30,6 +32,27 @@ class BTDriver:
     SHELF_2 = 40
     SHELF_DISTANCE = 25
 
+    FRAME_TIMEOUT = 2       # сколько визуальные циклы ждут нового кадра, с
+
+    GRAB_DISTANCE = 28      # куб ближе стольких пикселей к захвату по вертикали - берём
+    GRAB_TOLERANCE = 15     # и не дальше стольких по горизонтали
+
+    MAX_REVERSE = 20        # см, дальше оптимизатор не ставит проезд задом: сзади нет ни камеры, ни дальномера
+
+    ROUTES_VERSION = 5      # версия результата compile_commands и estimate_time в кэше таблицы маршрутов
+    COMMAND_OVERHEAD = 0.05     # с на команду маршрута: обмен с платой и сброс положения в execute_route
+    WALL_ESTIMATE_DISTANCE = 40     # см: сколько проедет W, заранее неизвестно; точнее - time_to/time в локации
+
+    SERVO = False           # take_item подъезжает непрерывным движением; нужна команда D в прошивке платы
+    SERVO_TURN_GAIN = 0.4   # град/с на пиксель смещения по горизонтали
+    SERVO_MAX_TURN = 60     # град/с
+    SERVO_SPEED_GAIN = 0.15     # см/с на пиксель расстояния по вертикали
+    SERVO_MIN_SPEED = 6     # см/с, пока куб не у захвата: у захвата сантиметр - это десятки пикселей
+    SERVO_MAX_SPEED = 24    # см/с, как SerialRobot.go
+    SERVO_ALIGN_PIXELS = 150    # при таком смещении по горизонтали робот только поворачивает
+    SERVO_LOST_TIMEOUT = 5      # с без куба - TimeoutError, как 10 пропусков по 0.5 с в шаговом подъезде
+    SERVO_TIMEOUT = 20          # с на весь подъезд - TimeoutError, даже если куб виден (робот не едет)
+
     robot: SerialRobot
     navigator: Navigator
     camera: Camera
@@ -38,6 +61,11 @@ class BTDriver:
         self.robot = robot
         self.navigator = navigator
         self.camera = camera
+        if navigator is not None:
+            navigator.set_compiler(BTDriver.compile_commands, self.ROUTES_VERSION, BTDriver.estimate_time)
+
+        # задержка от захвата кадра до решения по нему в визуальных циклах, с
+        self.frame_latencies = collections.deque(maxlen=1000)
 
     @staticmethod
     def _parse_command(command: str) -> tuple[str, list[int | float]]:
@@ -65,79 +93,155 @@ class BTDriver:
         self.COMMANDS[cmd_key](self.robot, *cmd_args)
 
     @staticmethod
-    def _merge_rot_commands(commands: list[str]) -> list[tuple[str, list[int | float]]]:
+    def _normalize_angle(angle: int | float) -> float:
+        """
+        Угол в [-180, 180]; разворот на 180 сохраняет направление исходного угла
+        """
+        normalized = (angle + 180) % 360 - 180
+        if normalized == -180 and angle > 0:
+            normalized = 180
+        return float(normalized)
+
+    @staticmethod
+    def _drop_zero_moves(commands: list[tuple[str, list[int | float]]]) -> list[tuple[str, list[int | float]]]:
+        """
+        Убирает F0 и R0: после них соседние повороты и движения склеиваются следующими проходами
+        """
+        return [(cmd_key, cmd_args) for cmd_key, cmd_args in commands
+                if not (cmd_key in ("F", "Fc", "R") and cmd_args[0] == 0)]
+
+    @staticmethod
+    def _fold_rotations(commands: list[tuple[str, list[int | float]]]) -> list[tuple[str, list[int | float]]]:
+        """
+        Подряд идущие повороты - один поворот на нормализованную сумму; поворот на 0 убирается
+        """
         result = []
-        l = len(commands)
-        i = 0
-        while i < l:
-            cmd_key, cmd_args = BTDriver._parse_command(commands[i])
-            if cmd_key != "R":
+        for cmd_key, cmd_args in commands:
+            if cmd_key == "R" and result and result[-1][0] == "R":
+                angle = BTDriver._normalize_angle(result.pop()[1][0] + cmd_args[0])
+            elif cmd_key == "R":
+                angle = BTDriver._normalize_angle(cmd_args[0])
+            else:
                 result.append((cmd_key, cmd_args))
-                i += 1
                 continue
-            angle = cmd_args[0]
-            j = i + 1
-            while j < l:
-                next_cmd_key, next_cmd_args = BTDriver._parse_command(commands[j])
-                if next_cmd_key != "R":
-                    break
-                j += 1
-                angle += next_cmd_args[0]
-
-            angle = math.copysign(abs(angle) % 360, angle)
-
             if angle != 0:
-                if angle > 180:
-                    angle = 180 - angle
-                elif angle < -180:
-                    angle = -180 - angle
-
-                result.append((cmd_key, [angle, ]))
-            i = j
-
+                result.append(("R", [angle]))
         return result
 
     @staticmethod
-    def _merge_wall_commands(commands: list[tuple[str, list[int | float]]]) -> list[tuple[str, list[int | float]]]:
+    def _drop_round_trips(commands: list[tuple[str, list[int | float]]]) -> list[tuple[str, list[int | float]]]:
+        """
+        Разворот, проезд и разворот обратно (R180 F d R-180, R180 F d R180) - проезд задом F -d,
+        если d не больше MAX_REVERSE: дальше задом вслепую робот не едет.
+        Только для F: Fc и W держатся за стену и дальномер, которые после разворота с другой стороны
+        """
         result = []
-        l = len(commands)
         i = 0
-        while i < l:
-            cmd_key, cmd_args = commands[i]
-            if cmd_key != "F" and cmd_key != "Fc":
-                result.append((cmd_key, cmd_args))
-                i += 1
+        while i < len(commands):
+            if i + 2 < len(commands) and commands[i + 1][0] == "F" \
+                    and commands[i + 1][1][0] <= BTDriver.MAX_REVERSE \
+                    and commands[i][0] == "R" and abs(commands[i][1][0]) == 180 \
+                    and commands[i + 2][0] == "R" and abs(commands[i + 2][1][0]) == 180:
+                result.append(("F", [-commands[i + 1][1][0]]))
+                i += 3
                 continue
-            wall_dist = 0
-            j = i + 1
-            c = ""
-            while j < l:
-                next_cmd_key, next_cmd_args = commands[j]
-                if next_cmd_key != "W" and next_cmd_key != "Wc":
-                    break
-                c = next_cmd_key
-                j += 1
-                wall_dist = next_cmd_args[0]
-
-            if wall_dist > 0:
-                result.append((c, [wall_dist]))
-            else:
-                result.append((cmd_key, cmd_args))
+            result.append(commands[i])
+            i += 1
+        return result
 
-            i = j
+    @staticmethod
+    def _merge_moves(commands: list[tuple[str, list[int | float]]]) -> list[tuple[str, list[int | float]]]:
+        """
+        Подряд идущие F (или Fc) - одно движение на сумму; движение на 0 убирается.
+        Проезды задом не складываются в один длиннее MAX_REVERSE
+        """
+        result = []
+        for cmd_key, cmd_args in commands:
+            if cmd_key in ("F", "Fc") and result and result[-1][0] == cmd_key:
+                previous = result[-1][1][0]
+                distance = previous + cmd_args[0]
+                if distance < min(-BTDriver.MAX_REVERSE, previous, cmd_args[0]):
+                    result.append((cmd_key, cmd_args))
+                    continue
+                result.pop()
+                if distance != 0:
+                    result.append((cmd_key, [distance]))
+                continue
+            result.append((cmd_key, cmd_args))
+        return result
+
+    @staticmethod
+    def _merge_wall_commands(commands: list[tuple[str, list[int | float]]]) -> list[tuple[str, list[int | float]]]:
+        """
+        Движение вперёд и следующий за ним подъезд к стене - один подъезд: W едет до стены из любой точки впереди.
+        Движение задом остаётся: отъехать от стены назад W может только до неё, а не дальше.
+        Несколько подъездов подряд - последний, если он не дальше предыдущего
+        """
+        result = []
+        for cmd_key, cmd_args in commands:
+            if cmd_key in ("W", "Wc") and result:
+                previous_key, previous_args = result[-1]
+                if previous_key in ("F", "Fc") and previous_args[0] > 0 \
+                        or previous_key in ("W", "Wc") and cmd_args[0] <= previous_args[0]:
+                    result.pop()
+            result.append((cmd_key, cmd_args))
         return result
 
+    OPTIMIZATION_PASSES = ("_drop_zero_moves", "_fold_rotations", "_drop_round_trips", "_merge_moves",
+                           "_merge_wall_commands")
+
+    @staticmethod
+    def optimize(commands: list[tuple[str, list[int | float]]],
+                 passes: tuple[str, ...] = OPTIMIZATION_PASSES) -> list[tuple[str, list[int | float]]]:
+        """
+        Прогоняет проходы по разобранным командам по кругу, пока они что-то меняют
+        :param passes: имена проходов, по умолчанию OPTIMIZATION_PASSES
+        """
+        while True:
+            optimized = commands
+            for name in passes:
+                optimized = getattr(BTDriver, name)(optimized)
+            if optimized == commands:
+                return optimized
+            commands = optimized
+
+    @staticmethod
+    def compile_commands(commands: list[str]) -> tuple[tuple[str, tuple[int | float, ...]], ...]:
+        """
+        Разбор и оптимизация команд маршрута для execute_route; Navigator компилирует ими таблицу маршрутов.
+        При изменении результата нужно увеличить ROUTES_VERSION, иначе будет прочитана старая таблица
+        """
+        optimized = BTDriver.optimize([BTDriver._parse_command(c) for c in commands])
+        return tuple((cmd_key, tuple(cmd_args)) for cmd_key, cmd_args in optimized)
+
+    @staticmethod
+    def estimate_time(route: tuple[tuple[str, tuple[int | float, ...]], ...]) -> float:
+        """
+        Оценка времени выполнения скомпилированного маршрута, с
+        """
+        total = 0.0
+        for cmd_key, cmd_args in route:
+            if cmd_key in ("F", "Fc"):
+                total += abs(cmd_args[0]) / SerialRobot.SPEED
+            elif cmd_key in ("W", "Wc"):
+                total += BTDriver.WALL_ESTIMATE_DISTANCE / SerialRobot.SPEED
+            elif cmd_key == "R":
+                total += abs(cmd_args[0]) / SerialRobot.ROTATION_SPEED
+            total += BTDriver.COMMAND_OVERHEAD
+        return total
+
     def execute_many(self, commands: list[str]):
         print(f"EXECUTE MANY: {commands}")
-        merged = BTDriver._merge_rot_commands(commands)
-        print(f"MERGED ROT: {merged}")
-        #merged = BTDriver._merge_wall_commands(merged)
-        print(f"EXECUTE WALL: {merged}")
-        for cmd in merged:
+        self.execute_route(self.compile_commands(commands))
+
+    def execute_route(self, route: tuple[tuple[str, tuple[int | float, ...]], ...]):
+        """
+        Каждая команда ждёт 'OK' платы (SerialRobot.go, rotate), сброс положения - эха; пауз между ними нет
+        """
+        print(f"EXECUTE ROUTE: {route}")
+        for cmd in route:
             self.execute(cmd)
-            time.sleep(0.2)
             self.robot.reset_position()
-            time.sleep(0.2)
 
     def go_to(self, wp_name: str):
         if not wp_name:
@@ -148,24 +252,50 @@ class BTDriver:
 
         print(f"Going to te point {wp_name}...")
 
-        path = self.navigator.find_path(wp_name)
-        self.execute_many(path)
+        route = self.navigator.find_route(wp_name)
+        self.execute_route(route)
         self.navigator.set_current_waypoint(wp_name)
         print(f"Arrived to the point {wp_name}")
 
+    def read_qr_code(self, wp_name: str = "qr_code", timeout: float = FRAME_TIMEOUT) -> str | None:
+        """
+        Едет к точке wp_name, пока QR-код декодируется в фоне, и возвращает код, найденный по пути или на месте
+        :return: текст кода или None, если его не удалось прочитать за timeout после прибытия
+        """
+        worker = self.camera.start_qr_worker(continuous=True)
+        start_generation = self.camera.frame_generation
+        try:
+            self.go_to(wp_name)
+            text, generation = worker.code()
+            if text is not None and generation > start_generation:
+                return text
+            return worker.request(self.camera.frame_generation, timeout)
+        finally:
+            worker.set_continuous(False)
+
+    def _find_area(self, relative_size: tuple[tuple[float, float], tuple[float, float]]):
+        """
+        Область кадра для поиска (grab_helper.get_area)
+        :param relative_size: grab_helper.CUBE_FIND_AREA или GRABBER_FIND_AREA
+        """
+        height, width = self.camera.image_size[:2]     # image_size - форма кадра: высота, ширина, каналы
+        return grab_helper.get_area(width, height, relative_size)
+
     def _get_grabber_center(self) -> tuple[int, int]:
         sum_x = sum_y = 0
         n = 0
 
-        find_area = grab_helper.get_area(self.camera.image_size[0], self.camera.image_size[1], grab_helper.GRABBER_FIND_AREA)
+        find_area = self._find_area(grab_helper.GRABBER_FIND_AREA)
 
-        for i in range(5):
-            cx, cy = grab_helper.find_grabber_center(self.camera.current_image_hsv, find_area)
-            if cx != -1 and cy != -1:
-                n += 1
-                sum_x += cx
-                sum_y += cy
-            time.sleep(0.2)
+        # усредняется по 5 разным кадрам
+        with self.camera.roi(find_area):
+            for i, frame in zip(range(5), self.camera.frames(timeout=self.FRAME_TIMEOUT)):
+                cx, cy = grab_helper.find_grabber_center(frame.ensure_hsv(find_area), find_area)
+                self.frame_latencies.append(time.time() - frame.time)
+                if cx != -1 and cy != -1:
+                    n += 1
+                    sum_x += cx
+                    sum_y += cy
 
         if n == 0:
             return -1, -1
@@ -173,22 +303,31 @@ class BTDriver:
         return int(sum_x / n), int(sum_y / n)
 
     def rotate_to_object(self):
-        find_area = grab_helper.get_area(self.camera.image_size[0], self.camera.image_size[1],
-                                         grab_helper.CUBE_FIND_AREA)
+        find_area = self._find_area(grab_helper.CUBE_FIND_AREA)
 
         f = 10
-        while True:
-            cx, cy, rot = grab_helper.find_cube(self.camera.current_image_hsv, find_area)
-            if None not in (cx, cy, rot):
-                f -= 1
-                if f <= 0:
-                    return
-            else:
-                f = 10
-                self.robot.rotate(15)
+        with self.camera.roi(find_area):
+            for frame in self.camera.frames(timeout=self.FRAME_TIMEOUT):
+                cx, cy, rot = grab_helper.find_cube(frame.ensure_hsv(find_area), find_area)
+                self.frame_latencies.append(time.time() - frame.time)
+                if None not in (cx, cy, rot):
+                    f -= 1
+                    if f <= 0:
+                        return
+                else:
+                    f = 10
+                    self.robot.rotate(15)
+
 
+    def take_item(self, color: str, servo: bool | None = None):
+        """
+        :param servo: подъезжать непрерывным движением (SerialRobot.set_velocity), по умолчанию SERVO;
+                      False - шагами rotate/go
+        Если куб потерян при подъезде - TimeoutError; перед ним захват закрывается, свет выключается,
+        рука поднимается в транспортное положение
+        """
+        servo = self.SERVO if servo is None else servo
 
-    def take_item(self, color: str):
         self.robot.set_hand_angle(self.HAND_ITEM_LEVEL)
         self.robot.set_light(True)
 
@@ -198,30 +337,55 @@ class BTDriver:
         self.camera.draw_grabber_pos(grabber_center)
 
 
-        cube_find_area = grab_helper.get_area(self.camera.image_size[0], self.camera.image_size[1],
-                                         grab_helper.CUBE_FIND_AREA)
-        prev_image_time = 0
-        not_found = 10
-        while True:
+        cube_find_area = self._find_area(grab_helper.CUBE_FIND_AREA)
+        # куб сопровождается в процессе распознавания (CubeTracker): пропуск отдельных кадров не считается потерей
+        vision = self.camera.start_vision_worker((color, ), cube_find_area)
+        try:
+            if servo:
+                self._approach_servo(vision, color, grabber_center)
+            else:
+                self._approach_steps(vision, color, grabber_center)
+        except TimeoutError:
+            self.robot.close_grabber()
+            self.robot.set_light(False)
+            self.camera.draw_object_pos(None)
+            self.camera.draw_grabber_pos(None)
+            self.robot.set_hand_angle(self.HAND_TRANSPORTING_ANGLE)
+            raise
+        finally:
+            self.camera.stop_vision_worker()
 
-            hsv = self.camera.current_image_hsv
-            image_time = self.camera.image_time
+        self.robot.close_grabber()
 
-            if image_time == prev_image_time:
-                time.sleep(0.05)
-                continue
-            prev_image_time = image_time
+        self.robot.set_light(False)
+
+        self.camera.draw_object_pos(None)
+        self.camera.draw_grabber_pos(None)
+        self.robot.go(-15)
+
+        self.robot.set_hand_angle(self.HAND_TRANSPORTING_ANGLE)
+
+    def _approach_steps(self, vision, color: str, grabber_center: tuple[int, int]):
+        """
+        Подъезд к кубу шагами: после каждого шага робот стоит, пока не придёт следующий результат
+        """
+        not_found = 10
+        for track in vision.results(color, timeout=self.FRAME_TIMEOUT):
 
-            cx, cy, rot = grab_helper.find_cube(hsv, cube_find_area, color)
+            cx, cy, rot = track.x, track.y, track.rotated
+            self.frame_latencies.append(time.time() - track.time)
 
-            if None not in (cx, cy, rot):
+            if not track.lost:
                 not_found = 10
 
                 self.camera.draw_object_pos((cx, cy))
+                if not track.detected:
+                    continue    # по предсказанию робот не двигается, ждём следующий кадр
 
                 rot_delta = grabber_center[0] - cx
                 dist_delta = grabber_center[1] - cy
-                self.camera.set_text(f"{rot_delta} {dist_delta}")
+                self.camera.set_text(f"{rot_delta} {dist_delta} {track.confidence:.1f}")
+                vision.notify_motion()      # все ветки ниже двигают робота
                 if dist_delta < 100:
                     if rot_delta > 15:
                         self.robot.rotate(-2)
@@ -250,40 +414,117 @@ class BTDriver:
                         #time.sleep(0.5)
                         continue
 
-                
+            
                 if dist_delta > 300:
                     self.robot.go(15)
                 elif dist_delta > 200:
                     self.robot.go(4)
-                elif dist_delta > 28:
-                  
+                elif dist_delta > self.GRAB_DISTANCE:
+              
                     self.robot.go(2)
                 else:
-                    break
+                    return
 
 
             else:
                 self.camera.draw_object_pos(None)
-                
+            
                 time.sleep(0.5)
                 not_found -= 1
                 if not_found <= 0:
                     raise TimeoutError
 
-            time.sleep(0.05)
-
-        self.robot.close_grabber()
-
-        self.robot.set_light(False)
+    def _approach_servo(self, vision, color: str, grabber_center: tuple[int, int]):
+        """
+        Подъезд к кубу непрерывным движением: на каждом результате распознавания скорость и поворот
+        пересчитываются пропорционально смещению куба от захвата, робот не останавливается между кадрами
+        """
+        lost_since = None
+        deadline = time.time() + self.SERVO_TIMEOUT
+        try:
+            for track in vision.results(color, timeout=self.FRAME_TIMEOUT):
+                self.frame_latencies.append(time.time() - track.time)
+                if time.time() > deadline:
+                    raise TimeoutError("Approach timeout")
+
+                if track.lost:
+                    self.camera.draw_object_pos(None)
+                    self.robot.set_velocity(0, 0)
+                    lost_since = lost_since or time.time()
+                    if time.time() - lost_since > self.SERVO_LOST_TIMEOUT:
+                        raise TimeoutError
+                    continue
+                lost_since = None
+
+                self.camera.draw_object_pos((track.x, track.y))
+                if not track.detected:
+                    continue    # по предсказанию уставка не меняется
+
+                rot_delta = grabber_center[0] - track.x
+                dist_delta = grabber_center[1] - track.y
+                self.camera.set_text(f"{rot_delta} {dist_delta} {track.confidence:.1f}")
+                if dist_delta <= self.GRAB_DISTANCE and abs(rot_delta) <= self.GRAB_TOLERANCE:
+                    return
 
-        self.camera.draw_object_pos(None)
-        self.camera.draw_grabber_pos(None)
-        time.sleep(1)
-        self.robot.go(-15)
+                turn = max(-self.SERVO_MAX_TURN, min(self.SERVO_MAX_TURN, -self.SERVO_TURN_GAIN * rot_delta))
+                # пока куб сильно сбоку, робот только доворачивает
+                align = max(0.0, 1 - abs(rot_delta) / self.SERVO_ALIGN_PIXELS)
+                speed = 0.0
+                if dist_delta > self.GRAB_DISTANCE and align > 0:
+                    speed = self.SERVO_SPEED_GAIN * (dist_delta - self.GRAB_DISTANCE) * align
+                    speed = max(self.SERVO_MIN_SPEED, min(self.SERVO_MAX_SPEED, speed))
+                self.robot.set_velocity(speed, turn)
+        finally:
+            self.robot.stop_streaming()
+
+    def find_item(self, color: str) -> bool:
+        """
+        Виден ли куб цвета color на первом кадре, снятом после вызова
+        """
+        find_area = self._find_area(grab_helper.CUBE_FIND_AREA)
+        with self.camera.roi(find_area):
+            frame = self.camera.wait_for_frame(self.camera.frame_generation, self.FRAME_TIMEOUT)
+            if frame is None:
+                raise TimeoutError("No frames")
+            with frame:
+                cx, cy, rot = grab_helper.find_cube(frame.ensure_hsv(find_area), find_area, color)
+                self.frame_latencies.append(time.time() - frame.time)
+        return None not in (cx, cy)
+
+    def run_mission(self, plan: MissionPlan, planner: MissionPlanner, servo: bool | None = None) -> list:
+        """
+        Выполняет план MissionPlanner: для каждой цели - подъезд, take_item, дорога до полки и put.
+        Если куба на месте нет или он потерян при подъезде, цель пропускается, а остаток плана чинится
+        MissionPlanner.skip
+        :param servo: см. take_item
+        :return: выполненные цели (mission.PickupTarget)
+        """
+        print(f"Mission: {plan}")
+        done = []
+        while plan.targets:
+            target = plan.targets[0]
+            self.go_to(target.waypoint)
+            if not self.find_item(target.color):
+                print(f"No {target.color} cube at {target.waypoint}, skipping")
+                plan = planner.skip(plan, self.navigator.current_waypoint.name)
+                print(f"Mission: {plan}")
+                continue
 
-        time.sleep(1)
+            try:
+                self.take_item(target.color, servo)
+            except TimeoutError:
+                print(f"Lost {target.color} cube at {target.waypoint}, skipping")
+                plan = planner.skip(plan, self.navigator.current_waypoint.name)
+                print(f"Mission: {plan}")
+                continue
+            self.go_to(target.destination)
+            self.put(target.shelf)
+            done.append(target)
+            plan = planner.advance(plan, self.navigator.current_waypoint.name)
 
-        self.robot.set_hand_angle(self.HAND_TRANSPORTING_ANGLE)
+        if plan.finish is not None:
+            self.go_to(plan.finish)
+        return done
 
     def put(self, shelf: int):
         print(f"Putting cube to the shelf {shelf}")
@@ -293,17 +534,50 @@ class BTDriver:
 
         self.robot.go(0, correct=True, wall_distance=self.SHELF_DISTANCE)
 
-        time.sleep(1)
         self.robot.open_grabber()
 
-        time.sleep(1)
         self.robot.go(-10)
 
-        time.sleep(1)
-
         
 
 
+def test():
+    optimize = BTDriver.optimize
+
+    def parsed(commands: str) -> list[tuple[str, list[int | float]]]:
+        return [BTDriver._parse_command(c) for c in commands.split()]
+
+    assert BTDriver._normalize_angle(270) == -90
+    assert BTDriver._normalize_angle(-270) == 90
+    assert BTDriver._normalize_angle(200) == -160
+    assert BTDriver._normalize_angle(540) == 180 and BTDriver._normalize_angle(-180) == -180
+    assert BTDriver._normalize_angle(-93) == -93
+
+    assert BTDriver._drop_zero_moves(parsed("R90 F0 R0 Fc0 W0 R-90")) == parsed("R90 W0 R-90")
+    assert BTDriver._fold_rotations(parsed("R180 R90 F10 R90 R-90")) == [("R", [-90.0]), ("F", [10])]
+    assert BTDriver._fold_rotations(parsed("R-90 R-90 R-90")) == [("R", [90.0])]
+    assert BTDriver._drop_round_trips(parsed("R180 F15 R-180 Fc10")) == parsed("F-15 Fc10")
+    assert BTDriver._drop_round_trips(parsed("R180 F20 R180 F5")) == parsed("F-20 F5")
+    assert BTDriver._drop_round_trips(parsed("R180 Fc40 R180")) == parsed("R180 Fc40 R180")
+    # дальше MAX_REVERSE задом не едем: развороты остаются
+    assert BTDriver._drop_round_trips(parsed("R180 F130 R180")) == parsed("R180 F130 R180")
+    assert optimize(parsed("R180 F130 R180")) == [("R", [180.0]), ("F", [130]), ("R", [180.0])]
+    assert BTDriver._merge_moves(parsed("F-15 F-15 F-5")) == parsed("F-15 F-20")
+    assert BTDriver._merge_moves(parsed("F10 F-5 Fc3 Fc4 F2 F-2")) == parsed("F5 Fc7")
+    assert BTDriver._merge_wall_commands(parsed("R180 Fc70 Wc40 R90 Wc100 W50 W60 F65")) == \
+        parsed("R180 Wc40 R90 W50 W60 F65")
+    # проезд задом перед подъездом к стене не выбрасывается
+    assert BTDriver._merge_wall_commands(parsed("F-15 W40 Fc-10 Wc30")) == parsed("F-15 W40 Fc-10 Wc30")
+    assert optimize(parsed("R90 R90 F15 R180 W40")) == parsed("F-15 W40")
+
+    # повороты складываются через движение на 0, разворот туда и обратно - проезд задом
+    assert optimize(parsed("R90 F0 R90 F20 R180 F5")) == parsed("F-15")
+    assert optimize(parsed("R-90 R180 W40")) == [("R", [90.0]), ("W", [40])]
+    assert optimize(parsed("R90 R-90 F0")) == []
+    assert BTDriver.compile_commands(["R180", "W40", "R90", "F120", "R-90", "R90"]) == \
+        (("R", (180.0,)), ("W", (40,)), ("R", (90.0,)), ("F", (120,)))
+    print("ok")
+
+
 if __name__ == "__main__":
-    res = BTDriver._merge_wall_commands([('R', [180.0]), ('Fc', [70]), ('Wc', [40]), ('R', [90.0]), ('Wc', [100]), ('R', [90.0]), ('F', [65])])
-    print(res)
\ No newline at end of file
+    test()
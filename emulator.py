@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+import os
+import tty
+import time
+import math
+import heapq
+import select
+import threading
+import collections
+
+import telemetry
+
+
+class VirtualArduino:
+    """
+    Эмулятор платы робота на псевдотерминале.
+    Говорит тем же построчным протоколом, что ожидает SerialRobot.serial_io:
+    на каждую команду отвечает '+<cmd>', для команд с выполнением (F/W/R/H/S) через симулированное время шлёт 'OK',
+    с заданной частотой шлёт телеметрию 'n n n n n n n'.
+    Команды оконного протокола '<cmd>#<seq>' подтверждаются как '+<cmd>#<seq>' и 'OK#<seq>'.
+    После команды T1 телеметрия идёт бинарными кадрами (telemetry.FRAME_DTYPE), после T0 - снова текстом.
+    Команда 'D<мм/с>,<град/с>' задаёт скорость и скорость поворота без 'OK'; если следующая уставка не пришла
+    за STREAM_TIMEOUT, робот останавливается.
+
+    Положение робота на полу (pose) меняется во времени по командам F, R и D: по нему bench_servo
+    рисует кадры камеры.
+    Угол руки (telemetry[5]) после S и показания дальномера (telemetry[0]) после поворота командой Y
+    меняются в телеметрии постепенно; Y, как и на плате, не подтверждается.
+
+    Использование:
+        with VirtualArduino(telemetry_rate=20) as board:
+            robot = SerialRobot(board.port)
+    """
+
+    COMPLETING_COMMANDS = "FWRHS"
+
+    TELEMETRY_LEN = telemetry.TELEMETRY_LEN
+
+    SPEED = 24.7436             # см/с, как SerialRobot.SPEED
+    ROTATION_SPEED = 90         # град/с, как SerialRobot.ROTATION_SPEED
+    HAND_SPEED = 120            # град/с
+    GRABBER_DURATION = 0.6      # с
+    RANGEFINDER_DURATION = 0.4  # с, поворот дальномера командой Y
+    STREAM_TIMEOUT = 0.3        # с, сколько робот едет по последней уставке D
+
+    COMMAND_GAP = 0.005         # команды без '\n' отделяются паузой, как в Serial.readString на плате
+
+    port: str
+    received: list[tuple[float, str]]     # (время прихода первого байта по time.perf_counter, команда)
+
+    def __init__(self, telemetry_rate: float = 20, time_scale: float = 1, durations: dict[str, float] | None = None):
+        """
+        :param telemetry_rate: частота телеметрии в Гц; 0 - плата молчит
+        :param time_scale: множитель симулированных длительностей команд; 0 - команды выполняются мгновенно
+        :param durations: фиксированные длительности для ключей команд, например {"F": 0.5}
+        """
+        self.telemetry_rate = telemetry_rate
+        self.time_scale = time_scale
+        self.durations = durations or {}
+
+        self.received = []
+
+        self.forward_distance = 100     # см
+        self.right_distance = 30        # см
+        self.left_distance = 160        # мм
+        self.hand_angle = 125
+        self.rangefinder_angle = 110    # как SerialRobot._RANGEFINDER_ANGLES: 110 - вперёд, 10 - направо
+
+        # в телеметрии рука и дальномер поворачиваются постепенно: (начало по time.perf_counter, откуда, длительность)
+        self._hand_move = (0.0, self.hand_angle, 0.0)
+        self._rangefinder_move = (0.0, self.forward_distance, 0.0)
+
+        self.binary_telemetry = False
+        self._telemetry_seq = 0
+
+        # отрезки движения: (начало по time.perf_counter, x, y, курс в начале, скорость см/с, поворот град/с, конец);
+        # x - вперёд по начальному курсу, y - направо, курс растёт при повороте направо (R > 0)
+        self._segments = collections.deque([(time.perf_counter(), 0.0, 0.0, 0.0, 0.0, 0.0, math.inf)], maxlen=1024)
+        self._segments_lock = threading.Lock()
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+
+        self._write_lock = threading.Lock()
+        self._timers = []
+        self._timers_lock = threading.Condition()
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        for target in (self._reader, self._completer, self._telemetry_sender):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stopping.set()
+        with self._timers_lock:
+            self._timers_lock.notify_all()
+        for thread in self._threads:
+            thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def write_line(self, line: str):
+        self.write((line + "\r\n").encode("ascii"))
+
+    def write(self, data: bytes):
+        with self._write_lock:
+            os.write(self._master, data)
+
+    def telemetry(self) -> list[int]:
+        now = time.perf_counter()
+        result = [0] * self.TELEMETRY_LEN
+        result[0] = int(self._interpolate(self._rangefinder_move, self._rangefinder_target(), now))
+        result[1] = int(self.left_distance)
+        result[5] = int(self._interpolate(self._hand_move, self.hand_angle, now))
+        return result
+
+    @staticmethod
+    def _interpolate(move: tuple[float, float, float], target: float, t: float) -> float:
+        start, value, duration = move
+        if t >= start + duration:
+            return target
+        return value + (target - value) * (t - start) / duration
+
+    def _rangefinder_target(self) -> float:
+        return self.forward_distance if self.rangefinder_angle > 60 else self.right_distance
+
+    def pose(self, t: float | None = None) -> tuple[float, float, float]:
+        """
+        :param t: момент по time.perf_counter, по умолчанию сейчас; хранится последняя тысяча отрезков движения
+        :return: x, y (см) и курс (град)
+        """
+        t = time.perf_counter() if t is None else t
+        with self._segments_lock:
+            segment = next((s for s in reversed(self._segments) if s[0] <= t), self._segments[0])
+        start, x, y, heading, speed, turn, end = segment
+        return self._integrate(x, y, heading, speed, turn, max(min(t, end) - start, 0))
+
+    @staticmethod
+    def _integrate(x: float, y: float, heading: float, speed: float, turn: float,
+                   dt: float) -> tuple[float, float, float]:
+        h0 = math.radians(heading)
+        h1 = math.radians(heading + turn * dt)
+        if turn == 0:
+            x += speed * dt * math.cos(h0)
+            y += speed * dt * math.sin(h0)
+        else:
+            radius = speed / math.radians(turn)
+            x += radius * (math.sin(h1) - math.sin(h0))
+            y -= radius * (math.cos(h1) - math.cos(h0))
+        return x, y, heading + turn * dt
+
+    def place(self, x: float, y: float, heading: float):
+        """
+        Ставит робота в точку, робот стоит; прежние положения забываются
+        """
+        with self._segments_lock:
+            self._segments.clear()
+            self._segments.append((time.perf_counter(), x, y, heading, 0.0, 0.0, math.inf))
+
+    def _move(self, speed: float, turn: float, duration: float, scaled: bool = True):
+        """
+        Новый отрезок движения прерывает текущий, как новая команда на плате
+        :param scaled: длительность умножается на time_scale, путь остаётся тем же
+        """
+        now = time.perf_counter()
+        x, y, heading = self.pose(now)
+        if scaled and self.time_scale <= 0:
+            x, y, heading = self._integrate(x, y, heading, speed, turn, duration)
+            speed = turn = 0.0
+        elif scaled:
+            speed, turn, duration = speed / self.time_scale, turn / self.time_scale, duration * self.time_scale
+        with self._segments_lock:
+            self._segments.append((now, x, y, heading, speed, turn, now + duration))
+
+    def _reader(self):
+        buffer = b""
+        first_byte_time = 0
+        while not self._stopping.is_set():
+            ready, _, _ = select.select([self._master], [], [], self.COMMAND_GAP if buffer else 0.1)
+            if not ready:
+                if buffer:
+                    self._on_command(buffer.decode("ascii").strip(), first_byte_time)
+                    buffer = b""
+                continue
+            if not buffer:
+                first_byte_time = time.perf_counter()
+            try:
+                buffer += os.read(self._master, 1024)
+            except OSError:
+                break
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                self._on_command(line.decode("ascii").strip(), first_byte_time)
+                first_byte_time = time.perf_counter()
+
+    def _on_command(self, command: str, received_time: float):
+        if not command:
+            return
+        self.received.append((received_time, command))
+        self.write_line(f"+{command}")
+
+        command, _, seq = command.partition("#")
+        suffix = f"#{seq}" if seq else ""
+
+        key, value = command[0], command[1:]
+        if key == "D":
+            speed, _, turn = value.partition(",")
+            try:
+                self._move(float(speed) / 10, float(turn or 0), self.STREAM_TIMEOUT, scaled=False)
+            except ValueError:
+                pass
+            return
+
+        try:
+            value = float(value) if value else 0
+        except ValueError:
+            return
+
+        if key == "T":
+            self.binary_telemetry = value == 1
+            return
+        if key == "Y":      # как и настоящая плата, поворот дальномера не подтверждается
+            now = time.perf_counter()
+            reading = self._interpolate(self._rangefinder_move, self._rangefinder_target(), now)
+            if value != self.rangefinder_angle:
+                self._rangefinder_move = (now, reading, self.RANGEFINDER_DURATION * self.time_scale)
+            self.rangefinder_angle = value
+            return
+        if key not in self.COMPLETING_COMMANDS:
+            return
+        if key == "S" and value == self.hand_angle:
+            return      # как и настоящая плата, не подтверждает поворот на текущий угол
+
+        duration = self._simulate(key, value) * self.time_scale
+        with self._timers_lock:
+            heapq.heappush(self._timers, (time.perf_counter() + duration, suffix))
+            self._timers_lock.notify_all()
+
+    def _simulate(self, key: str, value: float) -> float:
+        """
+        Применяет команду к состоянию эмулятора и возвращает её длительность в секундах
+        """
+        if key in self.durations:
+            duration = self.durations[key]
+        elif key == "F":
+            duration = abs(value) / 10 / self.SPEED
+        elif key == "W":
+            duration = max(self.forward_distance - value / 10, 0) / self.SPEED
+        elif key == "R":
+            duration = abs(value) / self.ROTATION_SPEED
+        elif key == "S":
+            duration = abs(self.hand_angle - value) / self.HAND_SPEED
+        else:
+            duration = self.GRABBER_DURATION
+
+        if key == "F":
+            self._move(math.copysign(self.SPEED, value), 0, abs(value) / 10 / self.SPEED)
+        elif key == "R":
+            self._move(0, math.copysign(self.ROTATION_SPEED, value), abs(value) / self.ROTATION_SPEED)
+
+        if key == "F":
+            self.forward_distance = max(self.forward_distance - value / 10, 0)
+        elif key == "W":
+            self.forward_distance = min(self.forward_distance, value / 10)
+        elif key == "S":
+            now = time.perf_counter()
+            self._hand_move = (now, self._interpolate(self._hand_move, self.hand_angle, now),
+                               duration * self.time_scale)
+            self.hand_angle = value
+        return duration
+
+    def _completer(self):
+        with self._timers_lock:
+            while not self._stopping.is_set():
+                if not self._timers:
+                    self._timers_lock.wait()
+                    continue
+                deadline, suffix = self._timers[0]
+                delay = deadline - time.perf_counter()
+                if delay > 0:
+                    self._timers_lock.wait(delay)
+                    continue
+                heapq.heappop(self._timers)
+                self.write_line(f"OK{suffix}")
+
+    def _telemetry_sender(self):
+        if self.telemetry_rate <= 0:
+            return
+        period = 1 / self.telemetry_rate
+        next_time = time.perf_counter()
+        while not self._stopping.wait(max(next_time - time.perf_counter(), 0)):
+            if self.binary_telemetry:
+                self.write(telemetry.encode_frame(self._telemetry_seq, self.telemetry()))
+                self._telemetry_seq += 1
+            else:
+                self.write_line(" ".join(str(v) for v in self.telemetry()))
+            next_time += period
+
+
+if __name__ == "__main__":
+    with VirtualArduino() as board:
+        print(f"Virtual board: {board.port}")
+        print(f"Mini-terminal: python -m serial.tools.miniterm {board.port}")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
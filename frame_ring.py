@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+from multiprocessing.shared_memory import SharedMemory
+
+import cv2
+import numpy as np
+
+from shared_block import shared_ndarray
+
+
+Area = tuple[tuple[int, int], tuple[int, int]]     # ((min_x, max_x), (min_y, max_y)), как в grab_helper.get_area
+
+
+class Frame:
+    """
+    Закреплённый слот FrameRing: пока кадр не отпущен (release или выход из with), камера в этот слот не пишет.
+    image и hsv - массивы прямо в общей памяти, без копирования.
+    В hsv действительны только области, для которых вызван ensure_hsv
+    """
+
+    image: np.ndarray
+    hsv: np.ndarray
+    generation: int
+    time: float
+
+    def __init__(self, ring: "FrameRing", slot: int, generation: int, time: float):
+        self._ring = ring
+        self.slot = slot
+        self.generation = generation
+        self.time = time
+        self.image = ring.images[slot]
+        self.hsv = ring.hsv[slot]
+        self._converted_areas = set()
+
+    def ensure_hsv(self, area: Area) -> np.ndarray:
+        """
+        Гарантирует, что область area в hsv сконвертирована. Зарегистрированные области камера конвертирует сама
+        при захвате, остальные конвертируются здесь один раз на кадр
+        :return: hsv всего кадра
+        """
+        if area not in self._converted_areas:
+            self._ring.convert_area(self.slot, area)
+            self._converted_areas.add(area)
+        return self.hsv
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def release(self):
+        if self._ring is not None:
+            self._ring.unpin(self.slot)
+            self._ring = None
+
+
+class FrameRing:
+    """
+    Несколько слотов кадров (BGR и HSV) в общей памяти. Камера пишет каждый новый кадр в свободный слот
+    и только после этого объявляет его последним, поэтому читатель никогда не видит наполовину записанный кадр.
+    Читатель закрепляет последний готовый слот (pin_latest) и работает с ним без копирования.
+
+    У каждого кадра есть номер поколения: растёт на 1 с каждым опубликованным кадром, 0 - кадров ещё не было.
+    Один писатель, читателей сколько угодно.
+
+    HSV всего кадра не считается: потребители регистрируют нужные области (register_roi), и писатель
+    конвертирует только их. Какие области в слоте уже сконвертированы, хранится в маске слота,
+    так что каждая область конвертируется не больше одного раза на кадр.
+    """
+
+    _HEADER_SIZE = 64
+    MAX_ROIS = 16
+
+    shape: tuple[int, int, int]
+    slots: int
+
+    def __init__(self, shape: tuple[int, int, int], slots: int = 4, name: str | None = None, lock=None,
+                 condition=None):
+        self.shape = tuple(shape)
+        self.slots = slots
+
+        frame_size = int(np.prod(shape))
+        slot_header_size = slots * 8 * 4
+        rois_offset = self._HEADER_SIZE + slot_header_size
+        images_offset = (rois_offset + self.MAX_ROIS * 5 * 8 + 63) // 64 * 64
+        size = images_offset + 2 * slots * frame_size
+
+        self._shared_memory = SharedMemory(name, create=name is None, size=size)
+        self._lock = lock if lock is not None else multiprocessing.Lock()
+        self._condition = condition if condition is not None else multiprocessing.Condition()
+
+        memory = self._shared_memory
+        # [0] - последний готовый слот (-1 - нет), [1] - поколение последнего кадра
+        self._header = shared_ndarray(memory, (2, ), np.int64)
+        self._generations = shared_ndarray(memory, (slots, ), np.int64, self._HEADER_SIZE)
+        self._times = shared_ndarray(memory, (slots, ), np.float64, self._HEADER_SIZE + slots * 8)
+        self._pins = shared_ndarray(memory, (slots, ), np.int64, self._HEADER_SIZE + slots * 16)
+        # биты - сконвертированные в HSV области из _rois
+        self._converted = shared_ndarray(memory, (slots, ), np.int64, self._HEADER_SIZE + slots * 24)
+        # min_x, max_x, min_y, max_y, число подписчиков (0 - запись свободна)
+        self._rois = shared_ndarray(memory, (self.MAX_ROIS, 5), np.int64, rois_offset)
+        self.images = shared_ndarray(memory, (slots, ) + self.shape, np.uint8, images_offset)
+        self.hsv = shared_ndarray(memory, (slots, ) + self.shape, np.uint8, images_offset + slots * frame_size)
+
+        if name is None:
+            self._header[0] = -1
+
+    def __reduce__(self):
+        return self.__class__, (self.shape, self.slots, self._shared_memory.name, self._lock, self._condition)
+
+    def unlink(self):
+        self._shared_memory.unlink()
+
+    @property
+    def generation(self) -> int:
+        return int(self._header[1])
+
+    @property
+    def latest_slot(self) -> int:
+        return int(self._header[0])
+
+    @property
+    def latest_time(self) -> float:
+        slot = int(self._header[0])
+        return float(self._times[slot]) if slot >= 0 else 0.0
+
+    def begin_write(self) -> int | None:
+        """
+        Выбирает слот для нового кадра: не последний готовый, не закреплённый, самый старый из таких.
+        :return: номер слота или None, если все слоты заняты читателями (кадр придётся пропустить)
+        """
+        with self._lock:
+            latest = int(self._header[0])
+            best = None
+            for slot in range(self.slots):
+                if slot == latest or self._pins[slot] > 0:
+                    continue
+                if best is None or self._generations[slot] < self._generations[best]:
+                    best = slot
+            if best is not None:
+                self._generations[best] = 0     # слот больше не содержит готового кадра
+                self._converted[best] = 0
+            return best
+
+    def register_roi(self, area: Area) -> int:
+        """
+        Подписывается на область: писатель будет конвертировать её в HSV в каждом кадре.
+        Одинаковые области разных потребителей конвертируются один раз
+        :return: номер области для unregister_roi
+        """
+        (min_x, max_x), (min_y, max_y) = area
+        with self._lock:
+            free = None
+            for index in range(self.MAX_ROIS):
+                roi = self._rois[index]
+                if roi[4] > 0 and tuple(roi[:4]) == (min_x, max_x, min_y, max_y):
+                    roi[4] += 1
+                    return index
+                if roi[4] == 0 and free is None:
+                    free = index
+            if free is None:
+                raise OverflowError(f"More than {self.MAX_ROIS} different ROIs")
+            self._rois[free] = (min_x, max_x, min_y, max_y, 1)
+            return free
+
+    def unregister_roi(self, index: int):
+        with self._lock:
+            if self._rois[index][4] > 0:
+                self._rois[index][4] -= 1
+            if self._rois[index][4] == 0:
+                self._converted &= ~(1 << index)     # запись могут занять под другую область
+
+    def active_rois(self) -> list[tuple[int, Area]]:
+        rois = self._rois.copy()
+        return [(index, ((int(r[0]), int(r[1])), (int(r[2]), int(r[3]))))
+                for index, r in enumerate(rois) if r[4] > 0]
+
+    def write_hsv(self, slot: int, image: np.ndarray):
+        """
+        Конвертирует в HSV слота все зарегистрированные области кадра image. Вызывает писатель до publish
+        """
+        mask = 0
+        for index, ((min_x, max_x), (min_y, max_y)) in self.active_rois():
+            self.hsv[slot, min_y:max_y, min_x:max_x] = cv2.cvtColor(image[min_y:max_y, min_x:max_x],
+                                                                    cv2.COLOR_BGR2HSV)
+            mask |= 1 << index
+        self._converted[slot] = mask
+
+    def convert_area(self, slot: int, area: Area):
+        """
+        Конвертирует область закреплённого слота, если писатель не сделал этого при захвате
+        """
+        (min_x, max_x), (min_y, max_y) = area
+        with self._lock:
+            converted = int(self._converted[slot])
+            for index, roi in enumerate(self._rois):
+                if converted >> index & 1 and roi[0] <= min_x and max_x <= roi[1] and roi[2] <= min_y and max_y <= roi[3]:
+                    return
+        # несколько читателей могут сконвертировать одну область одновременно - они пишут одно и то же
+        self.hsv[slot, min_y:max_y, min_x:max_x] = cv2.cvtColor(self.images[slot, min_y:max_y, min_x:max_x],
+                                                                cv2.COLOR_BGR2HSV)
+
+    def publish(self, slot: int, t: float) -> int:
+        """
+        Объявляет записанный слот последним кадром
+        :return: поколение кадра
+        """
+        with self._lock:
+            generation = int(self._header[1]) + 1
+            self._times[slot] = t
+            self._generations[slot] = generation
+            self._header[0] = slot
+            self._header[1] = generation
+
+        with self._condition:
+            self._condition.notify_all()
+        return generation
+
+    def wait(self, after_generation: int, timeout: float | None = None) -> int:
+        """
+        Ждёт кадра с поколением больше after_generation
+        :return: поколение последнего кадра; равно after_generation, если вышел таймаут
+        """
+        if int(self._header[1]) > after_generation:
+            return int(self._header[1])
+        with self._condition:
+            self._condition.wait_for(lambda: int(self._header[1]) > after_generation, timeout)
+        return int(self._header[1])
+
+    def pin_latest(self) -> Frame | None:
+        """
+        Закрепляет последний готовый кадр. None, если кадров ещё не было
+        """
+        with self._lock:
+            slot = int(self._header[0])
+            if slot < 0:
+                return None
+            self._pins[slot] += 1
+            return Frame(self, slot, int(self._generations[slot]), float(self._times[slot]))
+
+    def pin_after(self, after_generation: int, timeout: float | None = None) -> Frame | None:
+        """
+        Ждёт кадра новее after_generation и закрепляет последний кадр. None, если вышел таймаут
+        """
+        if self.wait(after_generation, timeout) <= after_generation:
+            return None
+        return self.pin_latest()
+
+    def unpin(self, slot: int):
+        with self._lock:
+            self._pins[slot] -= 1
+
+
+def _fill_frames(ring: FrameRing, count: int):
+    for i in range(1, count + 1):
+        slot = ring.begin_write()
+        if slot is None:
+            continue
+        ring.images[slot][:] = i % 256
+        ring.hsv[slot][:] = i % 256
+        ring.publish(slot, float(i))
+
+
+if __name__ == "__main__":
+    # проверка: читатель, закрепивший кадр, видит его целиком, пока писатель в другом процессе пишет дальше
+    ring = FrameRing((480, 640, 3), slots=3)
+    writer = multiprocessing.Process(target=_fill_frames, args=(ring, 2000))
+    writer.start()
+    checked = 0
+    while writer.is_alive() or checked == 0:
+        frame = ring.pin_latest()
+        if frame is None:
+            continue
+        with frame:
+            value = frame.image[0, 0, 0]
+            assert (frame.image == value).all() and (frame.hsv == value).all(), "torn frame"
+            assert frame.generation % 256 == value
+        checked += 1
+    writer.join()
+    print(f"generation {ring.generation}, checked {checked} frames, no torn frames")
+    ring.unlink()
@@ -1,6 +1,13 @@
 import cv2
 import random
 import math
+import glob
+import os
+import sys
+
+import numpy as np
+
+import debug_bus
 
 GRABBER_COLOR_0_MIN = (170, 40, 40)
 GRABBER_COLOR_0_MAX = (180, 255, 255)
@@ -24,6 +31,11 @@ CUBE_MAX_AREA = 60000
 
 CUBE_FIND_AREA = (0, 1), (0, 0.9)
 
+# 2 или 4: кубы сначала ищутся на изображении, уменьшенном во столько раз, затем центр уточняется
+# в полном разрешении внутри найденного прямоугольника. 1 - сразу в полном разрешении
+DETECTION_SCALE = 1
+_COARSE_AREA_SLACK = 2      # площадь на уменьшенном изображении неточная, окончательно её проверяет уточнение
+
 CAMERA_DISTANCE = 740
 
 COLORS = {
@@ -45,7 +57,7 @@ def find_grabber_center(image_hsv: cv2.UMat, area: tuple[tuple[int, int], tuple[
     image_hsv = image_hsv[area[1][0]:area[1][1], area[0][0]:area[0][1]]
 
     mask = cv2.inRange(image_hsv, GRABBER_COLOR_0_MIN, GRABBER_COLOR_0_MAX) + cv2.inRange(image_hsv, GRABBER_COLOR_1_MIN, GRABBER_COLOR_1_MAX)
-    cv2.imshow("Mask", mask)
+    debug_bus.show("Grabber mask", mask)
 
     contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     if len(contours) < 2:
@@ -65,14 +77,88 @@ def find_grabber_center(image_hsv: cv2.UMat, area: tuple[tuple[int, int], tuple[
     return center
 
 
-def find_cube(image_hsv: cv2.UMat, area: tuple[tuple[int, int]], color: str) -> tuple[int | None, int | None, bool | None]:
+def _downscale(image: np.ndarray, scale: int) -> np.ndarray:
+    return cv2.resize(image, (image.shape[1] // scale, image.shape[0] // scale), interpolation=cv2.INTER_NEAREST)
+
+
+def _refine_area(area: tuple[tuple[int, int], tuple[int, int]], box: tuple[int, int, int, int],
+                 scale: int) -> tuple[tuple[int, int], tuple[int, int]]:
+    """
+    Прямоугольник (x, y, w, h) уменьшенного изображения области area -> область полного изображения
+    с запасом в один пиксель уменьшенного изображения
+    """
+    x, y, w, h = box
+    (min_x, max_x), (min_y, max_y) = area
+    return ((max(min_x, min_x + (x - 1) * scale), min(max_x, min_x + (x + w + 1) * scale)),
+            (max(min_y, min_y + (y - 1) * scale), min(max_y, min_y + (y + h + 1) * scale)))
+
+
+def _cut_by_refine_area(box: tuple[int, int, int, int], area: tuple[tuple[int, int], tuple[int, int]],
+                        full_area: tuple[tuple[int, int], tuple[int, int]]) -> bool:
+    """
+    Касается ли прямоугольник (x, y, w, h) в координатах area края area, который не является краем full_area:
+    тогда на уменьшенном изображении кусок распался, и в полном разрешении он продолжается за area
+    """
+    x, y, w, h = box
+    (min_x, max_x), (min_y, max_y) = area
+    (full_min_x, full_max_x), (full_min_y, full_max_y) = full_area
+    return ((x == 0 and min_x > full_min_x) or (y == 0 and min_y > full_min_y) or
+            (min_x + x + w == max_x and max_x < full_max_x) or (min_y + y + h == max_y and max_y < full_max_y))
+
+
+def _coarse_cube_area(image_hsv: np.ndarray, area: tuple[tuple[int, int], tuple[int, int]], color: str,
+                      scale: int) -> tuple[tuple[int, int], tuple[int, int]] | None:
+    """
+    Ищет самый большой подходящий по площади кусок цвета на уменьшенном изображении
+    :return: область полного изображения вокруг него или None
+    """
+    small = _downscale(image_hsv[area[1][0]:area[1][1], area[0][0]:area[0][1]], scale)
+    mask = cv2.inRange(small, *COLORS[color])
+    debug_bus.show("Coarse mask", mask)
+
+    min_area = CUBE_MIN_AREA / scale ** 2 / _COARSE_AREA_SLACK
+    max_area = CUBE_MAX_AREA / scale ** 2 * _COARSE_AREA_SLACK
+    biggest_area = 0
+    biggest = None
+    cnts, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    for cnt in cnts:
+        a = cv2.contourArea(cnt)
+        if min_area <= a <= max_area and a > biggest_area:
+            biggest_area = a
+            biggest = cnt
+    if biggest is None:
+        return None
+    return _refine_area(area, cv2.boundingRect(biggest), scale)
+
+
+def find_cube(image_hsv: cv2.UMat, area: tuple[tuple[int, int]], color: str,
+              scale: int | None = None) -> tuple[int | None, int | None, bool | None]:
+    """
+    :param scale: уменьшение для грубого поиска, по умолчанию DETECTION_SCALE. Площади и координаты
+                  всегда в пикселях полного изображения
+    """
+    return find_cube_box(image_hsv, area, color, scale)[:3]
+
+
+def find_cube_box(image_hsv: cv2.UMat, area: tuple[tuple[int, int]], color: str,
+                  scale: int | None = None) -> tuple[int | None, int | None, bool | None, tuple[int, int, int, int] | None]:
+    """
+    То же, что find_cube, и описанный прямоугольник куба (x, y, w, h) в координатах полного изображения
+    """
+    scale = DETECTION_SCALE if scale is None else scale
+    full_hsv, full_area = image_hsv, area
+    if scale > 1:
+        area = _coarse_cube_area(image_hsv, area, color, scale)
+        if area is None:
+            return None, None, None, None
+
     image_hsv = image_hsv[area[1][0]:area[1][1], area[0][0]:area[0][1]]
 
     contours = []
     clr = COLORS[color]
 
     mask = cv2.inRange(image_hsv, clr[0], clr[1])
-    cv2.imshow("Mask", mask)
+    debug_bus.show("Mask", mask)
 
     biggest_area = 0
     biggest = None
@@ -86,17 +172,22 @@ def find_cube(image_hsv: cv2.UMat, area: tuple[tuple[int, int]], color: str) ->
             biggest_area = a
             biggest = cnt
 
+    if scale > 1 and (biggest is None or _cut_by_refine_area(cv2.boundingRect(biggest), area, full_area)):
+        # грубый поиск ошибся: ищем как без него
+        return find_cube_box(full_hsv, full_area, color, 1)
+
     if biggest is not None:
         contours.append(biggest)
 
-    #cv2.imshow(f"Cnt {random.randint(0, 100)}", cv2.drawContours(img.copy(), contours, -1, (0, 255, 255), 1))
-    #cv2.waitKey(0)
+    if debug_bus.enabled:
+        debug_bus.show("Contours", cv2.drawContours(cv2.cvtColor(mask, cv2.COLOR_GRAY2BGR), contours, -1, (0, 255, 255), 2))
 
     center_x, center_y = int(image_hsv.shape[1] // 2), int(image_hsv.shape[0] // 2)
 
     closest_center = None
     closest_distance = -1
     closest_rotated = False
+    closest_box = None
     for cnt in contours:
         #approx = cv2.approxPolyDP(cnt, 15, True)
         #if not (4 <= len(approx) <= 6):
@@ -109,11 +200,14 @@ def find_cube(image_hsv: cv2.UMat, area: tuple[tuple[int, int]], color: str) ->
             closest_distance = dst
             closest_center = (cx, cy)
             closest_rotated = len(cnt) > 4
+            closest_box = cv2.boundingRect(cnt)
 
     if closest_center is None:
-        return None, None, None
+        return None, None, None, None
 
-    return closest_center[0] + area[0][0], closest_center[1] + area[1][0], closest_rotated
+    x, y, w, h = closest_box
+    return (closest_center[0] + area[0][0], closest_center[1] + area[1][0], closest_rotated,
+            (x + area[0][0], y + area[1][0], w, h))
 
 
 '''def find_yellow(image_hsv: cv2.UMat) -> bool:
@@ -128,8 +222,7 @@ def find_lines(image_hsv: cv2.UMat) -> list[tuple[tuple[int, int], tuple[int, in
     image_hsv = image_hsv[:450, :]
     mask = cv2.inRange(image_hsv, (0, -1, -1), (180, 40, 130))
 
-    cv2.imshow("Brown mask", mask)
-    cv2.waitKey(0)
+    debug_bus.show("Brown mask", mask)
 
     lines = []
 
@@ -146,40 +239,49 @@ def find_lines(image_hsv: cv2.UMat) -> list[tuple[tuple[int, int], tuple[int, in
         righty = int(((cols - x) * vy / vx) + y)
         lines.append(((cols - 1, righty), (0, lefty)))
 
+    if debug_bus.enabled:
+        lines_image = cv2.cvtColor(mask, cv2.COLOR_GRAY2BGR)
+        for line in lines:
+            lines_image = cv2.line(lines_image, line[0], line[1], (0, 255, 0), 2)
+        debug_bus.show("Lines", lines_image)
+
     return lines
 
 
 if __name__ == "__main__":
+    # python grab_helper.py [папка] - разметить найденное на test_images/grabber; с папкой изображения сохраняются в неё
+    output_dir = sys.argv[1] if len(sys.argv) > 1 else None
+    debug_bus.enable(output_dir)
 
-    image = cv2.imread("test_images/grabber/fit_line.png")
-    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-
-    lines = find_lines(hsv)
-    print(lines)
-
-    for line in lines:
-        image = cv2.line(image, line[0], line[1], (0, 255, 0), 2)
-
-    cv2.imshow("Lines", image)
-    cv2.waitKey(0)
-
-    '''for name in ("front", "45", "rot0", "rot1"):
-
-        image = cv2.imread(f"test_images/grabber/cube_red_{name}.jpg")
-
+    for path in sorted(glob.glob("test_images/grabber/*")):
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        name = os.path.splitext(os.path.basename(path))[0]
         hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
 
         grabber_find_area = get_area(image.shape[1], image.shape[0], GRABBER_FIND_AREA)
-
         grabber_x, grabber_y = find_grabber_center(hsv, grabber_find_area)
-        cv2.rectangle(image, (grabber_x-10, grabber_y-10), (grabber_x+10, grabber_y+10), (255, 255, 0), 1)
-
-        cube_x, cube_y, rotated = find_cube(hsv, grabber_find_area)
-        cv2.rectangle(image, (cube_x - 10, cube_y - 10), (cube_x + 10, cube_y + 10), (255 * rotated, 255 * (not rotated), 255), 1)
-
-        cv2.imshow(f"CUBE {name}", image)
-    cv2.waitKey(0)'''
-
-
-
-
+        cv2.rectangle(image, (grabber_x - 10, grabber_y - 10), (grabber_x + 10, grabber_y + 10), (255, 255, 0), 1)
+
+        cube_find_area = get_area(image.shape[1], image.shape[0], CUBE_FIND_AREA)
+        for color in COLORS:
+            cube_x, cube_y, rotated = find_cube(hsv, cube_find_area, color)
+            print(name, color, cube_x, cube_y, rotated)
+            if cube_x is None:
+                continue
+            cv2.rectangle(image, (cube_x - 10, cube_y - 10), (cube_x + 10, cube_y + 10),
+                          (255 * rotated, 255 * (not rotated), 255), 1)
+            cv2.putText(image, color, (cube_x + 12, cube_y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255))
+
+        for line in find_lines(hsv):
+            image = cv2.line(image, line[0], line[1], (0, 255, 0), 2)
+
+        if output_dir is None:
+            cv2.imshow(f"CUBE {name}", image)
+        else:
+            cv2.imwrite(os.path.join(output_dir, f"result_{name}.png"), image)
+
+    if output_dir is None:
+        cv2.waitKey(0)
+    debug_bus.disable()
@@ -7,46 +7,20 @@ from serial_robot import SerialRobot
 from camera import Camera
 from navigation import Navigator
 from driver import BTDriver
-import scanner
-import grab_helper
-import numpy as np
+from mission import MissionPlanner, PickupTarget
 import traceback
 
 
 def e1(driver: BTDriver):
-    hsv = driver.camera.current_image_hsv
+    planner = MissionPlanner(driver.navigator)
 
-    cube_area = grab_helper.get_area(hsv.shape[1], hsv.shape[0], grab_helper.CUBE_FIND_AREA)
+    targets = [
+        PickupTarget("cube0", "blue", 2),
+        #PickupTarget("cube1", "black", 2),
+    ]
+    plan = planner.plan(targets, finish="spawn")
 
-    shelf = 2
-
-    points = ("cube0", )#, "cube1")
-    colors = ("blue", "black")
-    i = 0
-    for point in points:
-
-        driver.go_to(point)
-
-        #driver.robot.set_servo_angle(130)
-
-        cx, cy, r = grab_helper.find_cube(hsv, cube_area, colors[i])
-        if None in (cx, cy):
-            continue
-
-        driver.take_item("blue")
-
-        driver.go_to("storage")
-
-        time.sleep(1)
-
-        driver.put(shelf)
-        time.sleep(2)
-
-        time.sleep(2)
-
-        i += 1
-
-    driver.go_to("spawn")
+    driver.run_mission(plan, planner)
 
 
 def main(robot: SerialRobot, camera: Camera):
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Планирование миссии по сбору кубов: порядок объезда целей с наименьшей оценкой времени по таблице
+маршрутов Navigator (Navigator.route_time). План выполняет BTDriver.run_mission.
+
+    planner = MissionPlanner(navigator)
+    plan = planner.plan([PickupTarget("cube0", "blue", 2), PickupTarget("cube1", "black", 1)])
+    driver.run_mission(plan, planner)
+"""
+import itertools
+import math
+
+from navigation import Navigator, PathNotFoundError
+
+
+class PickupTarget:
+    """
+    Куб цвета color, который надо взять в точке waypoint и поставить на полку shelf в точке destination
+    """
+
+    waypoint: str
+    color: str
+    shelf: int
+    destination: str
+
+    def __init__(self, waypoint: str, color: str, shelf: int, destination: str = "storage"):
+        self.waypoint = waypoint
+        self.color = color
+        self.shelf = shelf
+        self.destination = destination
+
+    def __repr__(self):
+        return f"PickupTarget({self.waypoint!r}, {self.color!r}, {self.shelf}, {self.destination!r})"
+
+
+class MissionPlan:
+    """
+    Робот из точки start по очереди берёт кубы targets и отвозит каждый на его полку, в конце едет в finish
+    """
+
+    start: str
+    targets: list[PickupTarget]
+    finish: str | None
+    estimate: float
+
+    def __init__(self, start: str, targets: list[PickupTarget], finish: str | None, estimate: float):
+        """
+        :param finish: None - миссия заканчивается у последней полки
+        :param estimate: оценка времени всей миссии, с
+        """
+        self.start = start
+        self.targets = targets
+        self.finish = finish
+        self.estimate = estimate
+
+    def __repr__(self):
+        order = " -> ".join(t.waypoint for t in self.targets)
+        return f"MissionPlan({self.start} -> {order} -> {self.finish}, {self.estimate:.1f} s)"
+
+
+class MissionPlanner:
+    """
+    В захвате помещается один куб, поэтому каждая цель - это подъезд к ней, take_item, дорога до её полки и put.
+    Порядок целей меняет только переезды от полки предыдущей цели к следующей (и первый и последний переезды).
+    До EXACT_LIMIT целей порядок ищется точно динамикой по подмножествам (Хелд - Карп), дальше - жадно
+    ближайшей целью с улучшением переносом одной цели на другое место, пока оно что-то даёт.
+    """
+
+    EXACT_LIMIT = 10
+    TAKE_TIME = 4.3     # с, take_item на эмуляторе (bench_mission)
+    PUT_TIME = 1.3      # с, put
+
+    navigator: Navigator
+
+    def __init__(self, navigator: Navigator):
+        self.navigator = navigator
+
+    def leg_time(self, source: str, target: str) -> float:
+        """
+        Оценка времени маршрута, с; math.inf, если маршрута нет
+        """
+        try:
+            return self.navigator.route_time(target, source)
+        except PathNotFoundError:
+            return math.inf
+
+    def _task_time(self, target: PickupTarget) -> float:
+        return self.TAKE_TIME + self.leg_time(target.waypoint, target.destination) + self.PUT_TIME
+
+    def estimate(self, start: str, targets: list[PickupTarget], finish: str | None) -> float:
+        """
+        Оценка времени миссии с целями в этом порядке, с
+        """
+        total = 0.0
+        position = start
+        for target in targets:
+            total += self.leg_time(position, target.waypoint) + self._task_time(target)
+            position = target.destination
+        if finish is not None:
+            total += self.leg_time(position, finish)
+        return total
+
+    def plan(self, targets: list[PickupTarget], start: str | None = None, finish: str | None = "") -> MissionPlan:
+        """
+        :param start: откуда, по умолчанию текущая точка навигатора
+        :param finish: куда вернуться в конце, по умолчанию в start; None - остаться у последней полки
+        """
+        start = self.navigator.current_waypoint.name if start is None else start
+        finish = start if finish == "" else finish
+        targets = list(targets)
+        if len(targets) <= self.EXACT_LIMIT:
+            order = self._exact(start, targets, finish)
+        else:
+            order = self._improve(start, self._nearest(start, targets), finish)
+        return MissionPlan(start, order, finish, self.estimate(start, order, finish))
+
+    def _exact(self, start: str, targets: list[PickupTarget], finish: str | None) -> list[PickupTarget]:
+        n = len(targets)
+        if n == 0:
+            return []
+        task = [self._task_time(t) for t in targets]
+        between = [[self.leg_time(a.destination, b.waypoint) for b in targets] for a in targets]
+        last = [0.0 if finish is None else self.leg_time(t.destination, finish) for t in targets]
+
+        # best[(mask, j)] - лучшее время, за которое выполнены цели из mask и последней - j; и предыдущая цель
+        best = {(1 << j, j): (self.leg_time(start, targets[j].waypoint) + task[j], None) for j in range(n)}
+        for size in range(2, n + 1):
+            for subset in itertools.combinations(range(n), size):
+                mask = sum(1 << j for j in subset)
+                for j in subset:
+                    previous_mask = mask & ~(1 << j)
+                    best[(mask, j)] = min(
+                        ((best[(previous_mask, i)][0] + between[i][j] + task[j], i)
+                         for i in subset if i != j),
+                        key=lambda item: item[0])
+
+        full = (1 << n) - 1
+        j = min(range(n), key=lambda j: best[(full, j)][0] + last[j])
+        order = []
+        mask = full
+        while j is not None:
+            order.append(targets[j])
+            mask, j = mask & ~(1 << j), best[(mask, j)][1]
+        return order[::-1]
+
+    def _nearest(self, start: str, targets: list[PickupTarget]) -> list[PickupTarget]:
+        remaining = list(targets)
+        order = []
+        position = start
+        while remaining:
+            target = min(remaining, key=lambda t: self.leg_time(position, t.waypoint))
+            remaining.remove(target)
+            order.append(target)
+            position = target.destination
+        return order
+
+    def _improve(self, start: str, order: list[PickupTarget], finish: str | None) -> list[PickupTarget]:
+        best = self.estimate(start, order, finish)
+        improved = True
+        while improved:
+            improved = False
+            for i in range(len(order)):
+                for j in range(len(order)):
+                    if i == j:
+                        continue
+                    candidate = order[:i] + order[i + 1:]
+                    candidate.insert(j, order[i])
+                    estimate = self.estimate(start, candidate, finish)
+                    if estimate < best - 1e-9:
+                        order, best, improved = candidate, estimate, True
+        return order
+
+    def advance(self, plan: MissionPlan, position: str) -> MissionPlan:
+        """
+        Первая цель плана выполнена, робот в position: остаток плана в том же порядке
+        """
+        targets = plan.targets[1:]
+        return MissionPlan(position, targets, plan.finish, self.estimate(position, targets, plan.finish))
+
+    def skip(self, plan: MissionPlan, position: str) -> MissionPlan:
+        """
+        Первая цель плана пропускается (куб не найден), робот в position. Остаток плана не планируется заново:
+        порядок сохраняется, только следующей ставится та из оставшихся целей, с которой выходит быстрее всего
+        """
+        targets = plan.targets[1:]
+        candidates = [targets] + [[targets[i]] + targets[:i] + targets[i + 1:] for i in range(1, len(targets))]
+        order = min(candidates, key=lambda c: self.estimate(position, c, plan.finish))
+        return MissionPlan(position, order, plan.finish, self.estimate(position, order, plan.finish))
+
+
+def test():
+    import random
+    import time
+
+    from driver import BTDriver
+
+    navigator = Navigator("locations/regional_graph.json", start="spawn")
+    navigator.set_compiler(BTDriver.compile_commands, BTDriver.ROUTES_VERSION, BTDriver.estimate_time)
+    planner = MissionPlanner(navigator)
+    targets = [PickupTarget("cube2", "green", 1), PickupTarget("cube0", "blue", 2), PickupTarget("cube1", "black", 1)]
+
+    plan = planner.plan(targets)
+    brute = min(itertools.permutations(targets), key=lambda order: planner.estimate("spawn", list(order), "spawn"))
+    assert abs(plan.estimate - planner.estimate("spawn", list(brute), "spawn")) < 1e-9
+    print(plan)
+
+    skipped = planner.skip(plan, plan.targets[0].waypoint)
+    assert len(skipped.targets) == 2 and plan.targets[0] not in skipped.targets
+    print(skipped)
+
+    # эвристика против точного поиска на случайных целях
+    random.seed(0)
+    points = ["cube0", "cube1", "cube2", "storage", "spawn"]
+    for n in (6, 8):
+        targets = [PickupTarget(random.choice(points[:3]), "blue", 1, random.choice(points[3:])) for _ in range(n)]
+        start = time.perf_counter()
+        exact = planner._exact("spawn", targets, "spawn")
+        exact_time = time.perf_counter() - start
+        heuristic = planner._improve("spawn", planner._nearest("spawn", targets), "spawn")
+        exact, heuristic = (planner.estimate("spawn", order, "spawn") for order in (exact, heuristic))
+        assert exact <= heuristic + 1e-9
+        print(f"{n} targets: exact {exact:.1f} s ({exact_time * 1000:.0f} ms), heuristic {heuristic:.1f} s")
+
+
+if __name__ == "__main__":
+    test()
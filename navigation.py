@@ -1,5 +1,10 @@
+import hashlib
+import heapq
+import itertools
 import os
 import os.path
+import pickle
+from typing import Callable
 
 from anytree import AnyNode, RenderTree, AsciiStyle
 from anytree.importer import DictImporter, JsonImporter
@@ -14,9 +19,19 @@ class PathNotFoundError(Exception):
 
 
 class Waypoint(AnyNode):
+    """
+    Точка локации. path_to - команды от родителя до точки, path_from - обратно. Необязательные time_to и
+    time_from, с, заменяют оценку времени этих команд при выборе маршрута (нужны, когда путь W неизвестен).
+    У корня может быть список edges - перекрёстные рёбра между именованными точками любых ветвей:
+        {"from": "cube1", "to": "cube2", "path": "W35 R90 W50", "path_back": "...", "time": 4.5, "time_back": 5}
+    path_back, time и time_back необязательны; без path_back ребро одностороннее.
+    """
+
     name: str
     path_to: str
     path_from: str
+    time_to: float | None
+    time_from: float | None
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -36,8 +51,29 @@ class Waypoint(AnyNode):
         if not hasattr(self, "name"):
             self.name = ""
 
+        if not hasattr(self, "time_to"):
+            self.time_to = None
+
+        if not hasattr(self, "time_from"):
+            self.time_from = None
+
+
+Route = tuple     # скомпилированный маршрут: команды в том виде, в каком их возвращает компилятор
+
 
 class Navigator:
+    """
+    Локация - дерево точек (path_to/path_from) и, если у корня есть edges, перекрёстные рёбра между ветвями.
+    Маршрут выбирается алгоритмом Дейкстры по оценке времени выполнения рёбер (см. set_compiler), на дереве
+    без edges это тот же единственный путь через общего предка.
+
+    Маршруты между всеми парами именованных точек компилируются при загрузке локации в таблицу
+    (find_route - поиск в словаре). Таблица сохраняется рядом с файлом локации (<файл>.routes) вместе с хэшем
+    JSON, поэтому при следующем запуске с тем же файлом читается готовой. Если файл локации меняется на диске,
+    таблица пересобирается при следующем find_route без перезапуска.
+    """
+
+    ROUTES_FORMAT = 2       # версия формата файла таблицы
 
     current_waypoint: Waypoint
 
@@ -45,11 +81,31 @@ class Navigator:
     _root_waypoint: Waypoint
     _walker: Walker
     _commands_separator: str
-
-    def __init__(self, location_path: str, start: str | None = None, commands_separator: str = " "):
+    _compiler: Callable[[list[str]], Route] | None
+    _compiler_version: int
+    _cost: Callable[[Route], float] | None
+    _routes: dict[tuple[str, str], tuple[Route, float]] | None
+    _location_stat: tuple[int, int] | None
+
+    def __init__(self, location_path: str, start: str | None = None, commands_separator: str = " ",
+                 compiler: Callable[[list[str]], Route] | None = None, compiler_version: int = 0,
+                 cost: Callable[[Route], float] | None = None):
+        """
+        :param compiler: превращает список команд маршрута в то, что вернёт find_route
+                         (BTDriver.compile_commands); по умолчанию маршрут - кортеж строк команд
+        :param compiler_version: входит в ключ кэша таблицы; увеличивается, когда меняется результат компилятора
+                                 или оценка cost
+        :param cost: оценка времени скомпилированных команд ребра, с (BTDriver.estimate_time);
+                     по умолчанию - число команд
+        """
         self._location_path = location_path
         self._commands_separator = commands_separator
+        self._compiler = compiler
+        self._compiler_version = compiler_version
+        self._cost = cost
+        self._routes = None
 
+        self._location_stat = self._stat()
         self._root_waypoint = Navigator.read_location(self._location_path)
         self._walker = Walker()
 
@@ -61,6 +117,156 @@ class Navigator:
         else:
             self.current_waypoint = self._root_waypoint
 
+    @property
+    def cache_path(self) -> str:
+        return self._location_path + ".routes"
+
+    def set_compiler(self, compiler: Callable[[list[str]], Route], version: int = 0,
+                     cost: Callable[[Route], float] | None = None):
+        """
+        Меняет компилятор маршрутов и оценку времени и сразу загружает или собирает таблицу
+        """
+        self._compiler = compiler
+        self._compiler_version = version
+        self._cost = cost
+        self._routes = None
+        self._load_routes()
+
+    def _stat(self) -> tuple[int, int] | None:
+        try:
+            st = os.stat(self._location_path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def reload_if_changed(self) -> bool:
+        """
+        Перечитывает локацию, если файл изменился с прошлой загрузки. Текущая точка сохраняется по имени,
+        если её больше нет - робот считается в корневой точке
+        :return: True, если локация перечитана
+        """
+        stat = self._stat()
+        if stat is None or stat == self._location_stat:
+            return False
+
+        try:
+            root = Navigator.read_location(self._location_path)
+        except ValueError as e:      # файл сохраняется прямо сейчас и ещё не дописан
+            print(f"Failed to reload location '{self._location_path}': {e}")
+            return False
+        self._location_stat = stat
+        self._root_waypoint = root
+        self._routes = None
+
+        name = self.current_waypoint.name
+        self.current_waypoint = self.get_waypoint(name) if name else None
+        if self.current_waypoint is None:
+            print(f"Waypoint '{name}' is not in the reloaded location. Starting at the root waypoint")
+            self.current_waypoint = self._root_waypoint
+        print(f"Reloaded location '{self._location_path}'")
+        return True
+
+    def _location_hash(self) -> str:
+        h = hashlib.sha256()
+        with open(self._location_path, "rb") as f:
+            h.update(f.read())
+        compiler = "" if self._compiler is None else self._compiler.__qualname__
+        cost = "" if self._cost is None else self._cost.__qualname__
+        h.update(f"\0{self.ROUTES_FORMAT}\0{self._commands_separator}\0{compiler}\0{cost}"
+                 f"\0{self._compiler_version}".encode())
+        return h.hexdigest()
+
+    def _load_routes(self):
+        key = self._location_hash()
+        try:
+            with open(self.cache_path, "rb") as f:
+                cached_key, routes = pickle.load(f)
+            if cached_key == key:
+                self._routes = routes
+                return
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            pass
+
+        self._routes = self.compile_routes()
+        # через временный файл: другой процесс не прочитает недописанную таблицу
+        temp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                pickle.dump((key, self._routes), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self.cache_path)
+        except OSError as e:
+            print(f"Failed to save the route table: {e}")
+
+    def _split(self, commands: str) -> list[str]:
+        return [c for c in commands.strip().split(self._commands_separator) if c]
+
+    def _graph(self) -> dict[Waypoint, list[tuple[Waypoint, list[str], float]]]:
+        """
+        :return: {точка: [(соседняя точка, команды, оценка времени, с), ...]}
+        """
+        compiler = self._compiler or tuple
+        cost = self._cost or len
+        graph = {}
+
+        def add(source: Waypoint, target: Waypoint, commands: str, duration: float | None):
+            commands = self._split(commands)
+            weight = duration if duration is not None else cost(compiler(commands))
+            graph[source].append((target, commands, weight))
+
+        for wp in anytree.PreOrderIter(self._root_waypoint):
+            graph[wp] = []
+        for wp in graph:
+            if wp.parent is not None:
+                add(wp.parent, wp, wp.path_to, wp.time_to)
+                add(wp, wp.parent, wp.path_from, wp.time_from)
+
+        for edge in getattr(self._root_waypoint, "edges", ()):
+            source, target = self.get_waypoint(edge["from"]), self.get_waypoint(edge["to"])
+            if source is None or target is None:
+                raise NameError(f"Unknown waypoint in edge {edge['from']} -> {edge['to']}")
+            add(source, target, edge["path"], edge.get("time"))
+            if "path_back" in edge:
+                add(target, source, edge["path_back"], edge.get("time_back"))
+        return graph
+
+    def compile_routes(self) -> dict[tuple[str, str], tuple[Route, float]]:
+        """
+        Самые быстрые по оценке маршруты между всеми парами именованных точек, без кэша
+        :return: {(откуда, куда): (маршрут, оценка времени, с)}; оценка - сумма оценок рёбер
+        """
+        graph = self._graph()
+        compiler = self._compiler or tuple
+        order = itertools.count()       # при равном времени heapq не сравнивает сами точки
+
+        routes = {}
+        for source in graph:
+            if not source.name:
+                continue
+            times = {source: 0.0}
+            previous = {}
+            queue = [(0.0, next(order), source)]
+            while queue:
+                duration, _, wp = heapq.heappop(queue)
+                if duration > times[wp]:
+                    continue
+                for target, commands, weight in graph[wp]:
+                    if duration + weight < times.get(target, float("inf")):
+                        times[target] = duration + weight
+                        previous[target] = (wp, commands)
+                        heapq.heappush(queue, (duration + weight, next(order), target))
+
+            for target, duration in times.items():
+                if target is source or not target.name:
+                    continue
+                legs = []
+                wp = target
+                while wp is not source:
+                    wp, commands = previous[wp]
+                    legs.append(commands)
+                commands = [c for leg in reversed(legs) for c in leg]
+                routes[(source.name, target.name)] = (compiler(commands), duration)
+        return routes
+
     @staticmethod
     def read_location(path: str) -> Waypoint:
         if not os.path.isfile(path):
@@ -82,6 +288,9 @@ class Navigator:
         self.current_waypoint = wp
 
     def find_path(self, target: Waypoint | str) -> list[str]:
+        """
+        Команды по дереву через общего предка, без перекрёстных рёбер и без таблицы
+        """
         if isinstance(target, str):
             _target = self.get_waypoint(target)
             if _target is None:
@@ -109,12 +318,59 @@ class Navigator:
 
         return result
 
+    def _table_entry(self, source: str, target: str) -> tuple[Route, float]:
+        self.reload_if_changed()
+        if self._routes is None:
+            self._load_routes()
+
+        entry = self._routes.get((source, target))
+        if entry is None:
+            if self.get_waypoint(target) is None:
+                raise NameError(f"Unknown waypoint: '{target}'")
+            raise PathNotFoundError(source, target)
+        return entry
+
+    def find_route(self, target: str) -> Route:
+        """
+        Скомпилированный маршрут от текущей точки до target из таблицы
+        """
+        source = self.current_waypoint.name
+        if source == target:
+            return ()
+        if not source:      # безымянной точки нет в таблице
+            return (self._compiler or tuple)(self.find_path(target))
+        return self._table_entry(source, target)[0]
+
+    def route_time(self, target: str, source: str | None = None) -> float:
+        """
+        Оценка времени маршрута из таблицы, с
+        :param source: откуда, по умолчанию текущая точка
+        """
+        source = self.current_waypoint.name if source is None else source
+        if source == target:
+            return 0.0
+        return self._table_entry(source, target)[1]
+
 
 if __name__ == "__main__":
-    navigator = Navigator("locations/main.json")
-    print(navigator.find_path("cube1"))
-    navigator.set_current_waypoint("cube1")
-    print(navigator.find_path("storage"))
-    navigator.set_current_waypoint("storage")
-    print(navigator.find_path("spawn"))
-    navigator.set_current_waypoint("spawn")
\ No newline at end of file
+    import sys
+    import time
+
+    path = sys.argv[1] if len(sys.argv) > 1 else "locations/regional.json"
+    start = time.perf_counter()
+    navigator = Navigator(path)
+    navigator.find_route("cube0")
+    print(f"route table: {len(navigator._routes)} routes in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        navigator.find_path("cube1")
+    print(f"find_path  {(time.perf_counter() - start):.3f} ms/call")
+    start = time.perf_counter()
+    for _ in range(1000):
+        navigator.find_route("cube1")
+    print(f"find_route {(time.perf_counter() - start):.3f} ms/call")
+
+    for target in ("cube1", "storage", "spawn"):
+        print(navigator.current_waypoint.name, "->", target, navigator.find_route(target))
+        navigator.set_current_waypoint(target)
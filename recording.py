@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""
+Запись кадров камеры в файл и воспроизведение записи вместо камеры.
+
+Запуск: python recording.py record out.frames [--camera 0] [--seconds 10]
+        python recording.py play out.frames [--max-speed] [--color blue]
+"""
+import argparse
+import contextlib
+import os
+import time
+
+import cv2
+import numpy as np
+
+from frame_ring import Area
+import telemetry
+from vision_worker import InlineVision
+
+_MAGIC = b"FRAMES01"
+_HEADER_DTYPE = np.dtype([
+    ("magic", "S8"),
+    ("shape", "<i4", (3, )),
+    ("reserved", "<i4"),
+    ("count", "<i8"),
+])
+_HEADER_SIZE = 64
+_GROW_FRAMES = 64   # на сколько кадров файл увеличивается за раз
+
+
+def record_dtype(shape: tuple[int, int, int]) -> np.dtype:
+    """
+    Запись файла: время захвата (time.time), телеметрия на момент захвата, кадр BGR
+    """
+    return np.dtype([
+        ("time", "<f8"),
+        ("telemetry", "<i4", (telemetry.TELEMETRY_LEN, )),
+        ("image", "u1", tuple(shape)),
+    ])
+
+
+class FrameRecorder:
+    """
+    Дописывает кадры в файл, отображённый в память. Записи фиксированного размера лежат подряд после заголовка,
+    так что индекс - это сами записи: i-й кадр находится по смещению, время каждого кадра - в его записи.
+    Счётчик кадров в заголовке обновляется после записи кадра, поэтому файл можно читать, пока идёт запись.
+    """
+
+    def __init__(self, path: str, shape: tuple[int, int, int]):
+        self.path = path
+        self.shape = tuple(shape)
+        self._dtype = record_dtype(self.shape)
+        self._file = open(path, "w+b")
+        self._capacity = 0
+        self._count = 0
+        self._grow()
+        self._header["magic"] = _MAGIC
+        self._header["shape"] = self.shape
+
+    def _grow(self):
+        self._capacity += _GROW_FRAMES
+        self._file.truncate(_HEADER_SIZE + self._capacity * self._dtype.itemsize)
+        self._header = np.memmap(self._file, _HEADER_DTYPE, "r+", 0, (1, ))
+        self._records = np.memmap(self._file, self._dtype, "r+", _HEADER_SIZE, (self._capacity, ))
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, image: np.ndarray, t: float, telemetry_values=None):
+        if self._count == self._capacity:
+            self._grow()
+        record = self._records[self._count]
+        record["time"] = t
+        record["telemetry"] = 0 if telemetry_values is None else telemetry_values
+        record["image"] = image
+        self._count += 1
+        self._header["count"] = self._count
+
+    def close(self):
+        self._records.flush()
+        del self._records, self._header
+        self._file.truncate(_HEADER_SIZE + self._count * self._dtype.itemsize)
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class FrameRecording:
+    """
+    Запись FrameRecorder, отображённая в память только для чтения: кадры не копируются и не читаются с диска целиком
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        header = np.fromfile(path, _HEADER_DTYPE, 1)[0]
+        if header["magic"] != _MAGIC:
+            raise ValueError(f"{path} is not a frame recording")
+        self.shape = tuple(int(v) for v in header["shape"])
+        count = int(header["count"])
+        self._records = np.memmap(path, record_dtype(self.shape), "r", _HEADER_SIZE, (count, ))
+        self.times = self._records["time"]
+        self.telemetry = self._records["telemetry"]
+        self.images = self._records["image"]
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    @property
+    def duration(self) -> float:
+        return float(self.times[-1] - self.times[0]) if len(self) else 0.0
+
+
+class ReplayFrame:
+    """
+    Кадр записи с тем же интерфейсом, что frame_ring.Frame. image смотрит прямо в файл,
+    hsv заполняется только для запрошенных через ensure_hsv областей
+    """
+
+    def __init__(self, image: np.ndarray, generation: int, time: float):
+        self.image = image
+        self.generation = generation
+        self.time = time
+        self.hsv = np.empty(image.shape, dtype=np.uint8)
+        self._converted_areas = set()
+
+    def ensure_hsv(self, area: Area) -> np.ndarray:
+        if area not in self._converted_areas:
+            (min_x, max_x), (min_y, max_y) = area
+            self.hsv[min_y:max_y, min_x:max_x] = cv2.cvtColor(self.image[min_y:max_y, min_x:max_x],
+                                                             cv2.COLOR_BGR2HSV)
+            self._converted_areas.add(area)
+        return self.hsv
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def release(self):
+        pass
+
+
+class ReplayCamera:
+    """
+    Воспроизводит запись FrameRecorder с интерфейсом Camera, чтобы гонять распознавание и визуальные циклы
+    BTDriver без робота.
+
+    В реальном времени последним считается кадр, который камера сняла бы к текущему моменту от начала
+    воспроизведения; пропуск кадров при медленной обработке такой же, как на роботе.
+    С max_speed каждый запрос нового кадра сразу отдаёт следующий кадр записи: обрабатываются все кадры,
+    результат не зависит от скорости машины.
+    """
+
+    def __init__(self, path: str, max_speed: bool = False):
+        self.recording = FrameRecording(path)
+        if len(self.recording) == 0:
+            raise ValueError(f"{path} is empty")
+        self.camera_index = path
+        self.image_size = self.recording.shape
+        self.max_speed = max_speed
+        self.display = False
+
+        self._start = time.time()
+        self._index = 0
+        self._frame = None
+
+        self.grabber_pos = None
+        self.object_pos = None
+        self.text = ""
+
+    def _current_index(self) -> int:
+        if self.max_speed:
+            return self._index
+        times = self.recording.times
+        elapsed = time.time() - self._start
+        return max(int(np.searchsorted(times, times[0] + elapsed, "right")) - 1, 0)
+
+    def _make_frame(self, index: int) -> ReplayFrame:
+        if self._frame is None or self._frame.generation != index + 1:
+            self._frame = ReplayFrame(self.recording.images[index], index + 1, float(self.recording.times[index]))
+        return self._frame
+
+    def release(self):
+        pass
+
+    def start_vision_worker(self, colors: tuple[str, ...], area: Area, processes: int | None = None) -> InlineVision:
+        """
+        См. Camera.start_vision_worker. Распознавание идёт в вызывающем процессе, processes не используется
+        """
+        return InlineVision(self, colors, area)
+
+    def stop_vision_worker(self):
+        pass
+
+    @property
+    def capture_fps(self) -> float:
+        return (len(self.recording) - 1) / self.recording.duration if self.recording.duration else 0.0
+
+    @property
+    def finished(self) -> bool:
+        return self._current_index() >= len(self.recording) - 1
+
+    @property
+    def telemetry(self) -> list[int]:
+        """
+        Телеметрия, записанная вместе с последним кадром
+        """
+        return self.recording.telemetry[self._current_index()].tolist()
+
+    def latest_frame(self) -> ReplayFrame:
+        return self._make_frame(self._current_index())
+
+    def wait_for_frame(self, after_generation: int, timeout: float | None = None) -> ReplayFrame | None:
+        if self.max_speed:
+            if after_generation >= len(self.recording):
+                return None
+            self._index = max(self._index, after_generation)
+            return self._make_frame(self._index)
+
+        if after_generation >= len(self.recording):
+            if timeout is not None:
+                time.sleep(timeout)
+            return None
+        wait = self.recording.times[after_generation] - self.recording.times[0] - (time.time() - self._start)
+        if timeout is not None and wait > timeout:
+            time.sleep(timeout)
+            return None
+        time.sleep(max(0.0, wait))
+        return self.latest_frame()
+
+    def frames(self, timeout: float | None = None, after_generation: int | None = None):
+        """
+        См. Camera.frames. В конце записи бросает TimeoutError, как камера, которая перестала присылать кадры
+        """
+        generation = self.frame_generation if after_generation is None else after_generation
+        while True:
+            frame = self.wait_for_frame(generation, timeout)
+            if frame is None:
+                raise TimeoutError("Recording ended")
+            yield frame
+            generation = frame.generation
+
+    @contextlib.contextmanager
+    def roi(self, area: Area):
+        yield
+
+    @property
+    def frame_generation(self) -> int:
+        return self._current_index() + 1
+
+    @property
+    def current_image(self) -> np.ndarray:
+        return self.recording.images[self._current_index()]
+
+    @property
+    def image_time(self) -> int:
+        return int(self.recording.times[self._current_index()] * 1000)
+
+    @property
+    def current_image_hsv(self) -> np.ndarray:
+        return cv2.cvtColor(self.current_image, cv2.COLOR_BGR2HSV)
+
+    def draw_grabber_pos(self, pos: tuple[int, int] | None):
+        self.grabber_pos = pos
+
+    def draw_object_pos(self, pos: tuple[int, int] | None):
+        self.object_pos = pos
+
+    def set_text(self, text: str):
+        self.text = text
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=("record", "play"))
+    parser.add_argument("path")
+    parser.add_argument("--camera", default="0", help="индекс камеры или видеофайл для записи")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--max-speed", action="store_true", help="воспроизводить без пауз между кадрами")
+    parser.add_argument("--color", default="blue", help="цвет куба для grab_helper.find_cube")
+    args = parser.parse_args()
+
+    if args.mode == "record":
+        from camera import Camera
+
+        camera = Camera(int(args.camera) if args.camera.isdigit() else args.camera, None, display=False)
+        camera.start_recording(args.path)
+        time.sleep(args.seconds)
+        camera.stop_recording()
+        camera.release()
+        print(f"{len(FrameRecording(args.path))} frames, {os.path.getsize(args.path) / 2 ** 20:.1f} MiB")
+        return
+
+    import grab_helper
+
+    camera = ReplayCamera(args.path, args.max_speed)
+    area = grab_helper.get_area(camera.image_size[1], camera.image_size[0], grab_helper.CUBE_FIND_AREA)
+    processed = found = 0
+    start = time.perf_counter()
+    with contextlib.suppress(TimeoutError):
+        for frame in camera.frames(timeout=1, after_generation=0):
+            cx, cy, rotated = grab_helper.find_cube(frame.ensure_hsv(area), area, args.color)
+            processed += 1
+            found += cx is not None
+    elapsed = time.perf_counter() - start
+    print(f"{processed} of {len(camera.recording)} frames in {elapsed:.2f} s, cube found in {found}")
+
+
+if __name__ == "__main__":
+    main()
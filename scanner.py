@@ -1,20 +1,273 @@
+import ctypes
+import multiprocessing
+import time
+
 import cv2
+import numpy as np
+
+from shared_block import SharedStruct
+from frame_ring import FrameRing
+
+
+class QRScanner:
+    """
+    Декодер QR-кодов с одним детектором на всё время работы. Проходы от быстрого к медленному:
+    окрестность кода, найденного в прошлый раз, в полном разрешении; поиск на уменьшенном в scale раз
+    сером кадре и декодирование найденной области в полном разрешении; весь кадр в полном разрешении.
+    """
+
+    def __init__(self, scale: int = 2, roi_margin: float = 0.5):
+        """
+        :param scale: во сколько раз уменьшается кадр для быстрого поиска; при 3 и больше модули
+                      кода с 2-3 метров уже не различаются
+        :param roi_margin: окрестность прошлого кода, в долях его размера с каждой стороны
+        """
+        self.scale = scale
+        self.roi_margin = roi_margin
+        self._detector = cv2.QRCodeDetector()
+        self._last_points = None
+        self.last_pass = None     # каким проходом найден последний код: "roi", "scaled", "full"
+
+    def _remember(self, points: np.ndarray | None, offset: tuple[int, int] = (0, 0)):
+        self._last_points = None if points is None else points.reshape(-1, 2) + offset
+
+    def _decode_roi(self, gray: np.ndarray) -> str | None:
+        (min_x, min_y), (max_x, max_y) = self._last_points.min(axis=0), self._last_points.max(axis=0)
+        margin_x, margin_y = (max_x - min_x) * self.roi_margin, (max_y - min_y) * self.roi_margin
+        min_x, min_y = int(max(0, min_x - margin_x)), int(max(0, min_y - margin_y))
+        max_x, max_y = int(min(gray.shape[1], max_x + margin_x)), int(min(gray.shape[0], max_y + margin_y))
+        text, points, _ = self._detector.detectAndDecode(gray[min_y:max_y, min_x:max_x])
+        if not text:
+            return None
+        self._remember(points, (min_x, min_y))
+        return text
+
+    def _decode_scaled(self, gray: np.ndarray) -> str | None:
+        small = cv2.resize(gray, (gray.shape[1] // self.scale, gray.shape[0] // self.scale),
+                           interpolation=cv2.INTER_AREA)
+        found, points = self._detector.detect(small)
+        if not found:
+            return None
+        points = points * self.scale
+        text, _ = self._detector.decode(gray, points)
+        if not text:
+            return None
+        self._remember(points)
+        return text
+
+    def _decode_full(self, bgr_image: np.ndarray) -> str | None:
+        retval, decoded_info, points, straight_qrcode = self._detector.detectAndDecodeMulti(bgr_image)
+        for c, p in zip(decoded_info, points if retval else ()):
+            if c:
+                self._remember(p)
+                return c
+        return None
+
+    def decode(self, bgr_image: cv2.UMat, full: bool = True) -> str | None:
+        """
+        :param full: если быстрые проходы ничего не нашли, искать во всём кадре в полном разрешении
+        """
+        gray = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2GRAY)
+        if self._last_points is not None:
+            text = self._decode_roi(gray)
+            if text:
+                self.last_pass = "roi"
+                return text
+            self._last_points = None
+
+        text = self._decode_scaled(gray)
+        if text:
+            self.last_pass = "scaled"
+            return text
+
+        if full:
+            text = self._decode_full(bgr_image)
+            if text:
+                self.last_pass = "full"
+                return text
+        self.last_pass = None
+        return None
+
+
+_scanner = None
 
 
 def read_qr_code(bgr_image: cv2.UMat) -> str | None:
+    global _scanner
+    if _scanner is None:
+        _scanner = QRScanner()
+    return _scanner.decode(bgr_image)
+
+
+class QRControl(SharedStruct):
+    """
+    Последний результат QRWorker и запросы к нему в общей памяти
+    """
+    _fields_ = [
+        ("is_releasing", ctypes.c_bool),
+        ("continuous", ctypes.c_bool),
+        ("requested", ctypes.c_int64),      # декодировать кадр не старше этого поколения
+        ("generation", ctypes.c_int64),     # поколение кадра, по которому получен результат; 0 - ещё не было
+        ("time", ctypes.c_double),          # время захвата этого кадра
+        ("found", ctypes.c_bool),
+        ("full", ctypes.c_bool),            # результат получен всеми проходами (или код найден быстрыми)
+        ("text", ctypes.c_char * 128),
+        ("code_generation", ctypes.c_int64),    # последний кадр, на котором код был найден
+        ("code_text", ctypes.c_char * 128),
+    ]
+
+
+class QRWorker:
+    """
+    Декодирование QR-кодов с кадров камеры в отдельном процессе. Результат хранится вместе с поколением кадра,
+    по которому он получен, поэтому latest и code читаются мгновенно, а повторный запрос по тому же кадру
+    не декодирует его заново.
 
-    qcd = cv2.QRCodeDetector()
-    retval, decoded_info, points, straight_qrcode = qcd.detectAndDecodeMulti(bgr_image)
-    for c in decoded_info:
-        if c:
-            return c
+    В непрерывном режиме декодируется каждый новый кадр, пока процесс успевает; полный проход по кадру
+    делается раз в FULL_EVERY кадров, на остальных - только быстрые (см. QRScanner).
+    Без непрерывного режима процесс ждёт request и на запрос делает все проходы. Если запрошенный кадр
+    уже декодирован только быстрыми проходами и код не найден, он декодируется заново всеми проходами.
+    """
+
+    FULL_EVERY = 5
+
+    def __init__(self, frames: FrameRing, continuous: bool = True):
+        self._control = QRControl.create()
+        self._control.continuous = continuous
+        self._result_ready = multiprocessing.Condition()
+        self._process = multiprocessing.Process(target=QRWorker.worker_loop, args=(
+            frames,
+            self._control,
+            self._result_ready,
+        ))
+        self._process.start()
+
+    @staticmethod
+    def worker_loop(frames: FrameRing, control: QRControl, result_ready):
+        scanner = QRScanner()
+        image = np.empty(frames.shape, dtype=np.uint8)
+        generation = 0
+        full_generation = 0     # последний кадр, результат по которому получен всеми проходами
+        frame_time = 0.0
+        scanned = 0
+        while not control.is_releasing:
+            with result_ready:
+                if not result_ready.wait_for(lambda: control.is_releasing or control.continuous
+                                             or control.requested > full_generation, 0.5):
+                    continue
+            requested = control.requested > full_generation
+
+            if not requested or control.requested > generation:
+                frame = frames.pin_after(generation, 0.5)
+                if frame is None:
+                    continue
+                with frame:
+                    generation = frame.generation
+                    frame_time = frame.time
+                    np.copyto(image, frame.image)   # слот не держится закреплённым, пока идёт декодирование
+                scanned += 1
+            # иначе запрошен уже декодированный быстрыми проходами кадр: он ещё в image, добираем полный проход
+
+            full = requested or (scanned - 1) % QRWorker.FULL_EVERY == 0
+            text = scanner.decode(image, full)
+            if full or text is not None:
+                full_generation = generation
+
+            values = dict(generation=generation, time=frame_time, found=text is not None,
+                          full=full or text is not None, text=(text or "").encode("utf-8")[:127])
+            if text is not None:
+                values.update(code_generation=generation, code_text=values["text"])
+            with result_ready:
+                control.write(**values)
+                result_ready.notify_all()
+
+    def set_continuous(self, continuous: bool):
+        with self._result_ready:
+            self._control.continuous = continuous
+            self._result_ready.notify_all()
+
+    def latest(self) -> tuple[str | None, int, float]:
+        """
+        Результат по последнему обработанному кадру, без ожидания
+        :return: текст кода или None, поколение кадра (0 - кадров ещё не было), время захвата кадра
+        """
+        found, text, generation, t = self._control.read("found", "text", "generation", "time")
+        return (text.decode("utf-8", "ignore") if found else None), generation, t
+
+    def code(self) -> tuple[str | None, int]:
+        """
+        Последний найденный код, даже если на следующих кадрах его уже не видно
+        :return: текст или None, поколение кадра, на котором он найден
+        """
+        text, generation = self._control.read("code_text", "code_generation")
+        return (text.decode("utf-8", "ignore") if generation else None), generation
+
+    def request(self, after_generation: int, timeout: float | None = None) -> str | None:
+        """
+        Декодирует кадр новее after_generation со всеми проходами и ждёт результата.
+        Если такой кадр уже обработан всеми проходами, результат берётся из кэша без декодирования
+        :return: текст кода или None, если кода нет или вышел таймаут
+        """
+        with self._result_ready:
+            self._control.requested = max(self._control.requested, after_generation + 1)
+            self._result_ready.notify_all()
+            if not self._result_ready.wait_for(lambda: self._control.generation > after_generation
+                                               and self._control.full, timeout):
+                return None
+        return self.latest()[0]
+
+    def release(self):
+        self._control.is_releasing = True
+        self._process.join(1)
+        self._control.unlink()
 
 
 def test():
-    pass
+    import glob
 
-if __name__ == "__main__":
-    test()
+    scanner = QRScanner()
+    for path in sorted(glob.glob("test_images/*/*")):
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        text = scanner.decode(image)
+        print(path, text, scanner.last_pass)
 
+    # повторный кадр с тем же кодом находится в окрестности прошлого
+    image = cv2.imread("test_images/qr/floor_qr.jpg")
+    assert scanner.decode(image) == "B3"
+    assert scanner.decode(image) == "B3" and scanner.last_pass == "roi"
 
+    frames = FrameRing(image.shape, 2)
+    worker = QRWorker(frames, continuous=False)
+    try:
+        slot = frames.begin_write()
+        np.copyto(frames.images[slot], image)
+        frames.publish(slot, time.time())
+        start = time.perf_counter()
+        assert worker.request(0, 5) == "B3"
+        print(f"request {(time.perf_counter() - start) * 1000:.1f} ms")
+        start = time.perf_counter()
+        assert worker.request(0, 5) == "B3"     # тот же кадр - из кэша
+        print(f"cached request {(time.perf_counter() - start) * 1000:.3f} ms")
+        assert worker.latest()[:2] == ("B3", 1) and worker.code() == ("B3", 1)
+    finally:
+        worker.release()
 
+    # в непрерывном режиме запрос по кадру без кода ждёт полного прохода по нему
+    worker = QRWorker(frames, continuous=True)
+    try:
+        blank = np.zeros_like(image)
+        for _ in range(QRWorker.FULL_EVERY + 1):
+            slot = frames.begin_write()
+            np.copyto(frames.images[slot], blank)
+            frames.publish(slot, time.time())
+            time.sleep(0.05)
+        assert worker.request(frames.generation - 1, 5) is None and worker._control.full
+    finally:
+        worker.release()
+        frames.unlink()
+
+
+if __name__ == "__main__":
+    test()
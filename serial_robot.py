@@ -1,37 +1,114 @@
-
 # -*- coding: utf-8 -*-
 import serial
 from serial.serialutil import SerialException
 
 import time
 import math
+import threading
 
 import multiprocessing
-from multiprocessing.managers import SharedMemoryManager
-from multiprocessing.shared_memory import ShareableList
-from multiprocessing import Value, Manager, Event
+from multiprocessing import Value, Event
 import ctypes
 
+import numpy as np
+
+from shared_block import SharedStruct
+import telemetry
+from telemetry import TelemetryDecoder, TelemetryRing
+from controllers import Controller, WallFollowController
+
+
+class CommandFuture:
+    """
+    Команда, отправленная через SerialRobot.send_command.
+    Позволяет дождаться подтверждения отправки ('+cmd') и выполнения ('OK') именно этой команды.
+    Времена - по time.monotonic в процессе обмена с платой.
+    """
+
+    seq: int
+    command: str
+
+    created_time: float
+    sent_time: float | None
+    completed_time: float | None
+    interrupted: bool
+
+    def __init__(self, seq: int, command: str):
+        self.seq = seq
+        self.command = command
+
+        self.created_time = time.monotonic()
+        self.sent_time = None
+        self.completed_time = None
+        self.interrupted = False
+
+        self._sent = threading.Event()
+        self._completed = threading.Event()
+
+    def __repr__(self):
+        return f"CommandFuture({self.seq}, {self.command!r}, sent={self.is_sent()}, done={self.done()})"
+
+    def is_sent(self) -> bool:
+        return self._sent.is_set()
+
+    def done(self) -> bool:
+        return self._completed.is_set()
+
+    def wait_sent(self, timeout: float | None = None) -> bool:
+        return self._sent.wait(timeout)
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """
+        Ждёт выполнения команды. Для команд без 'OK' выполнение совпадает с отправкой.
+        Прерванная следующей командой (в протоколе текущей прошивки) или потерянная команда тоже считается завершённой,
+        см. interrupted
+        """
+        return self._completed.wait(timeout)
+
+    def _set_sent(self, t: float):
+        self.sent_time = t
+        self._sent.set()
+
+    def _set_completed(self, t: float, interrupted: bool = False):
+        self.completed_time = t
+        self.interrupted = interrupted
+        if not self._sent.is_set():
+            self._set_sent(t)
+        self._completed.set()
+
+
+class WatcherControl(SharedStruct):
+    """
+    Параметры коррекции по стене, которые основной процесс передаёт watcher'у
+    """
+    _fields_ = [
+        ("status", ctypes.c_uint8),
+        ("left_correct_min", ctypes.c_int16),
+        ("left_correct_max", ctypes.c_int16),
+        ("target_distance", ctypes.c_int16),
+        ("command", ctypes.c_char * 16),
+    ]
+
 
 class SerialRobot:
 
     _telemetry_len: int
 
-    _shared_memory_manager: Manager
-    _shared_telemetry: ShareableList
-    _shared_command: Value
-    _shared_confirmations: Value
+    _shared_telemetry: TelemetryRing
+    _command_queue: multiprocessing.Queue
+    _command_seq: Value
+    _event_queue: multiprocessing.Queue
+    _futures: dict[int, CommandFuture]
+    _futures_dispatcher: threading.Thread
 
     _on_serial_ready: Event
-    _on_command_sent: Event
-    _on_command_completed: Event
     _on_releasing: Event
-    _on_telemetry_updated: Event
 
     _serial_io: multiprocessing.Process
 
     _watcher: multiprocessing.Process
-    _watcher_emergency_stop_distance: Value
+    _watcher_control: WatcherControl
+    _wall_controller: Controller
 
     RANGEFINDER_FORWARD = 0
     RANGEFINDER_RIGHT = 1
@@ -39,58 +116,92 @@ class SerialRobot:
 
     _rangefinder_direction: int
 
-    def __init__(self, port):
-        self._telemetry_len = 7
-        self._speed = 24.7436
+    SPEED = 24.7436         # см/с, скорость движения по F и W
+    ROTATION_SPEED = 90     # град/с, оценка для планирования маршрутов
+
+    # завершение действий без 'OK' по телеметрии: значение считается установившимся, когда SETTLE_SAMPLES
+    # пакетов подряд отличаются не больше чем на допуск; таймауты - только запасной вариант
+    SETTLE_SAMPLES = 3
+    HAND_TOLERANCE = 2              # град, telemetry[5]
+    HAND_TIMEOUT = 3                # с
+    RANGEFINDER_TOLERANCE = 2       # см, telemetry[0]
+    RANGEFINDER_MIN_TIME = 0.2      # с: раньше сервопривод не успевает повернуться, показания ещё старые
+    RANGEFINDER_TIMEOUT = 0.8       # с, прежняя фиксированная задержка
+
+    _READ_TIMEOUT = 0.1     # как часто процесс обмена проверяет _on_releasing, если плата молчит
+    _SEND_TIMEOUT = 1       # сколько ждать эха предыдущей команды перед отправкой следующей
+
+    _COMPLETING_COMMANDS = "FWRHS"      # команды, на которые плата присылает 'OK' по завершении
+    _STREAM_PERIOD = 0.1                # уставка D повторяется хотя бы так часто: без неё плата останавливается
+    _SEQ_MODULO = 100                   # номера команд на проводе
+
+    _EVENT_SENT = 0
+    _EVENT_COMPLETED = 1
+    _EVENT_INTERRUPTED = 2
+    _EVENT_LOST = 3
+
+    def __init__(self, port, window: int = 0, binary_telemetry: bool = False,
+                 wall_controller: Controller | None = None):
+        """
+        :param port: последовательный порт платы
+        :param window: 0 - протокол текущей прошивки, одна команда за раз;
+                       N > 0 - оконный протокол с номерами команд и до N команд в полёте (см. serial_io)
+        :param binary_telemetry: попросить плату слать телеметрию бинарными кадрами (telemetry.FRAME_DTYPE).
+                                 Текстовая телеметрия принимается в любом случае
+        :param wall_controller: регулятор движения вдоль стены (go(correct=True)), по умолчанию WallFollowController()
+        """
+        if not 0 <= window < SerialRobot._SEQ_MODULO // 2:
+            raise ValueError(f"window must be in [0, {SerialRobot._SEQ_MODULO // 2}), got {window}")
+
+        self._telemetry_len = telemetry.TELEMETRY_LEN
+        self._speed = SerialRobot.SPEED
         self._rangefinder_direction = SerialRobot.RANGEFINDER_FORWARD
         self._permanent_correction = 0
+        self._wall_controller = wall_controller if wall_controller is not None else WallFollowController()
 
-        self._shared_memory_manager = Manager()
-        self._shared_telemetry = ShareableList([0] * self._telemetry_len)
-        self._shared_command = self._shared_memory_manager.Value(ctypes.c_char_p, "")
-        self._shared_confirmations = self._shared_memory_manager.Value(ctypes.c_uint8, 1)
+        self._shared_telemetry = TelemetryRing()
+        self._command_queue = multiprocessing.Queue()
+        self._command_seq = Value(ctypes.c_uint32, 0)
+        self._event_queue = multiprocessing.Queue()
+        self._futures = {}
+        self._futures_lock = threading.Lock()
 
         self._on_serial_ready = Event()
-        self._on_command_sent = Event()
-        self._on_command_completed = Event()
         self._on_releasing = Event()
-        self._on_telemetry_updated = Event()
 
         self._serial_io = multiprocessing.Process(target=SerialRobot.serial_io, args=(
             port,
+            window,
             self._shared_telemetry,
-            self._shared_command,
-            self._shared_confirmations,
+            self._command_queue,
+            self._event_queue,
             self._on_serial_ready,
-            self._on_command_sent,
-            self._on_command_completed,
-            self._on_releasing,
-            self._on_telemetry_updated))
+            self._on_releasing))
 
         self._serial_io.start()
 
+        self._futures_dispatcher = threading.Thread(target=self._dispatch_events, daemon=True)
+        self._futures_dispatcher.start()
+
+        self._velocity = (0.0, 0.0)
+        self._velocity_cond = threading.Condition()
+        self._streamer = None
+
+        if binary_telemetry:
+            self.send_command(telemetry.BINARY_ON_COMMAND)
+
         self._on_serial_ready.wait()
 
-        self._watcher_status = self._shared_memory_manager.Value(ctypes.c_uint8, 0)
-        self._watcher_left_correct_min = self._shared_memory_manager.Value(ctypes.c_uint16, 0)
-        self._watcher_left_correct_max = self._shared_memory_manager.Value(ctypes.c_uint16, 0)
-        self._watcher_target_distance = self._shared_memory_manager.Value(ctypes.c_uint16, 0)
-        self._watcher_command = self._shared_memory_manager.Value(ctypes.c_char_p, "")
+        self._watcher_control = WatcherControl.create()
 
         self._watcher = multiprocessing.Process(target=SerialRobot.watcher, args=(
             self._permanent_correction,
             self._on_releasing,
-            self._on_telemetry_updated,
-            self._on_command_completed,
-            self._on_command_sent,
             self._shared_telemetry,
-            self._shared_command,
-            self._shared_confirmations,
-            self._watcher_status,
-            self._watcher_left_correct_min,
-            self._watcher_left_correct_max,
-            self._watcher_target_distance,
-            self._watcher_command
+            self._command_queue,
+            self._command_seq,
+            self._watcher_control,
+            self._wall_controller
         ))
         self._watcher.start()
 
@@ -98,18 +209,25 @@ class SerialRobot:
 
     @staticmethod
     def serial_io(port: str,
-                  shared_telemetry: ShareableList,
-                  shared_command: Value,
-                  shared_confirmations: Value,
+                  window: int,
+                  shared_telemetry: TelemetryRing,
+                  command_queue: multiprocessing.Queue,
+                  event_queue: multiprocessing.Queue,
                   on_serial_ready: Event,
-                  on_command_sent: Event,
-                  on_command_completed: Event,
-                  on_releasing: Event,
-                  on_telemetry_updated: Event):
+                  on_releasing: Event):
+        """
+        Процесс обмена с платой. Запись и чтение идут в отдельных потоках:
+        writer пишет команду сразу, как она появилась в очереди, не дожидаясь очередной строки от платы,
+        а основной поток разбирает строки по мере их прихода.
+
+        :param window: 0 - протокол текущей прошивки: одна команда без эха в полёте, 'OK' относится к последней
+                       команде с выполнением; N > 0 - оконный протокол: команды уходят как '<cmd>#<seq>\\n',
+                       плата отвечает '+<cmd>#<seq>' и 'OK#<seq>', без эха может быть до N команд
+        """
         trying = 3
         while trying > 0:
             try:
-                ser = serial.Serial(port, 115200, timeout=5)
+                ser = serial.Serial(port, 115200, timeout=SerialRobot._READ_TIMEOUT)
                 break
             except SerialException:
                 print("Connecting to serial failed")
@@ -120,148 +238,178 @@ class SerialRobot:
             print("Failed to connect to serial")
             return
 
-        on_serial_ready.set()
-        confirmations_left = shared_confirmations.value
-        waiting_for_sending = ""
-        while ser.is_open:
-            try:
-                bdata = ser.readline()
-                data = bdata.decode().strip()
-
-                print(f"SERIAL >>> {data}")
-
-                if on_releasing.is_set():
+        windowed = window > 0
+        cond = threading.Condition()
+        unsent = {}     # номер на проводе -> (seq, команда, подтверждений): отправлены, эха ещё нет
+        pending = {}    # номер на проводе -> [seq, подтверждений осталось]: эхо пришло, ждём 'OK'
+
+        def write(wire_seq: int, command: str):
+            if windowed:
+                command = f"{command}#{wire_seq}\n"
+            print(f"SEND SERIAL >>> {command.strip()}")
+            ser.write(command.encode("ascii"))
+
+        def writer():
+            while True:
+                item = command_queue.get()
+                if item is None or on_releasing.is_set():
                     break
+                seq, command, confirmations = item
+                wire_seq = seq % SerialRobot._SEQ_MODULO if windowed else 0
+
+                with cond:
+                    # без эха не больше window команд: иначе переполнится буфер приёма платы,
+                    # а текущая прошивка ещё и склеит соседние команды в одну
+                    if not cond.wait_for(lambda: len(unsent) < max(window, 1), SerialRobot._SEND_TIMEOUT):
+                        lost = next(iter(unsent))
+                        print(f"SERIAL NOT CONFIRMED >>> {unsent[lost][1]}")
+                        event_queue.put((unsent.pop(lost)[0], SerialRobot._EVENT_LOST, time.monotonic()))
+                    unsent[wire_seq] = (seq, command, confirmations)
+                    write(wire_seq, command)
+
+        def on_sent(wire_seq: int):
+            seq, command, confirmations = unsent.pop(wire_seq)
+            cond.notify_all()
+            t = time.monotonic()
+            event_queue.put((seq, SerialRobot._EVENT_SENT, t))
+
+            if confirmations <= 0 or command[:1] not in SerialRobot._COMPLETING_COMMANDS:
+                event_queue.put((seq, SerialRobot._EVENT_COMPLETED, t))
+                return
+            if not windowed:
+                # текущая прошивка прерывает выполняемую команду новой, а 'OK' без номера относится к последней
+                for interrupted_seq, _ in pending.values():
+                    event_queue.put((interrupted_seq, SerialRobot._EVENT_INTERRUPTED, t))
+                pending.clear()
+            pending[wire_seq] = [seq, confirmations]
+
+        def on_confirmed(wire_seq: int):
+            if wire_seq not in pending:
+                return
+            pending[wire_seq][1] -= 1
+            print(f"SERIAL CONFIRMED >>> {pending[wire_seq][1]} LEFT")
+            if pending[wire_seq][1] <= 0:
+                seq, _ = pending.pop(wire_seq)
+                event_queue.put((seq, SerialRobot._EVENT_COMPLETED, time.monotonic()))
+
+        def split_seq(data: str) -> tuple[str, int]:
+            if not windowed:
+                return data, 0
+            data, _, wire_seq = data.rpartition("#")
+            return data, int(wire_seq) if wire_seq.isdigit() else -1
+
+        writer_thread = threading.Thread(target=writer, daemon=True)
+        writer_thread.start()
+
+        decoder = TelemetryDecoder()
 
-                if data == "OK":
-                    confirmations_left -= 1
-                    print(f"SERIAL CONFIRMED >>> {confirmations_left} LEFT")
-                    if confirmations_left <= 0:
-                        on_command_completed.set()
-                        shared_confirmations.value = 1
-                elif data.startswith("+"):
-                    print(f"SEND SERIAL CONFIRMED >>> {data}")
-                    if data[1:].strip() == waiting_for_sending:
-                        on_command_sent.set()
-                        waiting_for_sending = ""
-                    else:
-                        shared_command.value = waiting_for_sending
-                else:
-                    splitted = data.split(" ")
-                    if any(splitted):
-                        bad_packet = False
-                        for i in range(len(splitted)):
-                            if splitted[i].isdigit():
-                                shared_telemetry[i] = int(splitted[i])
+        on_serial_ready.set()
+        while ser.is_open and not on_releasing.is_set():
+            try:
+                # всё, что уже пришло, одним чтением; бинарные кадры телеметрии разбираются пачкой
+                lines, frames = decoder.feed(ser.read(ser.in_waiting or 1))
+
+                for data in lines:
+                    print(f"SERIAL >>> {data}")
+
+                    if data.startswith("OK"):
+                        _, wire_seq = split_seq(data)
+                        with cond:
+                            on_confirmed(wire_seq)
+                    elif data.startswith("+"):
+                        print(f"SEND SERIAL CONFIRMED >>> {data}")
+                        command, wire_seq = split_seq(data[1:].strip())
+                        with cond:
+                            if wire_seq not in unsent:
+                                continue
+                            if command == unsent[wire_seq][1]:
+                                on_sent(wire_seq)
                             else:
-                                bad_packet = True
-                                break
-                        if not bad_packet:
-                            on_telemetry_updated.set()
-
-                if shared_command.value:
-                    print(f"SEND SERIAL >>> {shared_command.value}")
-                    waiting_for_sending = shared_command.value
-                    ser.write(shared_command.value.encode("ascii"))
-                    #print(f"SET CONFIRMATIONS: {shared_confirmations.value}")
-                    confirmations_left = shared_confirmations.value
-                    shared_command.value = ""
+                                write(wire_seq, unsent[wire_seq][1])
+                    else:
+                        values = telemetry.parse_text(data)
+                        if values is not None:
+                            shared_telemetry.append(values)
+
+                if len(frames):
+                    shared_telemetry.append(frames)
             except KeyboardInterrupt:
                 break
 
+        command_queue.put(None)
+        writer_thread.join()
         ser.close()
 
     @staticmethod
     def watcher(
             permanent_correction: float,
             on_releasing: Event,
-            on_telemetry_updated: Event,
-            on_command_completed: Event,
-            on_command_sent: Event,
-            telemetry: ShareableList,
-            shared_command: Value,
-            shared_confirms: Value,
-            status: Value,
-            left_correct_min: Value,
-            left_correct_max: Value,
-            target_distance: Value,
-            last_command: Value,
+            telemetry: TelemetryRing,
+            command_queue: multiprocessing.Queue,
+            command_seq: Value,
+            control: WatcherControl,
+            controller: Controller,
     ):
-
-        is_correcting = False
-        left_distance_buffer = []
-        left_distance_history = []
-        last_correct = 0
-        last_distance = -1
-        previous_speed_correction = 0
-
-        correction_interval = 0.1
-        buffer_size = 10
-        target_distance = 16
-        p_mult = 250
-        d_mult = 100
-        found_wall = False
-        found_wall_counter = 0
-
-        while not on_releasing.is_set():
-            on_telemetry_updated.wait()
-            on_telemetry_updated.clear()
-
-            t = time.time()
-
-            is_correcting = status.value == 0 and (left_correct_min.value != 0 or left_correct_max.value != 0)
+        """
+        Процесс коррекции движения. Вызывает controller строго раз в controller.period секунд со всей телеметрией,
+        пришедшей за период, и ставит его команду в очередь, не дожидаясь подтверждения платы:
+        частота регулирования не зависит от задержек обмена
+        """
+        telemetry_seq = telemetry.seq
+        was_correcting = False
+        next_time = time.monotonic()
+        while not on_releasing.wait(max(next_time - time.monotonic(), 0)):
+            next_time += controller.period
+            if next_time < time.monotonic():
+                next_time = time.monotonic()    # процесс не успевал - не пытаемся догнать пропущенные такты
+
+            samples = telemetry.since(telemetry_seq)
+            if len(samples):
+                telemetry_seq = int(samples["seq"][-1])
+
+            status, left_correct_min, left_correct_max = control.read("status", "left_correct_min", "left_correct_max")
+            is_correcting = status == 0 and (left_correct_min != 0 or left_correct_max != 0)
             if not is_correcting:
-                left_distance_buffer.clear()
-                left_distance_history.clear()
-                previous_speed_correction = 0
-                last_correct = 0
-                last_distance = -1
-                found_wall = False
-                found_wall_counter = 0
-            
-            if is_correcting:
-                time_delta = t - last_correct
-                if time_delta >= correction_interval:
-                    average_left_distance = telemetry[1] / 10
-                    if average_left_distance < 60:
-                        found_wall_counter += 1
-                        found_wall = found_wall or found_wall_counter > 3
-                    else:
-                        found_wall_counter = 0
-
-                    distance_error = target_distance - average_left_distance
-
-                    if found_wall:
-                        left_distance_buffer.append(distance_error)
+                if was_correcting:
+                    controller.reset()
+                was_correcting = False
+                continue
+            was_correcting = True
 
-                        if len(left_distance_buffer) > buffer_size:
-                            del left_distance_buffer[0]
+            output = controller.update(time.time(), samples)
+            if output is not None:
+                print("Correction", output)
+                command_queue.put((SerialRobot._next_seq(command_seq), f"{controller.command_key}{output}", 1))
 
-                        if len(left_distance_buffer) >= buffer_size :
-                            if last_distance != -1 and last_correct != 0:
-                                p_sign = 1
-                                d_sign = 1
-
-                                d_error = (left_distance_buffer[-1] - left_distance_buffer[0]) * d_mult * d_sign
-                                p_error = distance_error * p_mult * p_sign
-
-                                speed_correction = p_error + d_error
-                                print("Correction", target_distance - average_left_distance, speed_correction)
-
-                                if speed_correction != previous_speed_correction:
-                                    on_command_sent.clear()
-                                    shared_command.value = f"V{int(speed_correction)}"
-                                    on_command_sent.wait()
+    @property
+    def telemetry(self) -> list[int]:
+        return self._shared_telemetry.latest()
 
-                                previous_speed_correction = speed_correction
+    @property
+    def telemetry_seq(self) -> int:
+        """
+        Номер последнего пакета телеметрии, см. telemetry_since и wait_telemetry
+        """
+        return self._shared_telemetry.seq
 
-                            last_correct = t
-                            last_distance = average_left_distance
+    def telemetry_since(self, seq: int) -> np.ndarray:
+        """
+        Пакеты телеметрии (telemetry.RECORD_DTYPE) с номером больше seq, которые ещё хранятся в буфере
+        """
+        return self._shared_telemetry.since(seq)
 
+    def telemetry_window(self, seconds: float) -> np.ndarray:
+        """
+        Пакеты телеметрии (telemetry.RECORD_DTYPE) за последние seconds секунд
+        """
+        return self._shared_telemetry.window(seconds)
 
-    @property
-    def telemetry(self) -> list[int]:
-        return list(self._shared_telemetry)
+    def wait_telemetry(self, after_seq: int, timeout: float | None = None) -> int:
+        """
+        Ждёт пакета телеметрии с номером больше after_seq. Ждать могут любые процессы одновременно
+        :return: номер последнего пакета; равен after_seq, если вышел таймаут
+        """
+        return self._shared_telemetry.wait(after_seq, timeout)
 
     @property
     def forward_distance(self) -> int:
@@ -279,21 +427,59 @@ class SerialRobot:
     def hand_angle(self) -> int:
         return self._shared_telemetry[5]
 
+    @staticmethod
+    def _next_seq(command_seq: Value) -> int:
+        """
+        Номер команды, общий для всех процессов, которые ставят команды в очередь
+        """
+        with command_seq.get_lock():
+            command_seq.value += 1
+            return command_seq.value
+
+    def _dispatch_events(self):
+        """
+        Поток основного процесса: раздаёт события процесса обмена (отправлена, выполнена) ожидающим CommandFuture
+        """
+        while True:
+            item = self._event_queue.get()
+            if item is None:
+                break
+            seq, event, t = item
+            with self._futures_lock:
+                future = self._futures.get(seq)
+                if future is None:
+                    continue    # команда watcher'а
+                if event != SerialRobot._EVENT_SENT:
+                    del self._futures[seq]
+
+            if event == SerialRobot._EVENT_SENT:
+                future._set_sent(t)
+            else:
+                future._set_completed(t, interrupted=event != SerialRobot._EVENT_COMPLETED)
+
     def send_command(self, command: str,
                      await_sending: bool = True,
                      await_completion: bool = False,
                      await_completion_timeout: float = 20,
-                     required_confirmations: int = 1):
-        self._on_command_sent.clear()
-        self._on_command_completed.clear()
-        self._shared_confirmations.value = required_confirmations
-        self._shared_command.value = command
+                     required_confirmations: int = 1) -> CommandFuture:
+        """
+        Ставит команду в очередь на отправку
+        :param required_confirmations: сколько 'OK' ждать; 0 - команда считается выполненной после эха
+        :return: CommandFuture команды; с await_sending=False, await_completion=False вызов не блокируется
+        """
+        seq = SerialRobot._next_seq(self._command_seq)
+        future = CommandFuture(seq, command)
+        with self._futures_lock:
+            self._futures[seq] = future
+        self._command_queue.put((seq, command, required_confirmations))
 
         if await_sending and not await_completion:
-            self._on_command_sent.wait()
+            future.wait_sent()
 
         if await_completion:
-            self._on_command_completed.wait(timeout=await_completion_timeout)
+            future.wait(timeout=await_completion_timeout)
+
+        return future
 
     def go(self, distance: int, correct: bool = False, *args, wall_distance: int = 0):
         print(f"Going {distance if wall_distance == 0 else 'to wall ' + str(wall_distance)} {'(correction)' if correct else ''}")
@@ -305,21 +491,14 @@ class SerialRobot:
             self.switch_rangefinder(SerialRobot.RANGEFINDER_FORWARD)
 
         if correct:
-            self._watcher_left_correct_min.value = -5
-            self._watcher_left_correct_max.value = 5
-            self._watcher_target_distance.value = distance
-            self._watcher_command.value = cmd
+            self._watcher_control.write(left_correct_min=-5, left_correct_max=5,
+                                        target_distance=distance, command=cmd.encode("ascii"))
 
         if self._permanent_correction != 0:
             self.send_command(f"V{int(self._permanent_correction)}")
         self.send_command(cmd, await_completion=True, required_confirmations=1)
 
-        while self._watcher_status.value == 2:
-            self._on_command_completed.wait()
-
-        self._watcher_left_correct_min.value = 0
-        self._watcher_left_correct_max.value = 0
-        self._watcher_target_distance.value = 0
+        self._watcher_control.write(left_correct_min=0, left_correct_max=0, target_distance=0)
 
         if wall_distance > 0 and self.forward_distance - wall_distance > 10:
             self.go(distance, correct=correct, wall_distance=wall_distance)
@@ -333,6 +512,85 @@ class SerialRobot:
 
         self.send_command(f"R{degrees}", await_completion=wait, required_confirmations=1, await_completion_timeout=timeout)
 
+    def set_velocity(self, speed: float, turn: float):
+        """
+        Непрерывное движение: скорость вперёд, см/с, и скорость поворота, град/с (знак как у rotate).
+        Не блокируется: уставку отправляет поток потоковой отправки, см. _stream_velocity
+        """
+        with self._velocity_cond:
+            self._velocity = (speed, turn)
+            if self._streamer is None:
+                self._streamer = threading.Thread(target=self._stream_velocity, daemon=True)
+                self._streamer.start()
+            self._velocity_cond.notify_all()
+
+    def stop_streaming(self):
+        """
+        Останавливает робота после set_velocity и ждёт отправки команды остановки
+        """
+        with self._velocity_cond:
+            streamer, self._streamer = self._streamer, None
+            self._velocity_cond.notify_all()
+        if streamer is None:
+            return
+        streamer.join()
+        self.send_command("D0,0")
+
+    def _stream_velocity(self):
+        """
+        Поток потоковой отправки уставок: новая уставка уходит, как только отправлена предыдущая, промежуточные
+        заменяются последней и не копятся в очереди команд. Без изменений уставка повторяется раз в _STREAM_PERIOD
+        """
+        future = None
+        sent = None
+        next_time = 0.0
+        while True:
+            with self._velocity_cond:
+                self._velocity_cond.wait_for(lambda: self._streamer is None or self._velocity != sent
+                                             or time.monotonic() >= next_time, max(next_time - time.monotonic(), 0))
+                if self._streamer is None:
+                    return
+            if future is not None:
+                future.wait_sent(SerialRobot._SEND_TIMEOUT)
+            with self._velocity_cond:
+                sent = self._velocity
+            speed, turn = sent
+            future = self.send_command(f"D{int(round(speed * 10))},{int(round(turn))}", await_sending=False)
+            next_time = time.monotonic() + SerialRobot._STREAM_PERIOD
+
+    def wait_settled(self, index: int, after_seq: int, tolerance: float, timeout: float,
+                     target: float | None = None, future: CommandFuture | None = None, min_time: float = 0) -> bool:
+        """
+        Ждёт, пока telemetry[index] не установится: SETTLE_SAMPLES пакетов подряд, пришедших после after_seq,
+        отличаются не больше чем на tolerance (и от target, если задан)
+        :param future: команда, которая двигает это значение; если плата подтвердила её выполнение раньше,
+                       ожидание заканчивается по подтверждению
+        :param min_time: пакеты, пришедшие раньше, чем через столько секунд после вызова, не учитываются
+        :return: True, если значение установилось или команда выполнена; False, если вышел таймаут
+        """
+        not_before = time.time() + min_time
+        deadline = time.monotonic() + timeout
+        seq = after_seq
+        values = []
+        while True:
+            if future is not None and future.done():
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            # с future проверяется и подтверждение, даже если телеметрии нет
+            new_seq = self.wait_telemetry(seq, remaining if future is None else min(remaining, 0.05))
+            if new_seq == seq:
+                continue
+            records = self.telemetry_since(seq)
+            values.extend(records["values"][records["time"] >= not_before, index].tolist())
+            seq = new_seq
+            last = values[-SerialRobot.SETTLE_SAMPLES:]
+            if len(last) < SerialRobot.SETTLE_SAMPLES or max(last) - min(last) > tolerance:
+                continue
+            if target is None or all(abs(v - target) <= tolerance for v in last):
+                return True
+
     def reset_position(self):
         self.send_command("N")
 
@@ -354,7 +612,18 @@ class SerialRobot:
         self.send_command(f"Q{millis}")
 
     def set_hand_angle(self, degrees: int):
-        self.send_command(f"S{degrees}", await_completion=self.hand_angle != degrees)    # OK не приходит, если отправлен тот же угол
+        """
+        Поворачивает руку и ждёт 'OK' или, если его нет, пока угол в телеметрии (telemetry[5]) не установится
+        на degrees; не дольше HAND_TIMEOUT
+        """
+        moving = self.hand_angle != degrees     # OK не приходит, если отправлен тот же угол
+        seq = self.telemetry_seq
+        future = self.send_command(f"S{degrees}", required_confirmations=int(moving))
+        if not moving:
+            return
+        if not self.wait_settled(5, seq, SerialRobot.HAND_TOLERANCE, SerialRobot.HAND_TIMEOUT, target=degrees,
+                                 future=future):
+            print(f"Hand did not reach {degrees} in {SerialRobot.HAND_TIMEOUT} s")
 
     def switch_rangefinder(self, direction: int, force: bool = False):
         """
@@ -367,17 +636,27 @@ class SerialRobot:
 
         angle = SerialRobot._RANGEFINDER_ANGLES[direction]
         self._rangefinder_direction = direction
+        seq = self.telemetry_seq
         self.send_command(f"Y{angle}")
 
-        time.sleep(0.8)   # подтверждение выполнения на эту команду не работает, поэтому просто задержкой
+        # подтверждение выполнения на эту команду не работает: ждём, пока показания дальномера не перестанут
+        # меняться после поворота
+        self.wait_settled(0, seq, SerialRobot.RANGEFINDER_TOLERANCE, SerialRobot.RANGEFINDER_TIMEOUT,
+                          min_time=SerialRobot.RANGEFINDER_MIN_TIME)
 
     def set_light(self, enabled: bool):
         self.send_command(f"B{int(enabled)}")
 
     def release(self):
+        self.stop_streaming()
         self.set_hand_angle(125)
         self.reset_position()
         self._on_releasing.set()
+        self._command_queue.put(None)
+        self._event_queue.put(None)
+        self._watcher.join(1)
+        self._watcher_control.unlink()
+        self._shared_telemetry.unlink()
 
 
 if __name__ == "__main__":
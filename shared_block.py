@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import ctypes
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+
+def shared_ndarray(shared_memory: SharedMemory, shape, dtype, offset: int = 0) -> np.ndarray:
+    """
+    Массив numpy поверх SharedMemory. В отличие от np.ndarray(buffer=shared_memory.buf) не мешает
+    SharedMemory закрыться при сборке мусора, поэтому ссылку на shared_memory нужно держать, пока жив массив
+    """
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape)) * dtype.itemsize
+    address = ctypes.addressof(ctypes.c_char.from_buffer(shared_memory.buf)) + offset
+    return np.ndarray(shape, dtype, (ctypes.c_char * size).from_address(address))
+
+
+class SharedStruct(ctypes.Structure):
+    """
+    Структура ctypes фиксированной раскладки, лежащая в SharedMemory.
+    Поля читаются и пишутся напрямую в общей памяти, без процесса-менеджера и сокетов.
+
+    Подкласс добавляет свои поля в _fields_, поле seq задаёт базовый класс.
+    Одиночные поля до 8 байт читаются и пишутся атомарно, для согласованной записи нескольких полей
+    (координаты, текст) есть write/read: seq-lock, у группы полей должен быть один писатель.
+
+    При передаче в другой процесс через pickle (spawn) структура подключается к той же памяти по имени,
+    при fork просто наследуется.
+    """
+
+    _fields_ = [("seq", ctypes.c_uint32)]
+
+    _shared_memory: SharedMemory
+
+    @classmethod
+    def create(cls):
+        shared_memory = SharedMemory(create=True, size=ctypes.sizeof(cls))
+        return cls._from_shared_memory(shared_memory)
+
+    @classmethod
+    def attach(cls, name: str):
+        return cls._from_shared_memory(SharedMemory(name))
+
+    @classmethod
+    def _from_shared_memory(cls, shared_memory: SharedMemory):
+        # from_address, а не from_buffer: иначе SharedMemory не сможет закрыться при сборке мусора.
+        # Память живёт, пока жива ссылка на shared_memory в самой структуре
+        address = ctypes.addressof(ctypes.c_char.from_buffer(shared_memory.buf))
+        instance = cls.from_address(address)
+        instance._shared_memory = shared_memory
+        return instance
+
+    def __reduce__(self):
+        return self.__class__.attach, (self._shared_memory.name, )
+
+    @property
+    def name(self) -> str:
+        return self._shared_memory.name
+
+    def unlink(self):
+        """
+        Удаляет сегмент общей памяти. Вызывает процесс, который его создал, при освобождении
+        """
+        self._shared_memory.unlink()
+
+    def write(self, **values):
+        self.seq += 1       # нечётный seq - идёт запись
+        for field, value in values.items():
+            setattr(self, field, value)
+        self.seq += 1
+
+    def read(self, *fields) -> tuple:
+        while True:
+            seq = self.seq
+            if seq & 1:
+                continue
+            result = tuple(getattr(self, field) for field in fields)
+            if self.seq == seq:
+                return result
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+import re
+import time
+import struct
+import multiprocessing
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from shared_block import shared_ndarray
+
+TELEMETRY_LEN = 7
+
+# Бинарный кадр телеметрии, little-endian:
+#   0xA5 | seq: uint8 | 7 x int16 | crc8 (полином 0x07 по байтам seq..последнее значение)
+FRAME_SYNC = 0xA5
+FRAME_DTYPE = np.dtype([
+    ("sync", "u1"),
+    ("seq", "u1"),
+    ("values", "<i2", (TELEMETRY_LEN, )),
+    ("crc", "u1"),
+])
+FRAME_SIZE = FRAME_DTYPE.itemsize
+_FRAME_STRUCT = struct.Struct(f"<BB{TELEMETRY_LEN}hB")
+
+_BULK_MIN_FRAMES = 8    # меньше кадров выгоднее разобрать struct'ом, чем платить за вызовы numpy
+
+_PRINTABLE_TAIL = re.compile(rb"[\x20-\x7e\r]*$")     # строки протокола - печатный ASCII
+
+# Запись кольцевого буфера телеметрии: время прихода на хост (time.time), номер, значения
+RECORD_DTYPE = np.dtype([
+    ("time", "<f8"),
+    ("seq", "<u8"),
+    ("values", "<i4", (TELEMETRY_LEN, )),
+])
+
+BINARY_ON_COMMAND = "T1"
+BINARY_OFF_COMMAND = "T0"
+
+
+def _crc8_table(polynomial: int = 0x07) -> np.ndarray:
+    table = np.zeros(256, dtype=np.uint8)
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = ((crc << 1) ^ polynomial if crc & 0x80 else crc << 1) & 0xFF
+        table[i] = crc
+    return table
+
+
+_CRC8_TABLE = _crc8_table()
+_CRC8_LIST = _CRC8_TABLE.tolist()
+
+
+def crc8(data: bytes) -> int:
+    crc = 0
+    for b in data:
+        crc = _CRC8_LIST[crc ^ b]
+    return crc
+
+
+def encode_frame(seq: int, values: list[int]) -> bytes:
+    frame = np.zeros(1, dtype=FRAME_DTYPE)
+    frame["sync"] = FRAME_SYNC
+    frame["seq"] = seq & 0xFF
+    frame["values"] = values
+    data = frame.tobytes()
+    return data[:-1] + bytes((crc8(data[1:-1]), ))
+
+
+def parse_text(line: str) -> list[int] | None:
+    """
+    Разбирает текстовую телеметрию 'n n n n n n n'. None, если строка - не телеметрия или испорчена
+    """
+    splitted = line.split(" ")
+    if not any(splitted):
+        return None
+    result = []
+    for value in splitted:
+        if not value.isdigit():
+            return None
+        result.append(int(value))
+    return result
+
+
+class TelemetryDecoder:
+    """
+    Разбирает поток с платы, в котором текстовые строки ('+cmd', 'OK', текстовая телеметрия)
+    перемешаны с бинарными кадрами телеметрии.
+    Идущие подряд кадры декодируются пачкой через numpy, CRC считается сразу для всей пачки;
+    одиночные кадры, которые приходят между частыми чтениями, разбираются struct'ом.
+    Испорченный кадр отбрасывается, поиск синхробайта продолжается со следующего байта.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self.bad_frames = 0
+
+    def feed(self, data: bytes) -> tuple[list[str], np.ndarray]:
+        """
+        :return: (полные текстовые строки, массив значений целых кадров формы (N, TELEMETRY_LEN))
+        """
+        buffer = self._buffer
+        buffer += data
+
+        lines = []
+        frames = []
+        i = 0
+        n = len(buffer)
+        while i < n:
+            if buffer[i] == FRAME_SYNC:
+                count = 0
+                while i + (count + 1) * FRAME_SIZE <= n and buffer[i + count * FRAME_SIZE] == FRAME_SYNC:
+                    count += 1
+                if count == 0:
+                    break   # кадр пришёл не целиком
+
+                if count < _BULK_MIN_FRAMES:
+                    valid = self._decode_few(buffer, i, count)
+                else:
+                    valid = self._decode_bulk(buffer, i, count)
+                frames.append(valid)
+                if len(valid) == count:
+                    i += count * FRAME_SIZE
+                else:
+                    self.bad_frames += 1
+                    i += len(valid) * FRAME_SIZE + 1
+                continue
+
+            line_end = buffer.find(b"\n", i)
+            sync = buffer.find(FRAME_SYNC, i)
+            if sync != -1 and (line_end == -1 or sync < line_end):
+                i = sync    # обрывок строки перед кадром - мусор
+                continue
+            if line_end == -1:
+                break
+            line = _PRINTABLE_TAIL.search(buffer, i, line_end).group().decode("ascii").strip()
+            if line:
+                lines.append(line)
+            i = line_end + 1
+
+        del buffer[:i]
+        if not frames:
+            return lines, np.empty((0, TELEMETRY_LEN), dtype=np.int16)
+        if len(frames) == 1:
+            return lines, frames[0]
+        return lines, np.concatenate(frames)
+
+    @staticmethod
+    def _decode_few(buffer: bytearray, offset: int, count: int) -> np.ndarray:
+        """
+        Возвращает значения кадров до первого испорченного
+        """
+        result = []
+        for k in range(count):
+            start = offset + k * FRAME_SIZE
+            frame = _FRAME_STRUCT.unpack_from(buffer, start)
+            if crc8(buffer[start + 1:start + FRAME_SIZE - 1]) != frame[-1]:
+                break
+            result.append(frame[2:-1])
+        return np.array(result, dtype=np.int16).reshape(-1, TELEMETRY_LEN)
+
+    @staticmethod
+    def _decode_bulk(buffer: bytearray, offset: int, count: int) -> np.ndarray:
+        """
+        Возвращает значения кадров до первого испорченного
+        """
+        frames = np.frombuffer(buffer, dtype=FRAME_DTYPE, count=count, offset=offset)
+        raw = frames.view(np.uint8).reshape(count, FRAME_SIZE)
+        crc = np.zeros(count, dtype=np.uint8)
+        for column in range(1, FRAME_SIZE - 1):
+            crc = _CRC8_TABLE[crc ^ raw[:, column]]
+        bad = np.flatnonzero(crc != frames["crc"])
+        if len(bad):
+            return frames["values"][:bad[0]].copy()
+        return frames["values"].copy()
+
+
+class TelemetryRing:
+    """
+    Кольцевой буфер телеметрии в общей памяти: последние capacity записей RECORD_DTYPE.
+    Пишет один процесс (обмен с платой), читать и ждать новых записей могут сколько угодно процессов:
+    номер последней записи только растёт, поэтому никто не теряет и не «крадёт» обновления друг у друга.
+
+    Для совместимости с ShareableList индексация ring[i] возвращает i-е значение последней записи.
+    """
+
+    _HEADER_SIZE = 64
+
+    capacity: int
+
+    def __init__(self, capacity: int = 1024, name: str | None = None, condition=None):
+        self.capacity = capacity
+        self._shared_memory = SharedMemory(name, create=name is None,
+                                           size=self._HEADER_SIZE + capacity * RECORD_DTYPE.itemsize)
+        # [0] - номер последней записанной записи, [1] - номер, до которого писатель уже начал перезаписывать
+        self._header = shared_ndarray(self._shared_memory, (2, ), np.uint64)
+        self._records = shared_ndarray(self._shared_memory, (capacity, ), RECORD_DTYPE, offset=self._HEADER_SIZE)
+        self._condition = condition if condition is not None else multiprocessing.Condition()
+
+    def __reduce__(self):
+        return self.__class__, (self.capacity, self._shared_memory.name, self._condition)
+
+    def __getitem__(self, index: int) -> int:
+        return int(self._records["values"][int(self._header[0]) % self.capacity][index])
+
+    def __len__(self) -> int:
+        return TELEMETRY_LEN
+
+    def unlink(self):
+        self._shared_memory.unlink()
+
+    @property
+    def seq(self) -> int:
+        """
+        Номер последней записи, 0 - записей ещё не было
+        """
+        return int(self._header[0])
+
+    def append(self, values, t: float | None = None):
+        """
+        Дописывает одну или несколько записей и будит всех ожидающих
+        :param values: значения одной записи или массив (N, TELEMETRY_LEN)
+        :param t: время прихода, по умолчанию - сейчас
+        """
+        values = np.asarray(values).reshape(-1, TELEMETRY_LEN)
+        head = int(self._header[0]) + len(values)
+        values = values[-self.capacity:]
+        seqs = np.arange(head - len(values) + 1, head + 1, dtype=np.uint64)
+        slots = seqs % self.capacity
+
+        self._header[1] = seqs[-1]
+        records = self._records
+        records["time"][slots] = time.time() if t is None else t
+        records["values"][slots] = values
+        records["seq"][slots] = seqs
+        self._header[0] = seqs[-1]
+
+        with self._condition:
+            self._condition.notify_all()
+
+    def latest(self) -> list[int]:
+        return self._records["values"][int(self._header[0]) % self.capacity].tolist()
+
+    def since(self, seq: int) -> np.ndarray:
+        """
+        Записи с номером больше seq, которые ещё есть в буфере (копия)
+        """
+        head = int(self._header[0])
+        start = max(seq + 1, head - self.capacity + 1, 1)
+        if start > head:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        seqs = np.arange(start, head + 1, dtype=np.uint64)
+        result = self._records[seqs % self.capacity]
+
+        # писатель мог успеть перезаписать самые старые из скопированных записей
+        overwritten = int(self._header[1]) - self.capacity
+        valid = (result["seq"] == seqs) & (seqs > overwritten)
+        return result[valid]
+
+    def window(self, seconds: float) -> np.ndarray:
+        """
+        Записи, пришедшие за последние seconds секунд
+        """
+        records = self.since(0)
+        return records[records["time"] >= time.time() - seconds]
+
+    def wait(self, after_seq: int, timeout: float | None = None) -> int:
+        """
+        Ждёт записи с номером больше after_seq
+        :return: номер последней записи; равен after_seq, если вышел таймаут
+        """
+        if int(self._header[0]) > after_seq:
+            return int(self._header[0])
+        with self._condition:
+            self._condition.wait_for(lambda: int(self._header[0]) > after_seq, timeout)
+        return int(self._header[0])
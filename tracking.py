@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+import math
+
+import cv2
+import numpy as np
+
+import grab_helper
+
+
+class Track:
+    """
+    Результат CubeTracker.update для одного кадра
+    """
+
+    x: int | None
+    y: int | None
+    rotated: bool | None
+    confidence: float       # 0 - куба нет, 1 - уверенно видим несколько кадров подряд
+    detected: bool          # куб найден на этом кадре; иначе x, y - предсказание
+    full_search: bool       # искали по всей области, а не в окне вокруг предсказания
+    box: tuple[int, int, int, int] | None   # описанный прямоугольник (x, y, w, h), если куб найден на этом кадре
+
+    def __init__(self, x, y, rotated, confidence: float, detected: bool, full_search: bool, box=None):
+        self.x = x
+        self.y = y
+        self.rotated = rotated
+        self.confidence = confidence
+        self.detected = detected
+        self.full_search = full_search
+        self.box = box
+
+    @property
+    def lost(self) -> bool:
+        return self.x is None
+
+
+class CubeTracker:
+    """
+    Сопровождение куба между кадрами: find_cube ищет только в окне вокруг положения, предсказанного
+    фильтром Калмана (постоянная скорость в пикселях), и только при потере цели - во всей области.
+
+    Уверенность растёт с каждым найденным кадром и падает с каждым пропуском. Пока она выше
+    min_confidence, пропуск кадра не считается потерей: update возвращает предсказанное положение.
+    """
+
+    def __init__(self,
+                 color: str,
+                 area: tuple[tuple[int, int], tuple[int, int]],
+                 window: int = 200,
+                 window_sigmas: float = 3,
+                 process_noise: float = 2000,
+                 measurement_noise: float = 4,
+                 confidence_gain: float = 0.34,
+                 confidence_decay: float = 0.5,
+                 min_confidence: float = 0.2):
+        """
+        :param color: цвет куба, ключ grab_helper.COLORS
+        :param area: вся область поиска, как для find_cube
+        :param window: половина стороны окна поиска, пикселей; куб размера CUBE_MAX_AREA должен помещаться
+        :param window_sigmas: окно расширяется на столько стандартных отклонений ошибки предсказания
+        :param process_noise: дисперсия ускорения, пикселей^2/с^3
+        :param measurement_noise: дисперсия измерения центра, пикселей^2
+        :param confidence_gain: прибавка уверенности за найденный кадр
+        :param confidence_decay: множитель уверенности за пропущенный кадр
+        :param min_confidence: ниже этого цель считается потерянной
+        """
+        self.color = color
+        self.area = area
+        self.window = window
+        self.window_sigmas = window_sigmas
+        self.process_noise = process_noise
+        self.confidence_gain = confidence_gain
+        self.confidence_decay = confidence_decay
+        self.min_confidence = min_confidence
+
+        self._kalman = cv2.KalmanFilter(4, 2)
+        self._kalman.measurementMatrix = np.array([[1, 0, 0, 0], [0, 1, 0, 0]], dtype=np.float32)
+        self._kalman.measurementNoiseCov = np.eye(2, dtype=np.float32) * measurement_noise
+        self.reset()
+
+    def reset(self):
+        self.confidence = 0.0
+        self._rotated = None
+        self._last_time = None
+
+    @property
+    def tracking(self) -> bool:
+        return self.confidence >= self.min_confidence
+
+    def notify_motion(self, pixels: float = 100):
+        """
+        Робот сдвинулся: скорость цели в кадре больше не предсказуема, окно поиска расширяется
+        """
+        if self.tracking:
+            self._kalman.errorCovPost[:2, :2] += np.eye(2, dtype=np.float32) * pixels ** 2
+            self._kalman.statePost[2:] = 0
+
+    def _start(self, x: int, y: int, t: float):
+        self._kalman.statePost = np.array([[x], [y], [0], [0]], dtype=np.float32)
+        self._kalman.errorCovPost = np.diag([10, 10, 1000, 1000]).astype(np.float32)
+        self._last_time = t
+
+    def _predict(self, t: float) -> tuple[float, float]:
+        dt = max(t - self._last_time, 1e-3)
+        self._last_time = t
+        kalman = self._kalman
+        kalman.transitionMatrix = np.array([[1, 0, dt, 0],
+                                            [0, 1, 0, dt],
+                                            [0, 0, 1, 0],
+                                            [0, 0, 0, 1]], dtype=np.float32)
+        # белый шум ускорения
+        q = self.process_noise
+        kalman.processNoiseCov = np.array([[dt ** 3 / 3, 0, dt ** 2 / 2, 0],
+                                           [0, dt ** 3 / 3, 0, dt ** 2 / 2],
+                                           [dt ** 2 / 2, 0, dt, 0],
+                                           [0, dt ** 2 / 2, 0, dt]], dtype=np.float32) * q
+        prediction = kalman.predict()
+        return float(prediction[0, 0]), float(prediction[1, 0])
+
+    def search_window(self, x: float, y: float) -> tuple[tuple[int, int], tuple[int, int]]:
+        covariance = self._kalman.errorCovPre
+        half_x = self.window + self.window_sigmas * math.sqrt(max(float(covariance[0, 0]), 0))
+        half_y = self.window + self.window_sigmas * math.sqrt(max(float(covariance[1, 1]), 0))
+        (min_x, max_x), (min_y, max_y) = self.area
+        return ((int(max(min_x, x - half_x)), int(min(max_x, x + half_x))),
+                (int(max(min_y, y - half_y)), int(min(max_y, y + half_y))))
+
+    def update(self, frame, t: float) -> Track:
+        """
+        :param frame: кадр камеры (frame_ring.Frame или recording.ReplayFrame)
+        :param t: время кадра
+        """
+        if self.tracking:
+            px, py = self._predict(t)
+            window = self.search_window(px, py)
+            cx, cy, rotated, box = grab_helper.find_cube_box(frame.ensure_hsv(window), window, self.color)
+            full_search = False
+        else:
+            cx, cy, rotated, box = grab_helper.find_cube_box(frame.ensure_hsv(self.area), self.area, self.color)
+            full_search = True
+
+        if cx is not None:
+            if full_search:
+                self._start(cx, cy, t)
+            else:
+                self._kalman.correct(np.array([[cx], [cy]], dtype=np.float32))
+            self.confidence = min(1.0, self.confidence + self.confidence_gain)
+            self._rotated = rotated
+            return Track(cx, cy, rotated, self.confidence, True, full_search, box)
+
+        if full_search:
+            self.confidence = 0.0
+            return Track(None, None, None, 0.0, False, True)
+
+        self.confidence *= self.confidence_decay
+        if not self.tracking:
+            self.confidence = 0.0
+            return Track(None, None, None, 0.0, False, False)
+
+        # пропуск одного кадра - не потеря: отдаём предсказание
+        self._kalman.statePost = self._kalman.statePre.copy()
+        self._kalman.errorCovPost = self._kalman.errorCovPre.copy()
+        return Track(int(px), int(py), self._rotated, self.confidence, False, False)
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+Распознавание кубов в отдельных процессах: процессы берут кадры из FrameRing камеры и пишут результаты
+в таблицу в общей памяти, BTDriver только читает последний результат.
+
+    worker = camera.start_vision_worker(("blue", "black"), area)
+    for detection in worker.results("blue", timeout=2):
+        ...
+        worker.notify_motion()      # перед командой, которая двигает робота
+"""
+import ctypes
+import multiprocessing
+import os
+import time
+
+from shared_block import SharedStruct
+from frame_ring import FrameRing, Area
+from tracking import CubeTracker
+
+
+class DetectionBlock(SharedStruct):
+    """
+    Последний результат одного цвета. Пишет только процесс, которому достался этот цвет
+    """
+    _fields_ = [
+        ("generation", ctypes.c_int64),     # кадр, по которому получен результат; 0 - ещё не было
+        ("time", ctypes.c_double),          # время захвата этого кадра
+        ("detected", ctypes.c_bool),        # куб найден на этом кадре; иначе x, y - предсказание
+        ("rotated", ctypes.c_bool),
+        ("x", ctypes.c_int32),              # -1 - куба нет
+        ("y", ctypes.c_int32),
+        ("box_x", ctypes.c_int32),
+        ("box_y", ctypes.c_int32),
+        ("box_w", ctypes.c_int32),          # 0 - прямоугольника нет (куб не найден на этом кадре)
+        ("box_h", ctypes.c_int32),
+        ("confidence", ctypes.c_float),
+    ]
+
+
+class VisionControl(SharedStruct):
+    _fields_ = [
+        ("is_releasing", ctypes.c_bool),
+        ("motion", ctypes.c_uint32),        # растёт с каждым notify_motion
+    ]
+
+
+class Detection:
+    """
+    Результат распознавания одного цвета на одном кадре
+    """
+
+    color: str
+    generation: int
+    time: float
+    x: int | None
+    y: int | None
+    rotated: bool | None
+    box: tuple[int, int, int, int] | None
+    confidence: float
+    detected: bool
+
+    def __init__(self, color: str, generation: int, time: float, x, y, rotated, box, confidence: float,
+                 detected: bool):
+        self.color = color
+        self.generation = generation
+        self.time = time
+        self.x = x
+        self.y = y
+        self.rotated = rotated
+        self.box = box
+        self.confidence = confidence
+        self.detected = detected
+
+    @property
+    def lost(self) -> bool:
+        return self.x is None
+
+
+class VisionWorker:
+    """
+    Пул процессов распознавания: цвета делятся между процессами, каждый процесс сопровождает свои кубы
+    tracking.CubeTracker на каждом новом кадре, пока успевает, и публикует результат с поколением кадра.
+    Область area конвертируется в HSV камерой, пока работает пул.
+    """
+
+    def __init__(self, frames: FrameRing, colors: tuple[str, ...], area: Area, processes: int | None = None):
+        """
+        :param colors: цвета кубов, ключи grab_helper.COLORS
+        :param area: область поиска, как для find_cube
+        :param processes: число процессов, по умолчанию по одному на цвет, но не больше числа ядер без двух
+                          (захват и сам драйвер)
+        """
+        self.colors = tuple(colors)
+        self.area = area
+        if processes is None:
+            processes = max(1, min(len(self.colors), (os.cpu_count() or 1) - 2))
+
+        self._control = VisionControl.create()
+        self._blocks = {color: DetectionBlock.create() for color in self.colors}
+        self._result_ready = multiprocessing.Condition()
+        self._processes = []
+        for i in range(processes):
+            process = multiprocessing.Process(target=VisionWorker.worker_loop, args=(
+                frames,
+                area,
+                {color: self._blocks[color] for color in self.colors[i::processes]},
+                self._control,
+                self._result_ready,
+            ))
+            process.start()
+            self._processes.append(process)
+
+    @staticmethod
+    def worker_loop(frames: FrameRing,
+                    area: Area,
+                    blocks: dict[str, DetectionBlock],
+                    control: VisionControl,
+                    result_ready):
+        trackers = {color: CubeTracker(color, area) for color in blocks}
+        roi = frames.register_roi(area)
+        generation = 0
+        motion = control.motion
+        try:
+            while not control.is_releasing:
+                frame = frames.pin_after(generation, 0.5)
+                if frame is None:
+                    continue
+                if control.motion != motion:
+                    motion = control.motion
+                    for tracker in trackers.values():
+                        tracker.notify_motion()
+
+                with frame:
+                    generation = frame.generation
+                    for color, tracker in trackers.items():
+                        track = tracker.update(frame, frame.time)
+                        box = track.box or (0, 0, 0, 0)
+                        blocks[color].write(generation=generation, time=frame.time, detected=track.detected,
+                                            rotated=bool(track.rotated), x=-1 if track.lost else track.x,
+                                            y=-1 if track.lost else track.y, box_x=box[0], box_y=box[1],
+                                            box_w=box[2], box_h=box[3], confidence=track.confidence)
+                with result_ready:
+                    result_ready.notify_all()
+        finally:
+            frames.unregister_roi(roi)
+
+    def latest(self, color: str) -> Detection:
+        """
+        Последний результат цвета без ожидания; generation 0 - результатов ещё не было
+        """
+        values = self._blocks[color].read("generation", "time", "detected", "rotated", "x", "y",
+                                          "box_x", "box_y", "box_w", "box_h", "confidence")
+        generation, t, detected, rotated, x, y, box_x, box_y, box_w, box_h, confidence = values
+        if x == -1:
+            return Detection(color, generation, t, None, None, None, None, 0.0, False)
+        box = (box_x, box_y, box_w, box_h) if box_w else None
+        return Detection(color, generation, t, x, y, rotated, box, confidence, detected)
+
+    def wait(self, color: str, after_generation: int, timeout: float | None = None) -> Detection | None:
+        """
+        Ждёт результата по кадру новее after_generation
+        :return: результат или None, если вышел таймаут
+        """
+        block = self._blocks[color]
+        with self._result_ready:
+            if not self._result_ready.wait_for(lambda: block.generation > after_generation, timeout):
+                return None
+        return self.latest(color)
+
+    def results(self, color: str, timeout: float | None = None, after_generation: int | None = None):
+        """
+        Перебирает новые результаты цвета, как Camera.frames - кадры
+        :param timeout: сколько ждать результата; если вышел, генератор бросает TimeoutError
+        """
+        generation = self.latest(color).generation if after_generation is None else after_generation
+        while True:
+            detection = self.wait(color, generation, timeout)
+            if detection is None:
+                raise TimeoutError(f"No {color} detections for {timeout} s")
+            yield detection
+            generation = detection.generation
+
+    def notify_motion(self):
+        """
+        Робот начинает двигаться: см. CubeTracker.notify_motion
+        """
+        self._control.motion += 1
+
+    def release(self):
+        self._control.is_releasing = True
+        for process in self._processes:
+            process.join(1)
+        self._control.unlink()
+        for block in self._blocks.values():
+            block.unlink()
+
+
+class InlineVision:
+    """
+    Интерфейс VisionWorker без отдельных процессов: кадр распознаётся в вызывающем процессе, когда запрошен
+    результат. Для камер без FrameRing (recording.ReplayCamera)
+    """
+
+    def __init__(self, camera, colors: tuple[str, ...], area: Area):
+        self.camera = camera
+        self.colors = tuple(colors)
+        self.area = area
+        self._trackers = {color: CubeTracker(color, area) for color in self.colors}
+        self._latest = {color: Detection(color, 0, 0.0, None, None, None, None, 0.0, False) for color in self.colors}
+
+    def _process(self, frame) -> dict[str, Detection]:
+        for color, tracker in self._trackers.items():
+            track = tracker.update(frame, frame.time)
+            self._latest[color] = Detection(color, frame.generation, frame.time, track.x, track.y, track.rotated,
+                                            track.box, track.confidence, track.detected)
+        return self._latest
+
+    def latest(self, color: str) -> Detection:
+        generation = self.camera.frame_generation
+        if self._latest[color].generation < generation:
+            with self.camera.latest_frame() as frame:
+                self._process(frame)
+        return self._latest[color]
+
+    def wait(self, color: str, after_generation: int, timeout: float | None = None) -> Detection | None:
+        if self._latest[color].generation > after_generation:
+            return self._latest[color]
+        frame = self.camera.wait_for_frame(after_generation, timeout)
+        if frame is None:
+            return None
+        with frame:
+            return self._process(frame)[color]
+
+    def results(self, color: str, timeout: float | None = None, after_generation: int | None = None):
+        generation = self.camera.frame_generation if after_generation is None else after_generation
+        while True:
+            detection = self.wait(color, generation, timeout)
+            if detection is None:
+                raise TimeoutError(f"No {color} detections for {timeout} s")
+            yield detection
+            generation = detection.generation
+
+    def notify_motion(self):
+        for tracker in self._trackers.values():
+            tracker.notify_motion()
+
+    def release(self):
+        pass
+
+
+def test():
+    import cv2
+    import numpy as np
+
+    import grab_helper
+
+    image = cv2.imread("test_images/grabber/yellow.png")
+    area = grab_helper.get_area(image.shape[1], image.shape[0], grab_helper.CUBE_FIND_AREA)
+    expected = grab_helper.find_cube_box(cv2.cvtColor(image, cv2.COLOR_BGR2HSV), area, "yellow")
+
+    frames = FrameRing(image.shape, 4)
+    worker = VisionWorker(frames, ("yellow", "blue", "green"), area, processes=2)
+    try:
+        slot = frames.begin_write()
+        np.copyto(frames.images[slot], image)
+        frames.write_hsv(slot, image)
+        frames.publish(slot, time.time())
+
+        yellow = worker.wait("yellow", 0, 5)
+        assert (yellow.x, yellow.y, yellow.rotated, yellow.box) == expected, (vars(yellow), expected)
+        assert yellow.detected and yellow.generation == 1
+        blue = worker.wait("blue", 0, 5)
+        assert blue.lost and blue.generation == 1
+        print(vars(yellow))
+    finally:
+        worker.release()
+        frames.unlink()
+
+
+if __name__ == "__main__":
+    test()